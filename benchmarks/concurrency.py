@@ -0,0 +1,82 @@
+"""Hammers one shared E621 client from many threads against the local fake e621 and checks that nothing races
+
+Every thread mixes searches, gets, users.me and the lazily fetched properties of posts and pools.
+The run fails if any request fails, if users.me or a lazy property is fetched more than once,
+or if more connections are opened than the pool allows.
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+import typer
+
+from e621.fakeserver import FakeE621Server
+
+app = typer.Typer(add_completion=False)
+
+
+def stress(threads: int, operations: int, pool_size: int, latency: float = 0.005) -> Dict[str, float]:
+    """Runs operations mixed operations on each of threads threads and returns what was measured"""
+    with FakeE621Server(post_count=5000, entity_count=500, latency=latency) as server:
+        api = server.api(auth=("stress", "key"), pool_size=pool_size)
+        start_line = threading.Barrier(threads)
+        shared_post = api.posts.get(4000)
+        # The fake server's posts have no parents of their own, and a missing parent is never fetched
+        shared_post.relationships.parent_id = 3999
+        shared_pool = api.pools.get(1)
+
+        def worker(index: int) -> List[object]:
+            seen = []
+            # All of the threads ask for the lazy properties at the same moment
+            start_line.wait()
+            seen += [api.users.me, shared_post.parent, shared_pool.posts]
+            for i in range(operations):
+                kind = (index + i) % 4
+                if kind == 0:
+                    api.posts.search(f"tag_{i % 50}", limit=20)
+                elif kind == 1:
+                    api.posts.get(1 + (index * operations + i) % 5000)
+                elif kind == 2:
+                    api.tags.search(name_matches="tag_*", limit=10)
+                else:
+                    seen.append(api.users.me)
+            return seen
+
+        requests_before = server.requests_served
+        start = time.perf_counter()
+        with ThreadPoolExecutor(threads) as executor:
+            results = list(executor.map(worker, range(threads)))
+        seconds = time.perf_counter() - start
+        requests = server.requests_served - requests_before
+
+    distinct_lazy_values = max(len({id(seen[i]) for seen in results}) for i in range(3))
+    distinct_me = len({id(value) for seen in results for value in seen[3:]} | {id(results[0][0])})
+    if distinct_lazy_values != 1 or distinct_me != 1:
+        raise AssertionError(f"A lazy property was fetched more than once: {distinct_lazy_values}, {distinct_me}")
+    # With fewer connections than threads, the threads that find the pool empty open extra ones that are then closed.
+    # The two gets before the threads start may open a connection of their own
+    if threads <= pool_size and server.connections_opened > pool_size + 1:
+        raise AssertionError(f"{server.connections_opened} connections were opened for a pool of {pool_size}")
+    return {
+        "requests_per_second": requests / seconds,
+        "connections": server.connections_opened,
+        "requests": requests,
+    }
+
+
+@app.command()
+def main(
+    threads: int = typer.Option(32, help="threads sharing the client"),
+    operations: int = typer.Option(50, help="operations per thread"),
+    pool_size: int = typer.Option(32, help="connections kept open by the client"),
+):
+    result = stress(threads, operations, pool_size)
+    print(f"threads:               {threads}")
+    print(f"requests:              {result['requests']:.0f}")
+    print(f"requests per second:   {result['requests_per_second']:.0f}")
+    print(f"connections opened:    {result['connections']:.0f} (pool_size {pool_size})")
+
+
+if __name__ == "__main__":
+    app()
@@ -0,0 +1,75 @@
+"""Latency and throughput of the default HTTP/1.1 connection pool and of http2.Http2Adapter against the local fake e621
+
+Latency is the median of sequential gets, throughput the requests per second of many threads sharing one client.
+The fake e621 is a plain http:// server that only speaks HTTP/1.1, so here Http2Adapter falls back to HTTP/1.1
+and the run measures what the adapter costs on top of httpx. The gains of multiplexing need a real HTTP/2 server.
+The Http2Adapter runs are skipped if httpx or h2 isn't installed.
+"""
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Optional
+
+import typer
+from requests.adapters import BaseAdapter
+
+from e621.fakeserver import FakeE621Server
+
+app = typer.Typer(add_completion=False)
+
+
+def transports() -> Dict[str, Callable[[], Optional[BaseAdapter]]]:
+    """The transports to compare, by name. None is the default connection pool of SimpleSession"""
+    result: Dict[str, Callable[[], Optional[BaseAdapter]]] = {"http1": lambda: None}
+    try:
+        import h2  # noqa: F401
+        import httpx  # noqa: F401
+    except ImportError:
+        return result
+    from e621.http2 import Http2Adapter
+
+    result["http2"] = lambda: Http2Adapter(max_connections=16)
+    return result
+
+
+def measure(threads: int, requests_per_thread: int, latency: float) -> Dict[str, Dict[str, float]]:
+    results = {}
+    with FakeE621Server(post_count=2000, entity_count=100, latency=latency) as server:
+        for name, create in transports().items():
+            api = server.api(transport=create(), pool_size=threads)
+            api.posts.get(1)
+            timings = []
+            for i in range(50):
+                start = time.perf_counter()
+                api.posts.get(1 + i)
+                timings.append(time.perf_counter() - start)
+
+            def worker(index: int) -> None:
+                for i in range(requests_per_thread):
+                    api.posts.search(f"tag_{(index + i) % 50}", limit=20)
+
+            start = time.perf_counter()
+            with ThreadPoolExecutor(threads) as executor:
+                list(executor.map(worker, range(threads)))
+            seconds = time.perf_counter() - start
+            results[name] = {
+                "median_latency_ms": statistics.median(timings) * 1000,
+                "requests_per_second": threads * requests_per_thread / seconds,
+            }
+            api.session.close()
+    return results
+
+
+@app.command()
+def main(
+    threads: int = typer.Option(16, help="threads sharing the client"),
+    requests_per_thread: int = typer.Option(50, help="searches made by every thread"),
+    latency: float = typer.Option(0.005, help="seconds the fake e621 waits before every response"),
+):
+    for name, result in measure(threads, requests_per_thread, latency).items():
+        print(f"{name:<6} median latency {result['median_latency_ms']:8.2f} ms")
+        print(f"{name:<6} throughput     {result['requests_per_second']:8.0f} req/s")
+
+
+if __name__ == "__main__":
+    app()
@@ -0,0 +1,47 @@
+"""Measures how many requests query multiplexing saves for a typical set of saved searches"""
+import random
+
+import typer
+
+from e621.multiplex import plan_queries
+
+app = typer.Typer(add_completion=False)
+
+SPECIES = ["fox", "wolf", "cat", "dragon", "rabbit", "dog", "deer", "horse", "lion", "tiger", "otter", "raccoon"]
+MODIFIERS = ["male", "female", "solo", "duo", "group", "feral", "anthro", "smile", "sitting", "standing"]
+ARTISTS = [f"artist_{i}" for i in range(40)]
+EXCLUSIONS = ["-3d", "-comic", "-sketch"]
+
+
+def subscription_set(size: int, seed: int) -> dict:
+    """Mostly "<species> <modifier>" searches with some shared exclusions, artists and metatags mixed in"""
+    rng = random.Random(seed)
+    queries = {}
+    while len(queries) < size:
+        kind = rng.random()
+        if kind < 0.6:
+            tags = [rng.choice(SPECIES), rng.choice(MODIFIERS)]
+        elif kind < 0.75:
+            tags = [rng.choice(SPECIES), rng.choice(MODIFIERS), rng.choice(EXCLUSIONS)]
+        elif kind < 0.9:
+            tags = [rng.choice(ARTISTS)]
+        else:
+            tags = [rng.choice(SPECIES), "order:score", f"score:>{rng.randrange(50, 500, 50)}"]
+        if rng.random() < 0.2:
+            tags.append("rating:s")
+        queries[" ".join(tags)] = tags
+    return queries
+
+
+@app.command()
+def main(size: int = 300, seed: int = 621, tag_limit: int = 40):
+    plan = plan_queries(subscription_set(size, seed), tag_limit)
+    saved = plan.query_count - plan.request_count
+    print(f"saved searches:         {plan.query_count}")
+    print(f"requests per poll:      {plan.request_count}")
+    print(f"reduction:              {saved} requests ({saved / plan.query_count:.1%})")
+    print(f"largest merged query:   {max(len(m.members) for m in plan.merged)} searches")
+
+
+if __name__ == "__main__":
+    app()
@@ -0,0 +1,453 @@
+"""Benchmarks for the hot paths of the client, run offline against fixture JSON and the local fake e621
+
+python benchmarks/suite.py run                 # Runs everything and prints the results
+python benchmarks/suite.py run --only parse    # Runs the benchmarks whose names start with "parse"
+python benchmarks/suite.py save                # Stores the results as the new baselines
+python benchmarks/suite.py compare             # Fails if anything got slower than the baselines allow
+
+The parse benchmarks run once per model backend that the installed pydantic supports, see base_model.BACKEND.
+"""
+import functools
+import gc
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+import pydantic
+import requests
+import typer
+
+from e621 import E621
+from e621.fakeserver import FakeE621Server, synthesize_post
+from e621.models import BlackList, Post
+
+app = typer.Typer(add_completion=False)
+
+BASELINES_PATH = Path(__file__).with_name("baselines.json")
+
+
+@dataclass
+class Result:
+    value: float
+    unit: str
+    higher_is_better: bool
+
+
+Benchmark = Callable[[], Dict[str, Result]]
+BENCHMARKS: Dict[str, Benchmark] = {}
+
+
+def benchmark(name: str) -> Callable[[Benchmark], Benchmark]:
+    def register(function: Benchmark) -> Benchmark:
+        BENCHMARKS[name] = function
+        return function
+
+    return register
+
+
+def best_of(function: Callable[[], object], repeat: int = 5) -> float:
+    """The fastest of several runs, which is the one least disturbed by everything else on the machine"""
+    times = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+@functools.lru_cache(maxsize=None)
+def fixture_posts(count: int) -> List[dict]:
+    """Synthetic raw posts. Shared between benchmarks, so never modify them"""
+    return [synthesize_post(i, max_id=count) for i in range(count, 0, -1)]
+
+
+def json_response(body: object) -> requests.Response:
+    response = requests.Response()
+    response.status_code = 200
+    response._content = json.dumps(body).encode()
+    response.encoding = "utf-8"
+    return response
+
+
+def measure_parsing() -> Dict[str, Result]:
+    api = E621()
+    raw = fixture_posts(10000)
+    from_list = best_of(lambda: Post.from_list(raw, api))
+    response = json_response({"posts": fixture_posts(320)})
+    from_response = best_of(lambda: Post.from_response(response, api, expect=list), repeat=20)
+    return {
+        "from_list.posts_per_second": Result(len(raw) / from_list, "posts/s", True),
+        "from_response.pages_per_second": Result(1 / from_response, "pages/s", True),
+    }
+
+
+@benchmark("parse")
+def parse() -> Dict[str, Result]:
+    """Parse throughput of every model backend the installed pydantic supports, each in a process of its own"""
+    backends = ["v1", "v2"] if pydantic.VERSION.startswith("2.") else ["v1"]
+    results = {}
+    for backend in backends:
+        env = {**os.environ, "E621_MODEL_BACKEND": backend}
+        output = subprocess.check_output([sys.executable, __file__, "parse-worker"], env=env)
+        for metric, result in json.loads(output).items():
+            results[f"{backend}.{metric}"] = Result(**result)
+    return results
+
+
+@benchmark("paginated_get")
+def paginated_get() -> Dict[str, Result]:
+    count = 5000
+    with FakeE621Server(post_count=count) as server:
+        api = server.api()
+        # The first run also fills the server's cache of synthetic posts
+        raw = best_of(lambda: api.session.paginated_get("posts", {"tags": "", "limit": count, "page": 1}, "posts"), 3)
+        models = best_of(lambda: api.posts.search(limit=count, ignore_pagination=True), 3)
+    return {
+        "raw_posts_per_second": Result(count / raw, "posts/s", True),
+        "model_posts_per_second": Result(count / models, "posts/s", True),
+    }
+
+
+@benchmark("blacklist.intersects")
+def blacklist_intersects() -> Dict[str, Result]:
+    # A blacklist of single tags and tag combinations, mostly of tags that are rare in the fixture
+    blacklist = BlackList(
+        [f"tag_{i}" for i in range(100, 300)] + [f"tag_{i} tag_{i + 1}" for i in range(10, 60, 2)] + ["species_7"]
+    )
+    posts = Post.from_list(fixture_posts(2000), E621())
+    tag_sets = [post.all_tags for post in posts]
+    seconds = best_of(lambda: [blacklist.intersects(tags) for tags in tag_sets])
+    return {"microseconds_per_post": Result(seconds / len(tag_sets) * 1e6, "us", False)}
+
+
+@benchmark("endpoint_overhead")
+def endpoint_overhead() -> Dict[str, Result]:
+    """What a generated method like tags.search adds on top of the _default_search it calls"""
+    api = E621()
+    api.tags._default_search = lambda params, limit, page, ignore_pagination: []  # type: ignore
+    calls = 20000
+    generated = best_of(lambda: [api.tags.search(name_matches="fox", limit=10) for _ in range(calls)])
+    direct = best_of(
+        lambda: [api.tags._default_search({"search[name_matches]": "fox"}, 10, 1, False) for _ in range(calls)]
+    )
+    return {"microseconds_per_call": Result((generated - direct) / calls * 1e6, "us", False)}
+
+
+@benchmark("import_time")
+def import_time() -> Dict[str, Result]:
+    """Startup cost of a short-lived script: importing e621, creating a client, and making it ready for a search"""
+    code = (
+        "import time; start = time.perf_counter(); import e621; imported = time.perf_counter(); "
+        "api = e621.E621(); created = time.perf_counter(); api.posts; api.session; ready = time.perf_counter(); "
+        "print(imported - start, created - start, ready - start)"
+    )
+    root = Path(__file__).resolve().parent.parent
+    runs = [subprocess.check_output([sys.executable, "-c", code], cwd=root).split() for _ in range(7)]
+    imported, created, ready = (statistics.median(float(run[i]) for run in runs) * 1000 for i in range(3))
+    return {
+        "milliseconds": Result(imported, "ms", False),
+        "client_milliseconds": Result(created, "ms", False),
+        "ready_milliseconds": Result(ready, "ms", False),
+    }
+
+
+@benchmark("memory")
+def memory() -> Dict[str, Result]:
+    api = E621()
+    raw = fixture_posts(10000)
+    gc.collect()
+    tracemalloc.start()
+    posts = Post.from_list(raw, api)
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del posts
+    return {
+        "megabytes_per_10k_posts": Result(size / 2**20, "MB", False),
+        "bytes_per_post": Result(size / len(raw), "B", False),
+    }
+
+
+@benchmark("stream")
+def stream() -> Dict[str, Result]:
+    """Peak memory of iterating over the pages of a search with and without streaming them"""
+    count = 3200
+    results = {}
+    with FakeE621Server(post_count=count) as server:
+        api = server.api()
+        for name, streamed in (("buffered", False), ("streamed", True)):
+            gc.collect()
+            tracemalloc.start()
+            for _ in api.posts.iter_search("", limit=count, stream=streamed):
+                pass
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            results[f"{name}.peak_megabytes"] = Result(peak / 2**20, "MB", False)
+    return results
+
+
+@benchmark("resultset")
+def resultset() -> Dict[str, Result]:
+    """Peak memory of a 10k post ignore_pagination search held as a list and as a DiskResultSet"""
+    count = 10000
+    results = {}
+    with FakeE621Server(post_count=count) as server:
+        api = server.api()
+        searches = {
+            "list": lambda: api.posts.search(limit=count, ignore_pagination=True),
+            "disk": lambda: api.posts.search_to_disk(limit=count),
+        }
+        for name, search in searches.items():
+            gc.collect()
+            tracemalloc.start()
+            posts = search()
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            results[f"{name}.peak_megabytes"] = Result(peak / 2**20, "MB", False)
+        with api.posts.search_to_disk(limit=count) as on_disk:
+            seconds = best_of(lambda: [post.id for post in on_disk], 3)
+        results["disk.iterated_posts_per_second"] = Result(count / seconds, "posts/s", True)
+    return results
+
+
+@benchmark("export")
+def export_posts() -> Dict[str, Result]:
+    """Throughput and peak memory of exporting 10k posts from an iterator, the way a search yields them"""
+    from e621.exporters import JsonlExporter, ParquetExporter, SqliteExporter, export
+
+    api = E621()
+    raw = fixture_posts(10000)
+    exporters = {"jsonl": lambda path: JsonlExporter(path), "sqlite": lambda path: SqliteExporter(path, Post)}
+    try:
+        import pyarrow  # noqa: F401
+
+        exporters["parquet"] = lambda path: ParquetExporter(path, Post)
+    except ImportError:
+        pass
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for name, create in exporters.items():
+            path = Path(directory) / name
+
+            def run() -> None:
+                with create(path) as exporter:
+                    export((Post._validate(post, api) for post in raw), exporter)
+                path.unlink()
+
+            gc.collect()
+            tracemalloc.start()
+            run()
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            results[f"{name}.posts_per_second"] = Result(len(raw) / best_of(run, 3), "posts/s", True)
+            results[f"{name}.peak_megabytes"] = Result(peak / 2**20, "MB", False)
+    return results
+
+
+@benchmark("serialization")
+def serialization() -> Dict[str, Result]:
+    """Encoding and decoding a page of posts in the compact format, next to the json it came from"""
+    from e621.serialization import dumps, loads
+
+    api = E621()
+    raw = fixture_posts(320)
+    posts = Post.from_list(raw, api)
+    data = dumps(posts)
+    return {
+        "dumps.posts_per_second": Result(len(posts) / best_of(lambda: dumps(posts), 10), "posts/s", True),
+        "loads.posts_per_second": Result(len(posts) / best_of(lambda: loads(data, api), 10), "posts/s", True),
+        "bytes_per_post": Result(len(data) / len(posts), "B", False),
+        "json_bytes_per_post": Result(len(json.dumps(raw)) / len(posts), "B", False),
+    }
+
+
+@benchmark("concurrency")
+def concurrency() -> Dict[str, Result]:
+    """One client shared by 16 threads, see concurrency.py, which also fails the run if anything raced"""
+    sys.path.insert(0, str(Path(__file__).parent))
+    from concurrency import stress
+
+    result = stress(threads=16, operations=20, pool_size=16)
+    return {
+        "requests_per_second": Result(result["requests_per_second"], "req/s", True),
+        "connections": Result(result["connections"], "", False),
+    }
+
+
+@benchmark("http2")
+def http2() -> Dict[str, Result]:
+    """The HTTP/1.1 pool next to Http2Adapter (if httpx and h2 are installed), see http2.py"""
+    sys.path.insert(0, str(Path(__file__).parent))
+    from http2 import measure
+
+    results = {}
+    for transport, result in measure(threads=16, requests_per_thread=20, latency=0.005).items():
+        results[f"{transport}.median_latency_ms"] = Result(result["median_latency_ms"], "ms", False)
+        results[f"{transport}.requests_per_second"] = Result(result["requests_per_second"], "req/s", True)
+    return results
+
+
+@benchmark("negative_cache")
+def negative_cache() -> Dict[str, Result]:
+    """Getting posts that are gone again and again, the way a crawler retrying a list of ids does"""
+    from e621.cache import NegativeCache
+
+    results = {}
+    with FakeE621Server(post_count=1000, entity_count=10, deleted_posts=range(1, 1001, 10)) as server:
+        for name, cache in (("uncached", None), ("cached", NegativeCache())):
+            api = server.api(negative_cache=cache)
+
+            def run() -> None:
+                for id in range(1001, 1101):
+                    try:
+                        api.posts.get(id)
+                    except requests.HTTPError:
+                        pass
+                for chunk in range(1, 1001, 100):
+                    api.posts.get(list(range(chunk, chunk + 100)))
+
+            results[f"{name}.milliseconds"] = Result(best_of(run, 3) * 1000, "ms", False)
+    return results
+
+
+@benchmark("hedging")
+def hedging() -> Dict[str, Result]:
+    """Median and p99 latency of posts.get with and without hedging, against a fake e621 where 3% of responses stall"""
+    from e621.hedging import HedgePolicy
+
+    results = {}
+    for name, policy in (("plain", None), ("hedged", HedgePolicy(budget=0.1))):
+        with FakeE621Server(post_count=1000, latency=0.003, slow_rate=0.03, slow_latency=0.1) as server:
+            api = server.api(hedge_policy=policy)
+            timings = []
+            for i in range(500):
+                start = time.perf_counter()
+                api.posts.get(1 + i)
+                timings.append(time.perf_counter() - start)
+            api.session.close()
+        results[f"{name}.p50_ms"] = Result(statistics.median(timings) * 1000, "ms", False)
+        results[f"{name}.p99_ms"] = Result(statistics.quantiles(timings, n=100)[98] * 1000, "ms", False)
+    return results
+
+
+@benchmark("idset")
+def idset() -> Dict[str, Result]:
+    """favorites & query - downloaded over 500k ids each, as PostIdSets and as Python sets"""
+    import random
+
+    from e621.idset import PostIdSet
+
+    rng = random.Random(621)
+    # Newest first, the order searches return them in
+    favorites, query, downloaded = (sorted(rng.sample(range(5_000_000), 500_000), reverse=True) for _ in range(3))
+    sets = [set(ids) for ids in (favorites, query, downloaded)]
+    id_sets = [PostIdSet(ids) for ids in (favorites, query, downloaded)]
+    gc.collect()
+    tracemalloc.start()
+    measured = set(favorites)
+    set_bytes, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del measured
+    results = {
+        "build_ids_per_second": Result(len(favorites) / best_of(lambda: PostIdSet(favorites), 3), "ids/s", True),
+        "megabytes": Result(id_sets[0].nbytes / 2**20, "MB", False),
+        "set_megabytes": Result(set_bytes / 2**20, "MB", False),
+    }
+    for name, values in (("", id_sets), ("set_", sets)):
+        a, b, c = values
+        results[f"{name}algebra_ms"] = Result(best_of(lambda: (a & b) - c) * 1000, "ms", False)
+        results[f"{name}union_ms"] = Result(best_of(lambda: a | b | c) * 1000, "ms", False)
+        results[f"{name}difference_ms"] = Result(best_of(lambda: a - b) * 1000, "ms", False)
+    return results
+
+
+@benchmark("multiplex.plan")
+def multiplex_plan() -> Dict[str, Result]:
+    sys.path.insert(0, str(Path(__file__).parent))
+    from e621.multiplex import plan_queries
+    from multiplex import subscription_set
+
+    queries = subscription_set(300, 621)
+    seconds = best_of(lambda: plan_queries(queries))
+    plan = plan_queries(queries)
+    return {
+        "milliseconds": Result(seconds * 1000, "ms", False),
+        "requests_saved": Result(100 * (1 - plan.request_count / plan.query_count), "%", True),
+    }
+
+
+def results_name(name: str, metric: str) -> str:
+    return f"{name}.{metric}"
+
+
+def run_benchmarks(only: Optional[str]) -> Dict[str, Result]:
+    results = {}
+    for name, function in BENCHMARKS.items():
+        if only is not None and not name.startswith(only):
+            continue
+        for metric, result in function().items():
+            results[results_name(name, metric)] = result
+            print(f"{results_name(name, metric):<60} {result.value:>12.3f} {result.unit}")
+    return results
+
+
+def load_baselines() -> Dict[str, Result]:
+    if not BASELINES_PATH.exists():
+        return {}
+    return {name: Result(**result) for name, result in json.loads(BASELINES_PATH.read_text()).items()}
+
+
+@app.command("parse-worker", hidden=True)
+def parse_worker():
+    print(json.dumps({metric: asdict(result) for metric, result in measure_parsing().items()}))
+
+
+@app.command()
+def run(only: Optional[str] = typer.Option(None, help="only run benchmarks whose names start with this")):
+    run_benchmarks(only)
+
+
+@app.command()
+def save(only: Optional[str] = typer.Option(None, help="only run benchmarks whose names start with this")):
+    baselines = load_baselines()
+    for name, result in run_benchmarks(only).items():
+        baselines[name] = Result(round(result.value, 3), result.unit, result.higher_is_better)
+    BASELINES_PATH.write_text(json.dumps({k: asdict(v) for k, v in sorted(baselines.items())}, indent=2) + "\n")
+    print(f"Saved {len(baselines)} baselines to {BASELINES_PATH}")
+
+
+@app.command()
+def compare(
+    only: Optional[str] = typer.Option(None, help="only run benchmarks whose names start with this"),
+    tolerance: float = typer.Option(0.2, help="how much worse than the baseline a result may be"),
+):
+    baselines = load_baselines()
+    results = run_benchmarks(only)
+    regressions = []
+    print()
+    for name, result in results.items():
+        baseline = baselines.get(name)
+        if baseline is None:
+            print(f"{name:<60} no baseline")
+            continue
+        change = result.value / baseline.value - 1 if baseline.value else 0.0
+        worse = -change if result.higher_is_better else change
+        verdict = "REGRESSION" if worse > tolerance else "improved" if worse < -tolerance else "ok"
+        print(f"{name:<60} {baseline.value:>12.3f} -> {result.value:>12.3f} {result.unit:<8} {change:+7.1%} {verdict}")
+        if worse > tolerance:
+            regressions.append(name)
+    if regressions:
+        print(f"\n{len(regressions)} regression(s): {', '.join(regressions)}")
+        raise typer.Exit(1)
+
+
+if __name__ == "__main__":
+    app()
@@ -1,5 +1,31 @@
-from .api import E621, E926
+import importlib
+from typing import TYPE_CHECKING, Any, List
+
+if TYPE_CHECKING:
+    from .api import E621, E926
+
+__all__ = ["E621", "E926"]
 
 __author__ = "PatriotRossii"
 __version__ = "0.0.7"
 __email__ = "patriotrosii2019@mail.ru"
+
+
+def __getattr__(name: str) -> Any:
+    # PEP 562: the client and the submodules are only imported when they are first used,
+    # which keeps "import e621" cheap for short-lived scripts
+    if name in __all__:
+        value = getattr(importlib.import_module(".api", __name__), name)
+    else:
+        try:
+            value = importlib.import_module(f".{name}", __name__)
+        except ModuleNotFoundError as e:
+            if e.name != f"{__name__}.{name}":
+                raise
+            raise AttributeError(f"module {__name__!r} has no attribute {name!r}") from None
+    globals()[name] = value
+    return value
+
+
+def __dir__() -> List[str]:
+    return sorted(set(globals()) | set(__all__))
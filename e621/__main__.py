@@ -0,0 +1,96 @@
+import argparse
+import os
+import sys
+from typing import List, Optional
+
+from .api import E621, E926
+from .crawler import OUTPUT_FORMATS, Crawler
+from .fakeserver import FakeE621Server
+from .ratelimit import DEFAULT_RATE
+from .session import MAX_PAGE_SIZE
+
+
+def _crawl(args: argparse.Namespace) -> int:
+    username, api_key = os.environ.get("E621_USERNAME"), os.environ.get("E621_API_KEY")
+    crawler = Crawler(
+        args.output,
+        tags=args.tags,
+        id_range=(args.min_id, args.max_id) if args.max_id is not None else None,
+        shards=args.shards,
+        workers=args.workers,
+        output_format=args.format,
+        rate=args.rate,
+        auth=(username, api_key) if username and api_key else None,
+        api_class=E926 if args.e926 else E621,
+        page_size=args.page_size,
+        seen_ids=args.seen_ids,
+    )
+    checkpoints = crawler.run()
+    total = sum(c.count for c in checkpoints.values())
+    print(f"Crawled {total} posts in {len(checkpoints)} shards into {args.output}")
+    return 0 if all(c.done for c in checkpoints.values()) else 1
+
+
+def _fake_server(args: argparse.Namespace) -> int:
+    server = FakeE621Server(
+        args.cassette,
+        post_count=args.posts,
+        latency=args.latency,
+        rate_limit_every=args.rate_limit_every,
+        error_rate=args.error_rate,
+        host=args.host,
+        port=args.port,
+    )
+    print(f"Serving a fake e621 at {server.base_url}, pass it to E621(base_url=...)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m e621", description="e621.net API wrapper command line tools")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    crawl = commands.add_parser(
+        "crawl",
+        help="download all posts matching a tag query",
+        description="Downloads all posts matching a tag query in parallel shards. Running the same command again "
+        "resumes an interrupted crawl. Credentials are read from E621_USERNAME and E621_API_KEY.",
+    )
+    crawl.add_argument("output", help="directory for the results and the checkpoints")
+    crawl.add_argument("--tags", default="", help="tag query to crawl (default: all posts)")
+    crawl.add_argument("--min-id", type=int, default=1, help="lowest post id to crawl")
+    crawl.add_argument("--max-id", type=int, default=None, help="highest post id to crawl (default: the newest post)")
+    crawl.add_argument("--shards", type=int, default=8, help="number of id ranges to split the crawl into")
+    crawl.add_argument("--workers", type=int, default=4, help="number of worker processes")
+    crawl.add_argument("--format", choices=OUTPUT_FORMATS, default="jsonl", help="output format")
+    crawl.add_argument("--rate", type=float, default=DEFAULT_RATE, help="requests per second shared by all workers")
+    crawl.add_argument("--page-size", type=int, default=MAX_PAGE_SIZE, help="posts per request")
+    crawl.add_argument(
+        "--seen-ids", default=None, help="PostIdSet file of posts to skip, updated with the crawled ones afterwards"
+    )
+    crawl.add_argument("--e926", action="store_true", help="crawl e926.net instead of e621.net")
+    crawl.set_defaults(handler=_crawl)
+
+    fake_server = commands.add_parser(
+        "fake-server",
+        help="run a local fake e621 for tests and benchmarks",
+        description="Serves recorded responses from a cassette and synthetic posts, pools, users, etc. otherwise.",
+    )
+    fake_server.add_argument("--cassette", default=None, help="cassette recorded with transport.RecordingAdapter")
+    fake_server.add_argument("--posts", type=int, default=10000, help="number of synthetic posts")
+    fake_server.add_argument("--latency", type=float, default=0.0, help="seconds to wait before every response")
+    fake_server.add_argument("--rate-limit-every", type=int, default=0, help="answer every n-th request with 429")
+    fake_server.add_argument("--error-rate", type=float, default=0.0, help="share of requests that fail with 500")
+    fake_server.add_argument("--host", default="127.0.0.1")
+    fake_server.add_argument("--port", type=int, default=8621)
+    fake_server.set_defaults(handler=_fake_server)
+
+    args = parser.parse_args(argv)
+    return args.handler(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
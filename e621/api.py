@@ -1,10 +1,38 @@
-from typing import Optional, Tuple
+from __future__ import annotations
 
-from . import endpoints
-from .session import ApiKey, SimpleSession, Username
+import threading
+from typing import TYPE_CHECKING, Any, Dict, Optional, Tuple
+
+from .util import locked_cached_property
+
+if TYPE_CHECKING:
+    from requests.adapters import BaseAdapter
+
+    from . import endpoints
+    from .cache import EntityCache, NegativeCache
+    from .circuit import CircuitBreaker
+    from .hedging import HedgePolicy
+    from .instrumentation import Instrumentation
+    from .ratelimit import RateLimiter
+    from .session import ApiKey, SimpleSession, Username
+    from .store import LocalStore
 
 
 class E621:
+    """The e621 api client
+
+    A single client can be shared by any number of threads: the session, the endpoints and the lazily fetched
+    properties (users.me, post.parent, pool.posts...) are only ever created once. Every thread's requests go through
+    one connection pool that keeps up to pool_size connections to e621 open, so set pool_size to at least the number
+    of threads that make requests. keep_alive=False closes every connection after its request.
+
+    With a circuit_breaker, requests fail fast while e621 is down. Gets that fail because e621 is unreachable
+    then return the last version of the entity from entity_cache (even if it expired) or from store, if they have it.
+    Every get fills the entity_cache, whether or not there is a circuit_breaker.
+    A negative_cache answers gets of entities that were found to be missing or deleted without asking e621 again.
+    A hedge_policy sends a second copy of GETs that are slower than usual and uses whichever answers first.
+    """
+
     BASE_URL = "https://e621.net/{endpoint}.json"
 
     posts: endpoints.Posts
@@ -37,42 +65,75 @@ class E621:
         client_name: str = "e621-py",
         client_version: str = "0.0.0",
         timeout: int = 10,
+        rate_limiter: Optional[RateLimiter] = None,
+        entity_cache: Optional[EntityCache] = None,
+        instrumentation: Optional[Instrumentation] = None,
+        base_url: Optional[str] = None,
+        transport: Optional[BaseAdapter] = None,
+        pool_size: int = 10,
+        keep_alive: bool = True,
+        circuit_breaker: Optional[CircuitBreaker] = None,
+        store: Optional[LocalStore] = None,
+        negative_cache: Optional[NegativeCache] = None,
+        hedge_policy: Optional[HedgePolicy] = None,
     ) -> None:
         self.timeout = timeout
-        self.session = SimpleSession(self.BASE_URL, timeout, auth, client_name, client_version)
+        self.entity_cache = entity_cache
+        self.negative_cache = negative_cache
+        self.store = store
+        self.base_url = base_url or self.BASE_URL
+        self._session_args = (
+            auth,
+            client_name,
+            client_version,
+            rate_limiter,
+            instrumentation,
+            transport,
+            pool_size,
+            keep_alive,
+            circuit_breaker,
+            hedge_policy,
+        )
+        self._lock = threading.Lock()
         if auth is not None:
             self.username, self.api_key = auth
         else:
             self.username, self.api_key = None, None
 
-        self.posts = endpoints.Posts(self)
-        self.favorites = endpoints.Favorites(self)
-        self.post_flags = endpoints.PostFlags(self)
-        self.tags = endpoints.Tags(self)
-        self.tag_aliases = endpoints.TagAliases(self)
-        self.notes = endpoints.Notes(self)
-        self.pools = endpoints.Pools(self)
-        self.users = endpoints.Users(self)
-        self.post_versions = endpoints.PostVersions(self)
-        self.post_approvals = endpoints.PostApprovals(self)
-        self.note_versions = endpoints.NoteVersions(self)
-        self.wiki_pages = endpoints.WikiPages(self)
-        self.wiki_page_versions = endpoints.WikiPageVersions(self)
-        self.artists = endpoints.Artists(self)
-        self.artist_versions = endpoints.ArtistVersions(self)
-        self.tag_type_versions = endpoints.TagTypeVersions(self)
-        self.tag_implications = endpoints.TagImplications(self)
-        self.bulk_update_requests = endpoints.BulkUpdateRequests(self)
-        self.blips = endpoints.Blips(self)
-        self.takedowns = endpoints.Takedowns(self)
-        self.user_feedbacks = endpoints.UserFeedbacks(self)
-        self.forum_topics = endpoints.ForumTopics(self)
-        self.post_sets = endpoints.PostSets(self)
+    @locked_cached_property
+    def session(self) -> SimpleSession:
+        # Created on first use, so that creating a client doesn't have to import requests
+        from .session import SimpleSession
+
+        return SimpleSession(self.base_url, self.timeout, *self._session_args)
+
+    def __getattr__(self, name: str) -> Any:
+        # Endpoints are created on first use, so that creating a client doesn't have to build all of the models
+        class_name = _ENDPOINTS.get(name)
+        if class_name is None:
+            raise AttributeError(f"{type(self).__name__!r} object has no attribute {name!r}")
+        from . import endpoints
+
+        with self._lock:
+            # Another thread may have created it in the meantime, and endpoints like users cache state of their own
+            endpoint = self.__dict__.get(name)
+            if endpoint is None:
+                endpoint = getattr(endpoints, class_name)(self)
+                setattr(self, name, endpoint)
+        return endpoint
 
     @property
     def logged_in(self) -> bool:
         return self.username is not None and self.api_key is not None
 
 
+# Attribute name -> endpoint class name, e.g. "posts" -> "Posts"
+_ENDPOINTS: Dict[str, str] = {
+    name: annotation[len("endpoints.") :]
+    for name, annotation in E621.__annotations__.items()
+    if annotation.startswith("endpoints.")
+}
+
+
 class E926(E621):
     BASE_URL = "https://e926.net/{endpoint}.json"
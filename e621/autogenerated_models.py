@@ -6,9 +6,7 @@ from __future__ import annotations
 
 from typing import Any, Dict, List, Optional
 
-from pydantic import Field
-
-from .base_model import BaseModel
+from .base_model import BaseModel, Field
 
 __all__ = (
     "File",
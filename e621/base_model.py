@@ -1,4 +1,17 @@
-from typing import TYPE_CHECKING, Any, Dict, List, Optional, Type, Union, overload
+import os
+import time
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Dict,
+    Iterator,
+    List,
+    Set,
+    Tuple,
+    Type,
+    Union,
+    overload,
+)
 
 import pydantic
 import requests
@@ -8,19 +21,169 @@ from typing_extensions import Self
 if TYPE_CHECKING:
     from .api import E621
 
+__all__ = ["BACKEND", "BaseModel", "Field", "fields_of"]
 
-class BaseModel(pydantic.BaseModel):
-    if TYPE_CHECKING:
-        e621api: E621
-    else:
-        e621api: Any
+# "v1" validates with the pydantic 1 API (pydantic.v1 if pydantic 2 is installed),
+# "v2" with pydantic 2, whose compiled core parses several times faster.
+# The newest backend the installed pydantic supports is used unless E621_MODEL_BACKEND says otherwise
+PYDANTIC_V2 = pydantic.VERSION.startswith("2.")
+BACKEND = os.environ.get("E621_MODEL_BACKEND") or ("v2" if PYDANTIC_V2 else "v1")
+if BACKEND not in ("v1", "v2"):
+    raise ImportError(f'E621_MODEL_BACKEND must be "v1" or "v2", not {BACKEND!r}')
+if BACKEND == "v2" and not PYDANTIC_V2:
+    raise ImportError(f"E621_MODEL_BACKEND=v2 requires pydantic 2, but pydantic {pydantic.VERSION} is installed")
+if BACKEND == "v1" and PYDANTIC_V2:
+    import pydantic.v1 as pydantic  # type: ignore # noqa: F811
 
-    class Config:
-        keep_untouched = (cached_property,)  # type: ignore
+Field = pydantic.Field
+
+# (name, alias, annotation, required)
+FieldInfo = Tuple[str, str, Any, bool]
+
+_required_field_counts: Dict[type, int] = {}
+_full_fields_sets: Dict[type, Set[str]] = {}
+
+
+if BACKEND == "v1":
+
+    class _BackendModel(pydantic.BaseModel):
+        class Config:
+            keep_untouched = (cached_property,)  # type: ignore
+
+        def __init__(__pydantic_self__, **data: Any) -> None:
+            super().__init__(**data)
+            _share_fields_set(__pydantic_self__, "__fields_set__")
+
+        @classmethod
+        def _validate(cls, obj: Dict[str, Any], api: "E621") -> Self:
+            model = cls(**obj)
+            _set_api(model, api)
+            return model
+
+        @classmethod
+        def _validate_many(cls, objs: List[Dict[str, Any]], api: "E621") -> List[Self]:
+            models = [cls(**obj) for obj in objs]
+            for model in models:
+                _set_api(model, api)
+            return models
+
+        @classmethod
+        def _construct(cls, values: Dict[str, Any]) -> Self:
+            # What construct() does, minus filling in defaults, as values always has every field
+            model = cls.__new__(cls)
+            object.__setattr__(model, "__dict__", values)
+            object.__setattr__(model, "__fields_set__", _full_fields_set(cls))
+            return model
+
+        @classmethod
+        def _fields(cls) -> Iterator[FieldInfo]:
+            for field in cls.__fields__.values():
+                yield field.name, field.alias, field.outer_type_, field.required
+
+else:
+    from pydantic import ConfigDict, TypeAdapter
+
+    _list_adapters: Dict[type, Any] = {}
+
+    class _BackendModel(pydantic.BaseModel):  # type: ignore
+        # Keeps the v1 behavior the models were written for: numbers are accepted for strings
+        model_config = ConfigDict(
+            ignored_types=(cached_property,), protected_namespaces=(), coerce_numbers_to_str=True, populate_by_name=True
+        )
+
+        @classmethod
+        def __pydantic_init_subclass__(cls, **kwargs: Any) -> None:
+            # In v1, Optional fields default to None. In v2 they are required unless the model says otherwise
+            optional = [f for f in cls.model_fields.values() if f.is_required() and _is_optional(f.annotation)]
+            for field in optional:
+                field.default = None
+            if optional:
+                cls.model_rebuild(force=True)
+
+        def model_post_init(self, __context: Any) -> None:
+            _share_fields_set(self, "__pydantic_fields_set__")
+
+        @classmethod
+        def _validate(cls, obj: Dict[str, Any], api: "E621") -> Self:
+            model = cls.model_validate(obj)
+            _set_api(model, api)
+            return model
+
+        @classmethod
+        def _validate_many(cls, objs: List[Dict[str, Any]], api: "E621") -> List[Self]:
+            # The whole page is validated in a single call into pydantic-core
+            adapter = _list_adapters.get(cls)
+            if adapter is None:
+                adapter = _list_adapters[cls] = TypeAdapter(List[cls])  # type: ignore
+            models = adapter.validate_python(objs)
+            for model in models:
+                _set_api(model, api)
+            return models
+
+        @classmethod
+        def _construct(cls, values: Dict[str, Any]) -> Self:
+            # What model_construct() does, minus filling in defaults, as values always has every field
+            model = cls.__new__(cls)
+            object.__setattr__(model, "__dict__", values)
+            object.__setattr__(model, "__pydantic_fields_set__", _full_fields_set(cls))
+            object.__setattr__(model, "__pydantic_extra__", None)
+            object.__setattr__(model, "__pydantic_private__", None)
+            return model
+
+        @classmethod
+        def _fields(cls) -> Iterator[FieldInfo]:
+            for name, field in cls.model_fields.items():
+                yield name, field.alias or name, field.annotation, field.is_required()
+
+    def _is_optional(annotation: Any) -> bool:
+        return getattr(annotation, "__origin__", None) is Union and type(None) in annotation.__args__
+
+
+class BaseModel(_BackendModel):
+    # The client is not a field: only the root entities that the client returns are bound to it,
+    # nested models such as Tags or Score don't carry a reference at all
+    __slots__ = ("_e621api",)
+
+    @property
+    def e621api(self) -> "E621":
+        try:
+            return self._e621api  # type: ignore
+        except AttributeError:
+            raise AttributeError(f"This {type(self).__name__} isn't bound to a client") from None
+
+    def __copy__(self) -> Self:
+        return self._bound_like_self(type(self)._construct(dict(self.__dict__)))
+
+    def copy(self, *args: Any, **kwargs: Any) -> Self:  # type: ignore[override]
+        # pydantic copies the fields but not the slot that binds the model to its client
+        return self._bound_like_self(super().copy(*args, **kwargs))
+
+    def _bound_like_self(self, model: Self) -> Self:
+        if hasattr(self, "_e621api"):
+            _set_api(model, self._e621api)  # type: ignore
+        return model
+
+    def __reduce__(self) -> Tuple[Any, ...]:
+        # Pickled in the compact format of e621.serialization. The client is rebound on load, see default_api
+        from .serialization import _restore, dumps
+
+        return _restore, (dumps(self),)
+
+    def __deepcopy__(self, memo: Any = None) -> Self:
+        from .serialization import dumps, loads
+
+        return loads(dumps(self), getattr(self, "_e621api", None))
 
     @classmethod
     def from_list(cls, list: List[Dict[str, Any]], api: "E621") -> List[Self]:
-        return [cls(**obj, e621api=api) for obj in list]
+        return cls._validate_many(list, api)
+
+    @classmethod
+    def _required_field_count(cls) -> int:
+        count = _required_field_counts.get(cls)
+        if count is None:
+            count = _required_field_counts[cls] = sum(required for name, *_, required in cls._fields())
+        return count
 
     @classmethod
     @overload
@@ -44,14 +207,73 @@ class BaseModel(pydantic.BaseModel):
         e621api: "E621",
         expect: Union[Type[Dict[Any, Any]], Type[List[Any]]] = dict,
     ) -> Union[Self, List[Self]]:
-        json: Union[Dict[Any, Any], List[Any]] = response.json()
+        event = getattr(response, "e621_event", None)
+        if event is None:
+            return cls._from_json(response.json(), e621api, expect)
+        start = time.monotonic()
+        json = response.json()
+        decoded = time.monotonic()
+        result = cls._from_json(json, e621api, expect)
+        event.decode_time = decoded - start
+        event.model_build_time = time.monotonic() - decoded
+        e621api.session._emit_parse(event)
+        return result
+
+    @classmethod
+    def _from_json(
+        cls,
+        json: Union[Dict[Any, Any], List[Any]],
+        e621api: "E621",
+        expect: Union[Type[Dict[Any, Any]], Type[List[Any]]],
+    ) -> Union[Self, List[Self]]:
         # {"post": {<post_info>}} or {"posts": [{<post_info>}, ...]}
-        if isinstance(json, dict) and len(cls.schema()["required"]) > len(json) and len(json) == 1:
+        if isinstance(json, dict) and cls._required_field_count() > len(json) and len(json) == 1:
             json = json[list(json)[0]]
 
         if isinstance(json, list) and expect is list:
             return cls.from_list(json, e621api)
         elif isinstance(json, dict) and expect is dict:
-            return cls(**json, e621api=e621api)
+            return cls._validate(json, e621api)
         else:
             raise TypeError(f"response.json() returned an unexpected object: {json}")
+
+
+def fields_of(model: Type[BaseModel]) -> List[Tuple[str, str, Any]]:
+    """(name, alias, annotation) of every field of a model, whichever backend built it"""
+    return [(name, alias, annotation) for name, alias, annotation, _ in model._fields()]
+
+
+def _strip_optional(annotation: Any) -> Any:
+    args = getattr(annotation, "__args__", ())
+    if getattr(annotation, "__origin__", None) is Union and type(None) in args:
+        rest = [arg for arg in args if arg is not type(None)]
+        return rest[0] if len(rest) == 1 else Any
+    return annotation
+
+
+def _is_model(annotation: Any) -> bool:
+    return isinstance(annotation, type) and issubclass(annotation, BaseModel)
+
+
+def _is_list(annotation: Any) -> bool:
+    return getattr(annotation, "__origin__", None) is list
+
+
+def _set_api(model: BaseModel, api: "E621") -> None:
+    object.__setattr__(model, "_e621api", api)
+
+
+def _full_fields_set(model: Type[BaseModel]) -> Set[str]:
+    fields = _full_fields_sets.get(model)
+    if fields is None:
+        fields = _full_fields_sets[model] = {name for name, *_ in model._fields()}
+    return fields
+
+
+def _share_fields_set(model: BaseModel, attribute: str) -> None:
+    # pydantic keeps a set of the names of the fields that were given for every model, which takes more memory than
+    # the values of the fields. When all of them were given, as they almost always are in api responses,
+    # the models of a class share a single set. Adding a name to a set that has every name already changes nothing
+    full = _full_fields_set(type(model))
+    if len(getattr(model, attribute)) == len(full):
+        object.__setattr__(model, attribute, full)
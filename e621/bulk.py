@@ -0,0 +1,241 @@
+import hashlib
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Dict, Iterator, List, Optional, Tuple, Union
+
+import requests
+
+from .enums import StrEnum
+from .instrumentation import retry_attempt
+from .ratelimit import RateLimiter, TokenBucket
+from .scheduler import BULK, priority
+from .util import write_atomically
+
+if TYPE_CHECKING:
+    from .api import E621
+
+__all__ = ["MutationKind", "Mutation", "MutationResult", "BulkReport", "BulkMutator"]
+
+_RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+
+class MutationKind(StrEnum):
+    UPDATE_POST = "update_post"
+    CREATE_FAVORITE = "create_favorite"
+    DELETE_FAVORITE = "delete_favorite"
+    UPDATE_POOL = "update_pool"
+    ADD_TO_POOL = "add_to_pool"
+    REMOVE_FROM_POOL = "remove_from_pool"
+
+
+_POOL_KINDS = (MutationKind.UPDATE_POOL, MutationKind.ADD_TO_POOL, MutationKind.REMOVE_FROM_POOL)
+
+
+@dataclass
+class Mutation:
+    kind: MutationKind
+    target: int
+    params: Dict[str, Any] = field(default_factory=dict)
+
+    @property
+    def lane(self) -> Tuple[str, int]:
+        """Mutations that share a lane are applied sequentially and in order, different lanes run concurrently"""
+        if self.kind in _POOL_KINDS:
+            return ("pool", self.target)
+        elif self.kind is MutationKind.UPDATE_POST:
+            return ("post", self.target)
+        else:
+            return ("favorite", self.target)
+
+
+@dataclass
+class MutationResult:
+    index: int
+    mutation: Mutation
+    ok: bool
+    attempts: int
+    error: Optional[str] = None
+
+
+@dataclass
+class BulkReport:
+    results: List[MutationResult]
+
+    def __iter__(self) -> Iterator[MutationResult]:
+        return iter(self.results)
+
+    def __len__(self) -> int:
+        return len(self.results)
+
+    @property
+    def succeeded(self) -> List[MutationResult]:
+        return [r for r in self.results if r.ok]
+
+    @property
+    def failed(self) -> List[MutationResult]:
+        return [r for r in self.results if not r.ok]
+
+
+class BulkMutator:
+    """Collects post updates, favorite changes and pool edits, then applies all of them concurrently
+
+    Successive edits of the same pool are merged into a single update of its post_ids.
+    If checkpoint_path is given, the progress is saved there after every finished lane
+    and a repeated run() of the same batch only retries the mutations that did not succeed.
+    """
+
+    def __init__(
+        self,
+        api: "E621",
+        max_workers: int = 4,
+        max_retries: int = 3,
+        backoff: float = 1.0,
+        rate_limiter: Optional[RateLimiter] = None,
+        checkpoint_path: Union[str, Path, None] = None,
+    ) -> None:
+        self._api = api
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.backoff = backoff
+        # The session already throttles every request if it has its own limiter
+        if rate_limiter is None and api.session.rate_limiter is None:
+            rate_limiter = TokenBucket()
+        self._rate_limiter = rate_limiter
+        self.checkpoint_path = Path(checkpoint_path) if checkpoint_path is not None else None
+        self.mutations: List[Mutation] = []
+
+    def update_post(self, post_id: int, **params: Any) -> None:
+        """Accepts the same keyword arguments as Posts.update"""
+        self.mutations.append(Mutation(MutationKind.UPDATE_POST, post_id, params))
+
+    def create_favorite(self, post_id: int) -> None:
+        self.mutations.append(Mutation(MutationKind.CREATE_FAVORITE, post_id))
+
+    def delete_favorite(self, post_id: int) -> None:
+        self.mutations.append(Mutation(MutationKind.DELETE_FAVORITE, post_id))
+
+    def update_pool(self, pool_id: int, **params: Any) -> None:
+        """Accepts the same keyword arguments as Pools.update"""
+        if isinstance(params.get("post_ids"), str):
+            params["post_ids"] = [int(i) for i in params["post_ids"].split()]
+        self.mutations.append(Mutation(MutationKind.UPDATE_POOL, pool_id, params))
+
+    def add_to_pool(self, pool_id: int, post_ids: List[int]) -> None:
+        self.mutations.append(Mutation(MutationKind.ADD_TO_POOL, pool_id, {"post_ids": list(post_ids)}))
+
+    def remove_from_pool(self, pool_id: int, post_ids: List[int]) -> None:
+        self.mutations.append(Mutation(MutationKind.REMOVE_FROM_POOL, pool_id, {"post_ids": list(post_ids)}))
+
+    def run(self) -> BulkReport:
+        fingerprint = self._fingerprint()
+        done = self._load_checkpoint(fingerprint)
+        lanes: Dict[Tuple[str, int], List[int]] = {}
+        for index, mutation in enumerate(self.mutations):
+            if index not in done or not done[index].ok:
+                lanes.setdefault(mutation.lane, []).append(index)
+
+        with ThreadPoolExecutor(self.max_workers) as executor:
+            futures = [executor.submit(self._run_lane, indices) for indices in lanes.values()]
+            for future in as_completed(futures):
+                for result in future.result():
+                    done[result.index] = result
+                self._save_checkpoint(fingerprint, done)
+
+        return BulkReport([done[i] for i in range(len(self.mutations))])
+
+    def _run_lane(self, indices: List[int]) -> List[MutationResult]:
+        with priority(BULK):
+            return self._run_lane_in_order(indices)
+
+    def _run_lane_in_order(self, indices: List[int]) -> List[MutationResult]:
+        mutations = [self.mutations[i] for i in indices]
+        if mutations[0].kind in _POOL_KINDS:
+            ok, attempts, error = self._with_retries(self._apply_pool_edits, mutations[0].target, mutations)
+            return [MutationResult(i, m, ok, attempts, error) for i, m in zip(indices, mutations)]
+        results = []
+        for index, mutation in zip(indices, mutations):
+            ok, attempts, error = self._with_retries(self._apply, mutation)
+            results.append(MutationResult(index, mutation, ok, attempts, error))
+        return results
+
+    def _with_retries(self, function: Any, *args: Any) -> Tuple[bool, int, Optional[str]]:
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                with retry_attempt(attempt - 1):
+                    function(*args)
+                return True, attempt, None
+            except requests.RequestException as e:
+                response = getattr(e, "response", None)
+                retryable = response is None or response.status_code in _RETRYABLE_STATUSES
+                if not retryable or attempt > self.max_retries:
+                    return False, attempt, str(e)
+                delay = self.backoff * 2 ** (attempt - 1)
+                if response is not None and response.headers.get("Retry-After", "").isdigit():
+                    delay = max(delay, int(response.headers["Retry-After"]))
+                time.sleep(delay)
+            except Exception as e:
+                # e.g. a response that doesn't validate. Retrying won't help, but the other mutations go on
+                return False, attempt, f"{type(e).__name__}: {e}"
+
+    def _throttle(self) -> None:
+        if self._rate_limiter is not None:
+            self._rate_limiter.acquire()
+
+    def _apply(self, mutation: Mutation) -> None:
+        self._throttle()
+        if mutation.kind is MutationKind.UPDATE_POST:
+            self._api.posts.update(mutation.target, **mutation.params)
+        elif mutation.kind is MutationKind.CREATE_FAVORITE:
+            self._api.favorites.create(mutation.target)
+        elif mutation.kind is MutationKind.DELETE_FAVORITE:
+            self._api.favorites.delete(mutation.target)
+        else:
+            raise ValueError(f"Unknown mutation kind: {mutation.kind}")
+
+    def _apply_pool_edits(self, pool_id: int, mutations: List[Mutation]) -> None:
+        """Squashes all edits of a single pool into one update request"""
+        post_ids: Optional[List[int]] = None
+        params: Dict[str, Any] = {}
+        for mutation in mutations:
+            if mutation.kind is MutationKind.UPDATE_POOL:
+                params.update(mutation.params)
+                if "post_ids" in mutation.params:
+                    post_ids = list(params.pop("post_ids"))
+                continue
+            if post_ids is None:
+                self._throttle()
+                post_ids = list(self._api.pools.get(pool_id).post_ids)
+            if mutation.kind is MutationKind.ADD_TO_POOL:
+                present = set(post_ids)
+                post_ids.extend(i for i in mutation.params["post_ids"] if i not in present)
+            else:
+                removed = set(mutation.params["post_ids"])
+                post_ids = [i for i in post_ids if i not in removed]
+        self._throttle()
+        self._api.pools.update(pool_id, post_ids=post_ids, **params)
+
+    def _fingerprint(self) -> str:
+        dump = json.dumps([asdict(m) for m in self.mutations], sort_keys=True, default=str)
+        return hashlib.sha256(dump.encode()).hexdigest()
+
+    def _load_checkpoint(self, fingerprint: str) -> Dict[int, MutationResult]:
+        if self.checkpoint_path is None or not self.checkpoint_path.exists():
+            return {}
+        checkpoint = json.loads(self.checkpoint_path.read_text())
+        if checkpoint["fingerprint"] != fingerprint:
+            raise ValueError(f"{self.checkpoint_path} belongs to a different batch of mutations")
+        return {
+            int(index): MutationResult(int(index), self.mutations[int(index)], r["ok"], r["attempts"], r["error"])
+            for index, r in checkpoint["results"].items()
+        }
+
+    def _save_checkpoint(self, fingerprint: str, done: Dict[int, MutationResult]) -> None:
+        if self.checkpoint_path is None:
+            return
+        results = {i: {"ok": r.ok, "attempts": r.attempts, "error": r.error} for i, r in done.items()}
+        write_atomically(self.checkpoint_path, json.dumps({"fingerprint": fingerprint, "results": results}))
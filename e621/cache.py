@@ -0,0 +1,167 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Iterable, List, Optional, Tuple, Type, TypeVar
+
+import requests
+
+from .base_model import BaseModel
+from .idset import PostIdSet
+from .serialization import dumps, loads
+
+__all__ = ["EntityCache", "NegativeCache", "KnownMissingError"]
+
+Model = TypeVar("Model", bound=BaseModel)
+
+
+class EntityCache:
+    """A thread-safe LRU cache of models, keyed by their class and id
+
+    Entries older than ttl seconds are treated as missing, unless get is asked for stale ones.
+    ttl=None keeps them fresh until they are evicted.
+    If compact is True, the models are stored in the compact format of e621.serialization, which takes several times
+    less memory, and every get returns a fresh copy, so changes to a returned model never leak into the cache.
+    """
+
+    def __init__(self, maxsize: int = 10_000, ttl: Optional[float] = None, compact: bool = False) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.compact = compact
+        self._entries: "OrderedDict[Tuple[type, Hashable], Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, model: Type[Model], id: Hashable, stale: bool = False) -> Optional[Model]:
+        """The cached model, or None. stale=True also returns expired models, e.g. while e621 is unreachable"""
+        key = (model, id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            stored_at, obj = entry
+            if not stale and self.ttl is not None and time.monotonic() - stored_at > self.ttl:
+                # Kept until it is evicted or replaced, as the last known version
+                return None
+            self._entries.move_to_end(key)
+        if self.compact:
+            data, api = obj
+            return loads(data, api)
+        return obj
+
+    def get_many(self, model: Type[Model], ids: Iterable[Hashable]) -> Dict[Hashable, Model]:
+        found = {}
+        for id in ids:
+            obj = self.get(model, id)
+            if obj is not None:
+                found[id] = obj
+        return found
+
+    def put(self, obj: BaseModel, id: Optional[Hashable] = None) -> None:
+        key = (type(obj), obj.id if id is None else id)  # type: ignore
+        entry = (dumps(obj), obj.e621api) if self.compact else obj
+        with self._lock:
+            self._entries[key] = (time.monotonic(), entry)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def put_many(self, objs: Iterable[BaseModel]) -> None:
+        for obj in objs:
+            self.put(obj)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+class KnownMissingError(requests.HTTPError):
+    """The 404 that a NegativeCache answers with, without asking e621 again"""
+
+
+class NegativeCache:
+    """Remembers which entities don't exist or were deleted, so that getting them again doesn't ask e621
+
+    Gets of an entity that got a 404 raise KnownMissingError (an HTTPError with a 404 response) for ttl seconds.
+    Gets of a deleted entity return a copy of the same deleted model for ttl seconds.
+    Posts that bulk gets find to be deleted or missing (older than the newest post they found) go to deleted_posts,
+    a PostIdSet that later bulk gets skip. They are forgotten together, ttl to 2 * ttl seconds after they were added,
+    in case they are restored.
+    """
+
+    def __init__(self, ttl: float = 3600.0, maxsize: int = 100_000) -> None:
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.deleted_posts = PostIdSet()
+        # The posts added during the previous ttl seconds, still skipped until deleted_posts is replaced again
+        self._older_deleted_posts = PostIdSet()
+        self._deleted_posts_until = time.monotonic() + ttl
+        # (endpoint url, identifier) -> (when it expires, the deleted model, dumped, and its client or None if missing)
+        self._entries: "OrderedDict[Tuple[str, Hashable], Tuple[float, Optional[Tuple[bytes, Any]]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def lookup(self, kind: str, identifier: Hashable) -> Tuple[bool, Optional[BaseModel]]:
+        """(whether the entity is known to be gone, a copy of its deleted model if it was deleted, not missing)"""
+        key = (kind, identifier)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return False, None
+            expires_at, deleted = entry
+            if time.monotonic() > expires_at:
+                del self._entries[key]
+                return False, None
+        if deleted is None:
+            return True, None
+        data, api = deleted
+        # A fresh copy, so that changes to a returned model never leak into later gets
+        return True, loads(data, api)
+
+    def add_missing(self, kind: str, identifier: Hashable) -> None:
+        self._add(kind, identifier, None)
+
+    def add_deleted(self, kind: str, identifier: Hashable, model: BaseModel) -> None:
+        self._add(kind, identifier, (dumps(model), getattr(model, "_e621api", None)))
+
+    def _add(self, kind: str, identifier: Hashable, deleted: Optional[Tuple[bytes, Any]]) -> None:
+        key = (kind, identifier)
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, deleted)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def without_deleted_posts(self, post_ids: Iterable[int]) -> List[int]:
+        with self._lock:
+            self._expire_deleted_posts()
+            current, older = self.deleted_posts, self._older_deleted_posts
+            return [id for id in post_ids if id not in current and id not in older]
+
+    def add_deleted_posts(self, post_ids: Iterable[int]) -> None:
+        with self._lock:
+            self._expire_deleted_posts()
+            self.deleted_posts.update(post_ids)
+
+    def _expire_deleted_posts(self) -> None:
+        now = time.monotonic()
+        if now < self._deleted_posts_until:
+            return
+        # Ids in deleted_posts were added during the last ttl seconds, unless nothing looked at them for longer
+        recent = now < self._deleted_posts_until + self.ttl
+        self._older_deleted_posts = self.deleted_posts if recent else PostIdSet()
+        self.deleted_posts = PostIdSet()
+        self._deleted_posts_until = now + self.ttl
+
+    def discard(self, kind: str, identifier: Hashable) -> None:
+        with self._lock:
+            self._entries.pop((kind, identifier), None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.deleted_posts.clear()
+            self._older_deleted_posts.clear()
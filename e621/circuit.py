@@ -0,0 +1,107 @@
+import threading
+import time
+from collections import deque
+from typing import Deque, Optional
+
+import requests
+
+__all__ = ["CircuitBreaker", "CircuitOpenError", "is_outage"]
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(requests.RequestException):
+    """Raised instead of making a request while the circuit breaker considers e621 to be down"""
+
+    def __init__(self, retry_after: float) -> None:
+        super().__init__(f"e621 looks unavailable, not sending requests for another {retry_after:.1f}s")
+        self.retry_after = retry_after
+
+
+def is_outage(response: requests.Response) -> bool:
+    """Whether the response means that e621 itself is in trouble, as opposed to the request being wrong"""
+    # Cloudflare answers with a challenge page that no api client can solve
+    return response.status_code >= 500 or response.headers.get("cf-mitigated") == "challenge"
+
+
+class CircuitBreaker:
+    """Fails requests fast while e621 is down instead of letting every one of them wait for the timeout
+
+    The breaker opens once at least min_requests of the last window requests were made and failure_rate of them
+    failed, i.e. didn't get a response at all or got a server error or a Cloudflare challenge.
+    While it is open, requests raise CircuitOpenError without being sent. After reset_timeout seconds it lets
+    half_open_probes requests through at a time. If one of them succeeds, the breaker closes again,
+    if one fails, it stays open for another reset_timeout seconds.
+    """
+
+    def __init__(
+        self,
+        failure_rate: float = 0.5,
+        window: int = 20,
+        min_requests: int = 5,
+        reset_timeout: float = 30.0,
+        half_open_probes: int = 1,
+    ) -> None:
+        if not 0 < failure_rate <= 1:
+            raise ValueError("failure_rate must be between 0 and 1")
+        if min_requests > window:
+            raise ValueError("min_requests can't be larger than window")
+        self.failure_rate = failure_rate
+        self.min_requests = min_requests
+        self.reset_timeout = reset_timeout
+        self.half_open_probes = half_open_probes
+        self._outcomes: Deque[bool] = deque(maxlen=window)
+        self._opened_at: Optional[float] = None
+        self._probes = 0
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        """Whether requests are let through: closed, open or half_open"""
+        with self._lock:
+            return self._state(time.monotonic())
+
+    def _state(self, now: float) -> str:
+        if self._opened_at is None:
+            return CLOSED
+        return OPEN if now - self._opened_at < self.reset_timeout else HALF_OPEN
+
+    def before_request(self) -> None:
+        """Raises CircuitOpenError if the request must not be sent. Every allowed request must be followed by record"""
+        with self._lock:
+            now = time.monotonic()
+            state = self._state(now)
+            if state == CLOSED:
+                return
+            if state == HALF_OPEN and self._probes < self.half_open_probes:
+                self._probes += 1
+                return
+            assert self._opened_at is not None
+            raise CircuitOpenError(max(self._opened_at + self.reset_timeout - now, 0.0))
+
+    def record(self, failed: bool) -> None:
+        with self._lock:
+            now = time.monotonic()
+            if self._opened_at is not None:
+                # Only probes are let through while the breaker isn't closed
+                self._probes = max(self._probes - 1, 0)
+                if failed:
+                    self._opened_at = now
+                elif self._state(now) == HALF_OPEN:
+                    self._opened_at = None
+                    self._outcomes.clear()
+                return
+            outcomes = self._outcomes
+            outcomes.append(failed)
+            if len(outcomes) >= self.min_requests and sum(outcomes) >= self.failure_rate * len(outcomes):
+                self._opened_at = now
+                self._probes = 0
+
+    def reset(self) -> None:
+        """Closes the breaker and forgets every recorded request"""
+        with self._lock:
+            self._opened_at = None
+            self._probes = 0
+            self._outcomes.clear()
@@ -0,0 +1,269 @@
+import functools
+import json
+import multiprocessing
+import os
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple, Type, Union
+
+from .api import E621
+from .exporters import ParquetExporter, encode_jsonl, encode_packed
+from .idset import PostIdSet
+from .models import Post
+from .ratelimit import DEFAULT_RATE, FileTokenBucket, RateLimiter
+from .session import MAX_PAGE_SIZE, ApiKey, Username
+from .store import LocalStore
+from .util import write_atomically
+
+__all__ = ["Shard", "ShardCheckpoint", "Crawler", "make_shards", "OUTPUT_FORMATS"]
+
+OUTPUT_FORMATS = ("jsonl", "packed", "parquet", "store")
+STORE_FILE_NAME = "store.sqlite3"
+
+
+@dataclass
+class Shard:
+    index: int
+    tags: str
+    min_id: int
+    max_id: int
+
+    @property
+    def query(self) -> str:
+        return f"{self.tags} id:{self.min_id}..{self.max_id}".strip()
+
+
+@dataclass
+class ShardCheckpoint:
+    # The lowest id written so far. The shard continues from the page before it (b<cursor>)
+    cursor: Optional[int] = None
+    done: bool = False
+    count: int = 0
+    # Size of the jsonl or packed file after the last completed page, anything after it is cut off on resume
+    offset: int = 0
+    # Number of parquet part files written
+    parts: int = 0
+
+
+def make_shards(tags: str, min_id: int, max_id: int, count: int) -> List[Shard]:
+    """Splits [min_id, max_id] into count ranges of equal width"""
+    count = max(1, min(count, max_id - min_id + 1))
+    width = (max_id - min_id + 1) / count
+    bounds = [min_id + round(i * width) for i in range(count)] + [max_id + 1]
+    return [Shard(i, tags, bounds[i], bounds[i + 1] - 1) for i in range(count)]
+
+
+class Crawler:
+    """Downloads every post matching tags into output_dir, split into shards that run in worker processes
+
+    All of the workers, as well as any other process on the host that uses the default FileTokenBucket,
+    share a single rate budget. Every shard checkpoints its cursor after each page,
+    so running the same crawl again after it was killed continues exactly where it stopped.
+
+    seen_ids is a PostIdSet file shared by several crawls: posts already in it aren't written again,
+    and once the crawl is done, the ids of the posts it wrote are added to it.
+    """
+
+    def __init__(
+        self,
+        output_dir: Union[str, Path],
+        tags: str = "",
+        id_range: Optional[Tuple[int, int]] = None,
+        shards: int = 8,
+        workers: int = 4,
+        output_format: str = "jsonl",
+        rate: float = DEFAULT_RATE,
+        auth: Optional[Tuple[Username, ApiKey]] = None,
+        api_class: Type[E621] = E621,
+        page_size: int = MAX_PAGE_SIZE,
+        seen_ids: Union[str, Path, None] = None,
+    ) -> None:
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError(f"output_format must be one of {OUTPUT_FORMATS}")
+        self.output_dir = Path(output_dir)
+        self.tags = tags
+        self.id_range = id_range
+        self.shard_count = shards
+        self.workers = workers
+        self.output_format = output_format
+        self.rate = rate
+        self.auth = auth
+        self.api_class = api_class
+        self.page_size = page_size
+        self.seen_ids = None if seen_ids is None else Path(seen_ids)
+
+    @property
+    def plan_path(self) -> Path:
+        return self.output_dir / "crawl.json"
+
+    def plan(self) -> List[Shard]:
+        """Returns the shards of this crawl. The first run fixes them, so a resumed crawl splits the same way"""
+        if "order:" in self.tags:
+            # The shards are walked with id cursors, which ignore any other order
+            raise ValueError("The crawler always goes through the posts by id, so the tags can't contain order:")
+        id_range = None if self.id_range is None else list(self.id_range)
+        if self.plan_path.exists():
+            plan = json.loads(self.plan_path.read_text())
+            planned = (plan["tags"], plan["output_format"], plan.get("id_range"))
+            if planned != (self.tags, self.output_format, id_range):
+                raise ValueError(f"{self.output_dir} contains a different crawl: {planned}")
+            return [Shard(**s) for s in plan["shards"]]
+
+        if self.id_range is not None:
+            min_id, max_id = self.id_range
+        else:
+            latest = self.api_class(self.auth).posts.search(self.tags, limit=1)
+            min_id, max_id = 1, latest[0].id if latest else 0
+        shards = make_shards(self.tags, min_id, max_id, self.shard_count) if max_id >= min_id else []
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        plan = {
+            "tags": self.tags,
+            "output_format": self.output_format,
+            "id_range": id_range,
+            "shards": [asdict(s) for s in shards],
+        }
+        write_atomically(self.plan_path, json.dumps(plan))
+        return shards
+
+    def run(self) -> Dict[int, ShardCheckpoint]:
+        shards = self.plan()
+        (self.output_dir / "checkpoints").mkdir(parents=True, exist_ok=True)
+        rate_limiter = FileTokenBucket(rate=self.rate)
+        jobs = [(shard, self.output_dir, self.output_format, self.page_size) for shard in shards]
+        with multiprocessing.Pool(
+            max(1, min(self.workers, len(jobs))),
+            initializer=_init_worker,
+            initargs=(self.api_class, self.auth, rate_limiter, self.seen_ids),
+        ) as pool:
+            results = pool.map(_crawl_shard, jobs, chunksize=1)
+        if self.seen_ids is not None:
+            self._update_seen_ids(shards)
+        return {shard.index: checkpoint for shard, checkpoint in zip(shards, results)}
+
+    def _update_seen_ids(self, shards: List[Shard]) -> None:
+        assert self.seen_ids is not None
+        seen = PostIdSet.load(self.seen_ids) if self.seen_ids.exists() else PostIdSet()
+        for shard in shards:
+            path = _written_ids_path(self.output_dir, shard)
+            if path.exists():
+                seen |= PostIdSet.load(path)
+        seen.save(self.seen_ids)
+
+
+class _ShardFile:
+    """The jsonl or packed file of a shard. It is cut back to the last checkpoint on resume and appended to"""
+
+    def __init__(self, path: Path, encode: Callable[[List[Dict[str, Any]]], bytes], truncate_to: Optional[int]) -> None:
+        self._encode = encode
+        if truncate_to is None:
+            self._file = path.open("wb")
+        else:
+            self._file = path.open("r+b")
+            self._file.truncate(truncate_to)
+            self._file.seek(truncate_to)
+
+    def write(self, records: List[Dict[str, Any]]) -> None:
+        self._file.write(self._encode(records))
+
+    def flush(self) -> int:
+        """Makes sure everything written so far is on disk. Returns the size of the file"""
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        return self._file.tell()
+
+    def close(self) -> None:
+        self._file.close()
+
+
+_worker_api: Optional[E621] = None
+_worker_seen_ids: Optional[PostIdSet] = None
+
+
+def _init_worker(
+    api_class: Type[E621],
+    auth: Optional[Tuple[Username, ApiKey]],
+    rate_limiter: RateLimiter,
+    seen_ids: Optional[Path] = None,
+) -> None:
+    global _worker_api, _worker_seen_ids
+    _worker_api = api_class(auth, client_name="e621-py-crawler", rate_limiter=rate_limiter)
+    if seen_ids is not None:
+        _worker_seen_ids = PostIdSet.load(seen_ids) if seen_ids.exists() else PostIdSet()
+
+
+def _written_ids_path(output_dir: Path, shard: Shard) -> Path:
+    return output_dir / "checkpoints" / f"shard-{shard.index:04}.idset"
+
+
+def _crawl_shard(job: Tuple[Shard, Path, str, int]) -> ShardCheckpoint:
+    shard, output_dir, output_format, page_size = job
+    assert _worker_api is not None
+    checkpoint_path = output_dir / "checkpoints" / f"shard-{shard.index:04}.json"
+    checkpoint = ShardCheckpoint()
+    if checkpoint_path.exists():
+        checkpoint = ShardCheckpoint(**json.loads(checkpoint_path.read_text()))
+    if checkpoint.done:
+        return checkpoint
+
+    path = None
+    encode: Optional[Callable[[List[Dict[str, Any]]], bytes]] = None
+    if output_format == "jsonl":
+        path, encode = output_dir / f"shard-{shard.index:04}.jsonl", encode_jsonl
+    elif output_format == "packed":
+        path, encode = output_dir / f"shard-{shard.index:04}.e621", functools.partial(encode_packed, Post)
+    if path is not None and checkpoint.cursor is not None:
+        if not path.exists() or path.stat().st_size < checkpoint.offset:
+            # The file lost pages that the checkpoint counts as written, so the shard starts over
+            checkpoint = ShardCheckpoint()
+    # The ids written by this shard, which are added to seen_ids once the crawl is done
+    written_ids_path = _written_ids_path(output_dir, shard)
+    written_ids = None
+    if _worker_seen_ids is not None:
+        written_ids = PostIdSet()
+        if written_ids_path.exists() and checkpoint.cursor is not None:
+            written_ids = PostIdSet.load(written_ids_path)
+
+    appended = None
+    store = None
+    if path is not None and encode is not None:
+        appended = _ShardFile(path, encode, checkpoint.offset if checkpoint.cursor is not None else None)
+    elif output_format == "store":
+        store = LocalStore(output_dir / STORE_FILE_NAME)
+
+    params: Dict[str, Any] = {
+        "tags": shard.query,
+        "limit": None,
+        "page": 1 if checkpoint.cursor is None else f"b{checkpoint.cursor}",
+    }
+    try:
+        for chunk in _worker_api.session.iter_paginated_get(
+            "posts", params, "posts", page_size=page_size, use_cursor=True, bulk=True
+        ):
+            cursor = min(post["id"] for post in chunk)
+            if _worker_seen_ids is not None:
+                chunk = [post for post in chunk if post["id"] not in _worker_seen_ids]
+            if appended is not None:
+                appended.write(chunk)
+                checkpoint.offset = appended.flush()
+            elif store is not None:
+                store.put_many("posts", chunk)
+            elif chunk:
+                part_path = output_dir / f"shard-{shard.index:04}-part-{checkpoint.parts:05}.parquet"
+                # A fixed schema, so that all of the parts can be read as one dataset
+                with ParquetExporter(part_path, Post) as part:
+                    part.write(chunk)
+                checkpoint.parts += 1
+            if written_ids is not None:
+                written_ids.update(post["id"] for post in chunk)
+                written_ids.save(written_ids_path)
+            checkpoint.cursor = cursor
+            checkpoint.count += len(chunk)
+            write_atomically(checkpoint_path, json.dumps(asdict(checkpoint)))
+        checkpoint.done = True
+        write_atomically(checkpoint_path, json.dumps(asdict(checkpoint)))
+    finally:
+        if appended is not None:
+            appended.close()
+        if store is not None:
+            store.close()
+    return checkpoint
@@ -9,6 +9,8 @@ from typing import (
     Callable,
     Dict,
     Generic,
+    Iterable,
+    Iterator,
     List,
     Optional,
     Sequence,
@@ -18,17 +20,21 @@ from typing import (
     overload,
 )
 
-from backports.cached_property import cached_property
+import requests
 from typing_extensions import Literal, ParamSpec, TypeAlias
 
-from e621.util import camel_to_snake
+from e621.util import camel_to_snake, locked_cached_property
 
 from .base_model import BaseModel
+from .cache import KnownMissingError
+from .circuit import CircuitOpenError, is_outage
 from .enums import OffsetRelation, PoolCategory, Rating, TagCategory
+from .idset import PostIdSet
 from .models import (
     Artist,
     ArtistVersion,
     AuthenticatedUser,
+    BlackList,
     Blip,
     BulkUpdateRequest,
     ForumPost,
@@ -51,6 +57,8 @@ from .models import (
     WikiPage,
     WikiPageVersion,
 )
+from .resolvers import ID_CHUNK_SIZE, load_related
+from .resultset import DiskResultSet
 
 if TYPE_CHECKING:
     from .api import E621
@@ -70,7 +78,7 @@ class PageOffset:
     id: int
 
     def __str__(self) -> str:
-        return f"{self.relation}{self.id}"
+        return f"{self.relation.value}{self.id}"
 
 
 _METHOD_MAPPER = {
@@ -82,6 +90,29 @@ _METHOD_MAPPER = {
 }
 
 
+def _is_unreachable(error: requests.RequestException) -> bool:
+    if isinstance(error, requests.HTTPError):
+        return error.response is not None and is_outage(error.response)
+    return isinstance(error, (CircuitOpenError, requests.ConnectionError, requests.Timeout))
+
+
+def _status(error: requests.HTTPError) -> Optional[int]:
+    return None if error.response is None else error.response.status_code
+
+
+def _is_deleted(model: BaseModel) -> bool:
+    flags = getattr(model, "flags", None)
+    return bool(getattr(flags, "deleted", False) or getattr(model, "is_deleted", False))
+
+
+def _known_missing(url: str) -> KnownMissingError:
+    response = requests.Response()
+    response.status_code = 404
+    response.reason = "Not Found"
+    response.url = url
+    return KnownMissingError(f"404 Client Error: Not Found for url: {url} (cached)", response=response)
+
+
 class BaseEndpoint(Generic[Model]):
     _model: Type[Model]
     _root_entity_name: str
@@ -103,7 +134,46 @@ class BaseEndpoint(Generic[Model]):
             setattr(cls, method_name, _generate_endpoint_method(cls, getattr(cls, method_name)))
 
     def _default_get(self, identifier: Any, **kwargs: Any) -> Model:
-        return self._model.from_response(self._api.session.get(f"{self._url}/{identifier}", **kwargs), self._api)
+        api = self._api
+        url = f"{self._url}/{identifier}"
+        # Extra request arguments could change the answer, so those gets are never answered from the negative cache
+        negative = None if kwargs else api.negative_cache
+        if negative is not None:
+            gone, deleted = negative.lookup(self._url, identifier)
+            if deleted is not None:
+                return deleted  # type: ignore
+            if gone:
+                raise _known_missing(api.session.base_url.format(endpoint=url))
+        try:
+            response = api.session.get(url, **kwargs)
+        except requests.RequestException as e:
+            if negative is not None and isinstance(e, requests.HTTPError) and _status(e) == 404:
+                negative.add_missing(self._url, identifier)
+            if api.session.circuit_breaker is None or not _is_unreachable(e):
+                raise
+            stale = self._last_known(identifier)
+            if stale is None:
+                raise
+            return stale
+        model = self._model.from_response(response, api)
+        if negative is not None and _is_deleted(model):
+            negative.add_deleted(self._url, identifier, model)
+        if api.entity_cache is not None:
+            api.entity_cache.put(model, identifier)
+        return model
+
+    def _last_known(self, identifier: Any) -> Optional[Model]:
+        """The last version of the entity that was seen, from the entity cache or the local store of the client"""
+        api = self._api
+        if api.entity_cache is not None:
+            cached = api.entity_cache.get(self._model, identifier, stale=True)
+            if cached is not None:
+                return cached
+        if api.store is not None and isinstance(identifier, int):
+            raw = api.store.get(self._url, identifier)
+            if raw is not None:
+                return self._model._validate(raw, api)
+        return None
 
     def _default_search(
         self, params: Dict[str, Any], limit: Optional[int], page: int = 1, ignore_pagination=False
@@ -120,6 +190,74 @@ class BaseEndpoint(Generic[Model]):
         else:
             return self._model.from_response(self._api.session.get(self._url, params=params), self._api, expect=list)
 
+    def _default_iter_search(
+        self,
+        params: Dict[str, Any],
+        limit: Optional[int] = None,
+        page: Union[PageOffset, PageNumber] = 1,
+        use_cursor: bool = False,
+    ) -> Iterator[List[Model]]:
+        """Lazily yields the search results page by page until limit results were returned or the results ran out"""
+        params = params.copy()
+        params.update({"limit": limit, "page": page})
+        for chunk in self._api.session.iter_paginated_get(
+            self._url, params, self._root_entity_name, use_cursor=use_cursor, bulk=True
+        ):
+            yield self._model.from_list(chunk, self._api)
+
+    def _default_iter_stream(
+        self,
+        params: Dict[str, Any],
+        limit: Optional[int] = None,
+        page: Union[PageOffset, PageNumber] = 1,
+        use_cursor: bool = False,
+    ) -> Iterator[Model]:
+        """Same as _default_iter_search, but decodes the pages while they download and yields one model at a time"""
+        params = params.copy()
+        params.update({"limit": limit, "page": page})
+        for item in self._api.session.iter_paginated_items(
+            self._url, params, self._root_entity_name, use_cursor=use_cursor, stream=True, bulk=True
+        ):
+            yield self._model._validate(item, self._api)
+
+    def _default_search_to_disk(
+        self,
+        params: Dict[str, Any],
+        limit: Optional[int] = None,
+        page: Union[PageOffset, PageNumber] = 1,
+        use_cursor: bool = False,
+        path: Union[str, Path, None] = None,
+        keep: Optional[Callable[[Dict[str, Any]], bool]] = None,
+    ) -> DiskResultSet[Model]:
+        """Same as _default_search with ignore_pagination, but the results go to a DiskResultSet instead of memory
+
+        keep decides which of the raw results are stored
+        """
+        params = params.copy()
+        params.update({"limit": limit, "page": page})
+        results = DiskResultSet(self._model, self._api, path)
+        items = self._api.session.iter_paginated_items(
+            self._url, params, self._root_entity_name, use_cursor=use_cursor, stream=True
+        )
+        results.extend(items if keep is None else filter(keep, items))
+        return results
+
+    def _default_search_ids(
+        self,
+        params: Dict[str, Any],
+        limit: Optional[int] = None,
+        page: Union[PageOffset, PageNumber] = 1,
+        use_cursor: bool = False,
+        keep: Optional[Callable[[Dict[str, Any]], bool]] = None,
+    ) -> PostIdSet:
+        """Same as _default_search with ignore_pagination, but only collects the ids, without building any models"""
+        params = params.copy()
+        params.update({"limit": limit, "page": page})
+        items = self._api.session.iter_paginated_items(
+            self._url, params, self._root_entity_name, use_cursor=use_cursor, stream=True
+        )
+        return PostIdSet(item["id"] for item in (items if keep is None else filter(keep, items)))
+
     def _default_create(self, params: Dict[str, Any], files: Optional[Dict[str, Any]] = None) -> Model:
         return self._model.from_response(self._api.session.post(self._url, params=params, files=files), self._api)
 
@@ -193,22 +331,37 @@ class Posts(BaseEndpoint[Post], generate=["update"]):
     _model = Post
 
     @overload
-    def get(self, post_id: int) -> Post:
+    def get(self, post_id: int, include: Iterable[str] = ()) -> Post:
         pass
 
     @overload
-    def get(self, post_id: List[int]) -> List[Post]:
+    def get(self, post_id: List[int], include: Iterable[str] = ()) -> List[Post]:
         pass
 
-    def get(self, post_id: Union[int, List[int]]) -> Union[Post, List[Post]]:
+    def get(self, post_id: Union[int, List[int]], include: Iterable[str] = ()) -> Union[Post, List[Post]]:
+        """include eagerly loads related entities, see e621.resolvers.load_related for the possible values"""
         if isinstance(post_id, int):
-            return self._default_get(post_id)
-        else:
-            return self._default_search(
-                {"tags": f"id:{','.join([str(id) for id in post_id])}"},
-                limit=len(post_id),
-                ignore_pagination=True,
-            )
+            post = self._default_get(post_id)
+            load_related([post], self._api, include)
+            return post
+        negative = self._api.negative_cache
+        if negative is not None:
+            post_id = negative.without_deleted_posts(post_id)
+            if not post_id:
+                return []
+        posts = self._default_search(
+            {"tags": f"id:{','.join([str(id) for id in post_id])}"},
+            limit=len(post_id),
+            ignore_pagination=True,
+        )
+        # e621 ignores the ids after the first ID_CHUNK_SIZE, so only shorter lists tell which posts are gone.
+        # Ids above the newest post found may belong to posts that just don't exist yet, so they aren't remembered
+        if negative is not None and posts and len(post_id) <= ID_CHUNK_SIZE:
+            found = {post.id for post in posts if not post.flags.deleted}
+            newest = max(post.id for post in posts)
+            negative.add_deleted_posts(id for id in post_id if id not in found and id < newest)
+        load_related(posts, self._api, include)
+        return posts
 
     def search(
         self,
@@ -216,10 +369,84 @@ class Posts(BaseEndpoint[Post], generate=["update"]):
         limit: Optional[int] = None,
         page: int = 1,
         ignore_pagination: bool = False,
+        include: Iterable[str] = (),
     ) -> List[Post]:
+        """include eagerly loads related entities, see e621.resolvers.load_related for the possible values"""
         if isinstance(tags, list):
             tags = " ".join(tags)
-        posts = self._default_search({"tags": tags}, limit, page, ignore_pagination)
+        posts = self._filter_blacklisted(self._default_search({"tags": tags}, limit, page, ignore_pagination))
+        load_related(posts, self._api, include)
+        return posts
+
+    def iter_search(
+        self,
+        tags: Union[str, List[str]] = "",
+        limit: Optional[int] = None,
+        page: Union[PageOffset, PageNumber] = 1,
+        include: Iterable[str] = (),
+        stream: bool = False,
+    ) -> Iterator[Post]:
+        """Lazily yields the posts that match the tags, requesting the pages one at a time
+
+        If limit is None, yields all of the matching posts. Related entities from include are loaded
+        for the whole page at once before its posts are yielded.
+        If stream is True, every page is parsed while it downloads and each post is yielded as soon as it arrives,
+        so only one post at a time is held in memory. This can't be combined with include,
+        which needs the whole page.
+        If page is a PageOffset, the posts come in its direction, e.g. everything newer than an id for AFTER.
+        """
+        if isinstance(tags, list):
+            tags = " ".join(tags)
+        # Id cursors only work when the posts are ordered by id
+        use_cursor = "order:" not in tags
+        if stream:
+            if include:
+                raise ValueError("include loads the related entities of whole pages, so it can't be used with stream")
+            for post in self._default_iter_stream({"tags": tags}, limit, page, use_cursor):
+                yield from self._filter_blacklisted([post])
+            return
+        for posts in self._default_iter_search({"tags": tags}, limit, page, use_cursor):
+            posts = self._filter_blacklisted(posts)
+            load_related(posts, self._api, include)
+            yield from posts
+
+    def search_to_disk(
+        self,
+        tags: Union[str, List[str]] = "",
+        limit: Optional[int] = None,
+        page: Union[PageOffset, PageNumber] = 1,
+        path: Union[str, Path, None] = None,
+    ) -> DiskResultSet[Post]:
+        """Same as search with ignore_pagination, for queries whose results don't fit in memory
+
+        The posts are written to disk while they download, and are only turned into Post objects when accessed.
+        If limit is None, all of the matching posts are fetched. See DiskResultSet for what path does.
+        """
+        if isinstance(tags, list):
+            tags = " ".join(tags)
+        keep = None
+        if self._api.logged_in:
+            keep = functools.partial(_not_blacklisted, self._api.users.me.blacklist)
+        return self._default_search_to_disk({"tags": tags}, limit, page, "order:" not in tags, path, keep)
+
+    def search_ids(
+        self,
+        tags: Union[str, List[str]] = "",
+        limit: Optional[int] = None,
+        page: Union[PageOffset, PageNumber] = 1,
+    ) -> PostIdSet:
+        """The ids of the posts that search with ignore_pagination would return, e.g. for set algebra with PostIdSet
+
+        If limit is None, the ids of all of the matching posts are fetched.
+        """
+        if isinstance(tags, list):
+            tags = " ".join(tags)
+        keep = None
+        if self._api.logged_in:
+            keep = functools.partial(_not_blacklisted, self._api.users.me.blacklist)
+        return self._default_search_ids({"tags": tags}, limit, page, "order:" not in tags, keep)
+
+    def _filter_blacklisted(self, posts: List[Post]) -> List[Post]:
         if self._api.logged_in:
             # FIXME: this works if the person put the tag correctly, but doesn't work with tag aliases
             return [p for p in posts if not self._api.users.me.blacklist.intersects(p.all_tags)]
@@ -285,6 +512,10 @@ class Posts(BaseEndpoint[Post], generate=["update"]):
         ...
 
 
+def _not_blacklisted(blacklist: BlackList, raw_post: Dict[str, Any]) -> bool:
+    return not blacklist.intersects({tag for group in raw_post["tags"].values() for tag in group})
+
+
 class Favorites(BaseEndpoint[Post], generate=["delete"]):
     _model = Post
     _root_entity_name = "posts"
@@ -298,6 +529,10 @@ class Favorites(BaseEndpoint[Post], generate=["delete"]):
     ) -> List[Post]:
         return self._default_search({"user_id": user_id}, limit, page, ignore_pagination)
 
+    def search_ids(self, user_id: Optional[int] = None, limit: Optional[int] = None) -> PostIdSet:
+        """The ids of the favorites of the user (or of the logged in user). If limit is None, all of them"""
+        return self._default_search_ids({"user_id": user_id}, limit)
+
     def create(self, post_id: int) -> Post:
         return self._default_create({"post_id": post_id})
 
@@ -477,11 +712,13 @@ class PostFlags(BaseEndpoint[PostFlag], generate=["search"]):
 class Users(BaseEndpoint[User], generate=["search", "get"]):
     _model = User
 
-    @cached_property
+    @locked_cached_property
     def me(self) -> AuthenticatedUser:
         if not self._api.logged_in:
             raise ValueError("Cannot access Users.me for a non-authenticated user")
-        return AuthenticatedUser.from_response(self._api.session.get(f"users/{self._api.username}"), self._api)
+        me = AuthenticatedUser.from_response(self._api.session.get(f"users/{self._api.username}"), self._api)
+        self._api.session.configure_from_user(me)
+        return me
 
     def get(self, user_identifier: Union[UserID, UserName]) -> User:
         ...
@@ -0,0 +1,245 @@
+import functools
+import json
+import sqlite3
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Type, Union
+
+from .base_model import BaseModel, _is_list, _is_model, _strip_optional, fields_of
+from .serialization import RECORD_HEADER, pack
+from .util import camel_to_snake
+
+__all__ = [
+    "Exporter",
+    "JsonlExporter",
+    "PackedExporter",
+    "ParquetExporter",
+    "SqliteExporter",
+    "arrow_schema",
+    "encode_jsonl",
+    "encode_packed",
+    "export",
+    "to_record",
+]
+
+Record = Dict[str, Any]
+
+
+class Exporter:
+    """Writes batches of raw entities somewhere. Usable as a context manager"""
+
+    def write(self, records: List[Record]) -> None:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+    def __enter__(self) -> "Exporter":
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
+
+
+class JsonlExporter(Exporter):
+    """Writes one JSON object per line"""
+
+    def __init__(self, path: Union[str, Path]) -> None:
+        self.path = Path(path)
+        self._file = self.path.open("wb")
+
+    def write(self, records: List[Record]) -> None:
+        self._file.write(encode_jsonl(records))
+
+    def close(self) -> None:
+        self._file.close()
+
+
+class PackedExporter(Exporter):
+    """Writes length-prefixed records in the compact format of e621.serialization.pack
+
+    The files are several times smaller than JSON lines and can be opened as a DiskResultSet of the model.
+    """
+
+    def __init__(self, path: Union[str, Path], model: Type[BaseModel]) -> None:
+        self.path = Path(path)
+        self.model = model
+        self._file = self.path.open("wb")
+
+    def write(self, records: List[Record]) -> None:
+        self._file.write(encode_packed(self.model, records))
+
+    def close(self) -> None:
+        self._file.close()
+
+
+def encode_jsonl(records: List[Record]) -> bytes:
+    """The bytes JsonlExporter writes for a batch, e.g. for appending it to a file of your own"""
+    return b"".join(json.dumps(r, ensure_ascii=False).encode() + b"\n" for r in records)
+
+
+def encode_packed(model: Type[BaseModel], records: List[Record]) -> bytes:
+    """The bytes PackedExporter writes for a batch"""
+    packed = [pack(model, r) for r in records]
+    return b"".join(RECORD_HEADER.pack(len(data)) + data for data in packed)
+
+
+class ParquetExporter(Exporter):
+    """Writes a single Parquet file, one row group per batch. Requires pyarrow
+
+    If model is given, the columns follow arrow_schema(model), so every file written for a model has the same schema
+    no matter which values its first batch happened to contain. Otherwise the schema is inferred from the first batch.
+    """
+
+    def __init__(self, path: Union[str, Path], model: Optional[Type[BaseModel]] = None) -> None:
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError as e:
+            raise ImportError("ParquetExporter requires pyarrow: pip install pyarrow") from e
+        self._pa = pyarrow
+        self._pq = pyarrow.parquet
+        self.path = Path(path)
+        self._writer: Any = None
+        self._schema = None if model is None else arrow_schema(model)
+        self._json_columns = [] if model is None else _opaque_fields(model)
+
+    def write(self, records: List[Record]) -> None:
+        if not records:
+            return
+        if self._schema is None:
+            table = self._pa.Table.from_pylist(records)
+        else:
+            if self._json_columns:
+                records = [_encode_fields(r, self._json_columns) for r in records]
+            table = self._pa.Table.from_pylist(records, schema=self._schema)
+        if self._writer is None:
+            self._writer = self._pq.ParquetWriter(str(self.path), table.schema)
+        self._writer.write_table(table.cast(self._writer.schema))
+
+    def close(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+
+
+class SqliteExporter(Exporter):
+    """Writes entities into a table of an SQLite database, with a column for every field of the model
+
+    Lists and nested objects are stored as JSON text. The table is called after the model (posts, pools, post_sets...)
+    unless table says otherwise. Every batch is inserted by a single executemany in a transaction of its own,
+    and rows with the same id are replaced.
+    """
+
+    def __init__(self, path: Union[str, Path], model: Type[BaseModel], table: Optional[str] = None) -> None:
+        self.path = Path(path)
+        self.model = model
+        self.table = table or camel_to_snake(model.__name__) + "s"
+        columns = [(alias, _sqlite_type(annotation)) for _, alias, annotation in fields_of(model)]
+        self._aliases = [alias for alias, _ in columns]
+        self._connection = sqlite3.connect(str(self.path), timeout=60)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        definitions = [f'"{alias}" {type}' + (" PRIMARY KEY" if alias == "id" else "") for alias, type in columns]
+        with self._connection as db:
+            db.execute(f'CREATE TABLE IF NOT EXISTS "{self.table}" ({", ".join(definitions)})')
+        names = ", ".join(f'"{alias}"' for alias in self._aliases)
+        placeholders = ", ".join("?" * len(self._aliases))
+        self._insert = f'INSERT OR REPLACE INTO "{self.table}" ({names}) VALUES ({placeholders})'
+
+    def write(self, records: List[Record]) -> None:
+        rows = ([_sqlite_value(r.get(alias)) for alias in self._aliases] for r in records)
+        with self._connection as db:
+            db.executemany(self._insert, rows)
+
+    def close(self) -> None:
+        self._connection.close()
+
+
+def export(results: Iterable[Union[Record, BaseModel]], exporter: Exporter, batch_size: int = 1000) -> int:
+    """Writes everything results yields, e.g. api.posts.iter_search(...), in batches of batch_size
+
+    Only one batch is held in memory at a time. Models are converted with to_record. Returns the number of results
+    """
+    if batch_size < 1:
+        raise ValueError("batch_size must be at least 1")
+    count = 0
+    batch: List[Record] = []
+    for result in results:
+        batch.append(to_record(result) if isinstance(result, BaseModel) else result)
+        if len(batch) >= batch_size:
+            exporter.write(batch)
+            count += len(batch)
+            batch = []
+    if batch:
+        exporter.write(batch)
+        count += len(batch)
+    return count
+
+
+def to_record(model: BaseModel) -> Record:
+    """The raw entity, as returned by the api, that a model was built from"""
+    return {alias: _to_raw(getattr(model, name)) for name, alias in _aliases_of(type(model))}
+
+
+def _to_raw(value: Any) -> Any:
+    if isinstance(value, BaseModel):
+        return to_record(value)
+    if isinstance(value, list):
+        return [_to_raw(v) for v in value]
+    return value
+
+
+@functools.lru_cache(maxsize=None)
+def _aliases_of(model: Type[BaseModel]) -> List[Tuple[str, str]]:
+    return [(name, alias) for name, alias, _ in fields_of(model)]
+
+
+def arrow_schema(model: Type[BaseModel]) -> Any:
+    """The pyarrow schema of a model. Nested models become structs, lists (such as the tags) become list columns
+    and fields of unknown types become JSON strings
+    """
+    try:
+        import pyarrow
+    except ImportError as e:
+        raise ImportError("arrow_schema requires pyarrow: pip install pyarrow") from e
+    return pyarrow.schema(_arrow_fields(pyarrow, model))
+
+
+def _arrow_fields(pa: Any, model: Type[BaseModel]) -> List[Any]:
+    return [pa.field(alias, _arrow_type(pa, annotation)) for _, alias, annotation in fields_of(model)]
+
+
+def _arrow_type(pa: Any, annotation: Any) -> Any:
+    annotation = _strip_optional(annotation)
+    if _is_model(annotation):
+        return pa.struct(_arrow_fields(pa, annotation))
+    if _is_list(annotation):
+        return pa.list_(_arrow_type(pa, annotation.__args__[0]))
+    scalars = {bool: pa.bool_(), int: pa.int64(), float: pa.float64(), str: pa.string()}
+    return scalars.get(annotation, pa.string())
+
+
+def _sqlite_type(annotation: Any) -> str:
+    return {bool: "INTEGER", int: "INTEGER", float: "REAL"}.get(_strip_optional(annotation), "TEXT")
+
+
+def _sqlite_value(value: Any) -> Any:
+    return json.dumps(value, ensure_ascii=False) if isinstance(value, (list, dict)) else value
+
+
+def _opaque_fields(model: Type[BaseModel]) -> List[str]:
+    """Aliases of the top-level fields whose values have no arrow type of their own and are stored as JSON"""
+    opaque = []
+    for _, alias, annotation in fields_of(model):
+        annotation = _strip_optional(annotation)
+        if not (_is_model(annotation) or _is_list(annotation) or annotation in (bool, int, float, str)):
+            opaque.append(alias)
+    return opaque
+
+
+def _encode_fields(record: Record, aliases: List[str]) -> Record:
+    record = dict(record)
+    for alias in aliases:
+        value = record.get(alias)
+        if value is not None and not isinstance(value, str):
+            record[alias] = json.dumps(value, ensure_ascii=False)
+    return record
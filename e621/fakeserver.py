@@ -0,0 +1,360 @@
+import json
+import random
+import threading
+import time
+import typing
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple, Type, Union
+from urllib.parse import parse_qsl, urlsplit
+
+from . import endpoints
+from .api import _ENDPOINTS, E621
+from .base_model import BaseModel, fields_of
+from .endpoints import BaseEndpoint
+from .models import AuthenticatedUser
+from .multiplex import TagQuery
+from .session import MAX_PAGE_SIZE
+from .transport import Cassette
+
+__all__ = ["FakeE621Server", "synthesize", "synthesize_post"]
+
+# e621's page size when the request has no limit
+DEFAULT_PAGE_SIZE = 75
+_RATINGS = "sqe"
+
+
+def synthesize(model: Type[BaseModel], id: int, seed: int = 0, max_id: int = 1000) -> Dict[str, Any]:
+    """Makes up a raw entity with the shape of model. The same arguments always produce the same entity"""
+    rng = random.Random(f"{seed}:{model.__name__}:{id}")
+    return _synthesize_model(model, rng, id, max_id)
+
+
+def _synthesize_model(model: Type[BaseModel], rng: random.Random, id: int, max_id: int) -> Dict[str, Any]:
+    entity = {}
+    for name, alias, annotation in fields_of(model):
+        entity[alias] = _synthesize_value(annotation, name, rng, id, max_id)
+    return entity
+
+
+def _synthesize_value(type_: Any, name: str, rng: random.Random, id: int, max_id: int) -> Any:
+    origin = typing.get_origin(type_)
+    if origin is Union:
+        return _synthesize_value(next(t for t in typing.get_args(type_) if t is not type(None)), name, rng, id, max_id)
+    if origin is list:
+        (item,) = typing.get_args(type_)
+        return [_synthesize_value(item, name, rng, id, max_id) for _ in range(rng.randint(0, 4))]
+    if origin is dict:
+        return {}
+    if isinstance(type_, type) and issubclass(type_, BaseModel):
+        return _synthesize_model(type_, rng, id, max_id)
+    if type_ is bool:
+        return False
+    if type_ is int:
+        if name == "id":
+            return id
+        if name.endswith("_id") or name.endswith("_ids"):
+            return rng.randint(1, max_id)
+        return rng.randint(0, 1000)
+    if type_ is float:
+        return round(rng.uniform(0, 10), 2)
+    if type_ is str:
+        if name.endswith("_at"):
+            return f"2022-{rng.randint(1, 12):02}-{rng.randint(1, 28):02}T12:00:00.000-04:00"
+        if name == "md5":
+            return "%032x" % rng.getrandbits(128)
+        if name.endswith("url") or name == "urls":
+            return f"https://static1.e621.net/data/{rng.getrandbits(64):016x}.png"
+        return f"{name}_{rng.randint(0, 10 ** 6)}"
+    return None
+
+
+def synthesize_post(id: int, seed: int = 0, max_id: int = 10000, vocabulary: int = 500) -> Dict[str, Any]:
+    """A synthetic post with tags drawn from tag_0..tag_<vocabulary - 1>, the lower the number the more common"""
+    from .models import Post, Tags
+
+    post = synthesize(Post, id, seed, max_id)
+    rng = random.Random(f"{seed}:tags:{id}")
+    # A long tail, like real tags: a few tags are on most posts, most tags are on a few
+    general = {f"tag_{min(int(rng.paretovariate(1.2)) - 1, vocabulary - 1)}" for _ in range(rng.randint(5, 30))}
+    post["tags"] = {alias: [] for _, alias, _ in fields_of(Tags)}
+    post["tags"]["general"] = sorted(general)
+    post["tags"]["species"] = [f"species_{rng.randrange(50)}"]
+    post["rating"] = _RATINGS[rng.randrange(len(_RATINGS))]
+    post["pools"] = []
+    post["relationships"].update(parent_id=None, has_children=False, has_active_children=False, children=[])
+    return post
+
+
+class _Matcher:
+    __slots__ = ("all_tags", "rating")
+
+    def __init__(self, post: Dict[str, Any]) -> None:
+        self.all_tags = {tag for tags in post["tags"].values() for tag in tags}
+        self.rating = post["rating"]
+
+
+class FakeE621Server:
+    """A local stand-in for e621 for tests and benchmarks
+
+    Requests found in the cassette are answered from it. Everything else gets synthetic entities
+    shaped like the models: post_count posts with ids 1..post_count and entity_count of everything else.
+    Post searches understand plain tags, -tags, ~tags, rating:, id:lo..hi and id:1,2,3,
+    and all of page=<n>, b<id> and a<id>.
+    The posts in deleted_posts are flagged as deleted and left out of searches, like e621 does.
+    Every response is delayed by latency plus up to jitter seconds, and slow_rate of them by slow_latency more,
+    like the occasional stragglers of a real server. Every rate_limit_every-th request
+    is answered with 429 and a Retry-After header, and error_rate of the others fail with a 500.
+
+    with FakeE621Server() as server:
+        api = server.api()
+    """
+
+    def __init__(
+        self,
+        cassette: Union[Cassette, str, Path, None] = None,
+        post_count: int = 10000,
+        entity_count: int = 1000,
+        max_page_size: int = MAX_PAGE_SIZE,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        slow_rate: float = 0.0,
+        slow_latency: float = 0.0,
+        rate_limit_every: int = 0,
+        retry_after: int = 1,
+        error_rate: float = 0.0,
+        tag_vocabulary: int = 500,
+        seed: int = 0,
+        deleted_posts: Iterable[int] = (),
+        host: str = "127.0.0.1",
+        port: int = 0,
+    ) -> None:
+        if cassette is not None and not isinstance(cassette, Cassette):
+            cassette = Cassette.load(cassette)
+        self.cassette = cassette
+        self.post_count = post_count
+        self.entity_count = entity_count
+        self.max_page_size = max_page_size
+        self.latency = latency
+        self.jitter = jitter
+        self.slow_rate = slow_rate
+        self.slow_latency = slow_latency
+        self.rate_limit_every = rate_limit_every
+        self.retry_after = retry_after
+        self.error_rate = error_rate
+        self.tag_vocabulary = tag_vocabulary
+        self.seed = seed
+        self.deleted_posts = set(deleted_posts)
+        self.requests_served = 0
+        self.connections_opened = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._posts: Dict[int, Tuple[Dict[str, Any], _Matcher]] = {}
+        endpoint_classes = [getattr(endpoints, class_name) for class_name in _ENDPOINTS.values()]
+        self._routes = {cls._url: cls for cls in endpoint_classes}
+        self._httpd = ThreadingHTTPServer((host, port), _make_handler(self))
+        self._httpd.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/{{endpoint}}.json"
+
+    def api(self, **kwargs: Any) -> E621:
+        """An E621 client that talks to this server"""
+        return E621(base_url=self.base_url, **kwargs)
+
+    def start(self) -> "FakeE621Server":
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._httpd.serve_forever, name="FakeE621Server", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        if self._thread is not None:
+            self._httpd.shutdown()
+            self._thread.join()
+            self._thread = None
+        self._httpd.server_close()
+
+    def serve_forever(self) -> None:
+        self._httpd.serve_forever()
+
+    def __enter__(self) -> "FakeE621Server":
+        return self.start()
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.stop()
+
+    def handle(self, method: str, url: str) -> Tuple[int, Dict[str, str], bytes]:
+        """Returns the status, headers and body of the response to a request"""
+        with self._lock:
+            self.requests_served += 1
+            served = self.requests_served
+            delay = self.latency + self._rng.uniform(0, self.jitter)
+            if self.slow_rate and self._rng.random() < self.slow_rate:
+                delay += self.slow_latency
+            fail = self._rng.random() < self.error_rate
+        if delay > 0:
+            time.sleep(delay)
+        if self.rate_limit_every and served % self.rate_limit_every == 0:
+            return 429, {"Retry-After": str(self.retry_after)}, b'{"success":false,"reason":"Rate limited"}'
+        if fail:
+            return 500, {}, b'{"success":false,"reason":"Internal error"}'
+
+        if self.cassette is not None:
+            interaction = self.cassette.find(method, url)
+            if interaction is not None:
+                return interaction.status, interaction.headers, interaction.body.encode("utf-8")
+
+        parts = urlsplit(url)
+        path = parts.path.strip("/")
+        if path.endswith(".json"):
+            path = path[: -len(".json")]
+        params = dict(parse_qsl(parts.query, keep_blank_values=True))
+        route, _, identifier = path.partition("/")
+        endpoint = self._routes.get(route)
+        if endpoint is None:
+            return 404, {}, b'{"success":false,"reason":"not found"}'
+        if method == "DELETE":
+            return 204, {}, b""
+        if method in ("PATCH", "PUT"):
+            return 200, {}, b"{}"
+        if method == "POST":
+            return 200, {}, json.dumps(self._entity(endpoint, self._new_id(endpoint))).encode()
+
+        if identifier:
+            if route == "users" and not identifier.isdigit():
+                # Users.me looks the account up by its name
+                return 200, {}, json.dumps(self._account(identifier)).encode()
+            if not identifier.isdigit() or not 1 <= int(identifier) <= self._count(endpoint):
+                return 404, {}, b'{"success":false,"reason":"not found"}'
+            entity = self._entity(endpoint, int(identifier))
+            if endpoint._root_entity_name == "posts":
+                return 200, {}, json.dumps({"post": entity}).encode()
+            return 200, {}, json.dumps(entity).encode()
+
+        entities = self._search(endpoint, params)
+        if endpoint._root_entity_name == "posts":
+            return 200, {}, json.dumps({"posts": entities}).encode()
+        return 200, {}, json.dumps(entities).encode()
+
+    def _count(self, endpoint: Type[BaseEndpoint]) -> int:
+        return self.post_count if endpoint._root_entity_name == "posts" else self.entity_count
+
+    def _new_id(self, endpoint: Type[BaseEndpoint]) -> int:
+        return self._count(endpoint) + 1
+
+    def _entity(self, endpoint: Type[BaseEndpoint], id: int) -> Dict[str, Any]:
+        if endpoint._root_entity_name == "posts":
+            return self._post(id)[0]
+        return synthesize(endpoint._model, id, self.seed, self.post_count)
+
+    def _account(self, name: str) -> Dict[str, Any]:
+        account = synthesize(AuthenticatedUser, 1, self.seed, self.post_count)
+        account.update(name=name, blacklisted_tags="")
+        return account
+
+    def _post(self, id: int) -> Tuple[Dict[str, Any], _Matcher]:
+        cached = self._posts.get(id)
+        if cached is None:
+            post = synthesize_post(id, self.seed, self.post_count, self.tag_vocabulary)
+            post["flags"]["deleted"] = id in self.deleted_posts
+            cached = self._posts[id] = (post, _Matcher(post))
+        return cached
+
+    def _search(self, endpoint: Type[BaseEndpoint], params: Dict[str, str]) -> List[Dict[str, Any]]:
+        limit = min(int(params.get("limit") or DEFAULT_PAGE_SIZE), self.max_page_size)
+        page = params.get("page") or "1"
+        low, high = 1, self._count(endpoint)
+        query = None
+        ids = params.get("search[id]")
+        is_posts = endpoint._root_entity_name == "posts"
+        if is_posts:
+            tags = []
+            for tag in params.get("tags", "").split():
+                if tag.startswith("id:") and ".." in tag:
+                    lo, hi = tag[len("id:") :].split("..")
+                    low, high = max(low, int(lo or low)), min(high, int(hi or high))
+                elif tag.startswith("id:"):
+                    ids = tag[len("id:") :]
+                elif ":" not in tag or tag.lstrip("-~").startswith("rating:"):
+                    tags.append(tag)
+            query = TagQuery.parse(tags)
+        if ids:
+            wanted = sorted({int(i) for i in ids.split(",") if i.isdigit() and low <= int(i) <= high}, reverse=True)
+            candidates: Iterator[int] = iter(wanted)
+        elif page[0] == "b":
+            candidates = iter(range(min(high, int(page[1:]) - 1), low - 1, -1))
+        elif page[0] == "a":
+            # The posts right after the cursor, newest first
+            after = max(low, int(page[1:]) + 1)
+            candidates = iter(sorted(self._matching(endpoint, query, range(after, high + 1), limit), reverse=True))
+        else:
+            skip = (int(page) - 1) * limit
+            if _filters(query) or (is_posts and self.deleted_posts):
+                found = self._matching(endpoint, query, iter(range(high, low - 1, -1)), skip + limit)[skip:]
+            else:
+                found = list(range(high - skip, max(low, high - skip - limit + 1) - 1, -1))
+            return [self._entity(endpoint, i) for i in found]
+        return [self._entity(endpoint, i) for i in self._matching(endpoint, query, candidates, limit)]
+
+    def _matching(
+        self, endpoint: Type[BaseEndpoint], query: Optional[TagQuery], candidates: Any, limit: int
+    ) -> List[int]:
+        if endpoint._root_entity_name == "posts" and self.deleted_posts:
+            candidates = (i for i in candidates if i not in self.deleted_posts)
+        if query is None or not _filters(query):
+            return [i for _, i in zip(range(limit), candidates)]
+        found = []
+        for i in candidates:
+            if query.matches(self._post(i)[1]):  # type: ignore
+                found.append(i)
+                if len(found) == limit:
+                    break
+        return found
+
+
+def _filters(query: Optional[TagQuery]) -> bool:
+    return query is not None and bool(query.required or query.excluded or query.any_of)
+
+
+def _make_handler(server: FakeE621Server) -> Type[BaseHTTPRequestHandler]:
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        # The headers and the body are written separately, and Nagle's algorithm would hold the body back
+        # until the client acknowledges the headers, which it delays by up to 40ms
+        disable_nagle_algorithm = True
+
+        def setup(self) -> None:
+            super().setup()
+            with server._lock:
+                server.connections_opened += 1
+
+        def handle(self) -> None:
+            try:
+                super().handle()
+            except (ConnectionResetError, BrokenPipeError):
+                # Clients close streamed responses they stop reading early, e.g. the trimmed last page of a search
+                pass
+
+        def _respond(self) -> None:
+            length = int(self.headers.get("Content-Length") or 0)
+            if length:
+                self.rfile.read(length)
+            status, headers, body = server.handle(self.command, self.path)
+            self.send_response(status)
+            headers = {"Content-Type": "application/json; charset=utf-8", **headers}
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        do_GET = do_POST = do_PATCH = do_PUT = do_DELETE = _respond
+
+        def log_message(self, format: str, *args: Any) -> None:
+            pass
+
+    return Handler
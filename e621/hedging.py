@@ -0,0 +1,68 @@
+import threading
+from collections import deque
+from typing import Deque, Optional
+
+from .util import percentile
+
+__all__ = ["HedgePolicy"]
+
+
+class HedgePolicy:
+    """Decides when a GET that is taking long gets a second, hedged copy, see SimpleSession
+
+    The hedge is sent once the first request has been waiting longer than the percentile of the latencies
+    of the last window requests (clamped to min_delay..max_delay), so only the slowest requests get one.
+    Nothing is hedged until min_samples latencies were seen. Every request earns budget hedges,
+    and at most burst unused ones are kept, so hedges can never add more than budget to the load.
+    Hedges go through the rate limiter like any other request.
+    """
+
+    def __init__(
+        self,
+        percentile: float = 0.95,
+        budget: float = 0.05,
+        burst: float = 5,
+        min_delay: float = 0.01,
+        max_delay: float = 2.0,
+        window: int = 200,
+        min_samples: int = 20,
+    ) -> None:
+        if not 0 < percentile < 1:
+            raise ValueError("percentile must be between 0 and 1")
+        if not 0 <= budget <= 1:
+            raise ValueError("budget must be between 0 and 1")
+        self.percentile = percentile
+        self.budget = budget
+        self.burst = burst
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.min_samples = min_samples
+        self.requests = 0
+        self.hedges = 0
+        self._latencies: Deque[float] = deque(maxlen=window)
+        self._tokens = 0.0
+        self._lock = threading.Lock()
+
+    def delay(self) -> Optional[float]:
+        """Counts a new request and returns how long to wait for it before hedging, or None to not hedge it"""
+        with self._lock:
+            self.requests += 1
+            self._tokens = min(self._tokens + self.budget, self.burst)
+            if len(self._latencies) < self.min_samples:
+                return None
+            latencies = list(self._latencies)
+        return min(max(percentile(latencies, self.percentile), self.min_delay), self.max_delay)
+
+    def try_hedge(self) -> bool:
+        """Takes a hedge from the budget, if there is one left"""
+        with self._lock:
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            self.hedges += 1
+            return True
+
+    def observe(self, seconds: float) -> None:
+        """Records how long a request took, hedged or not"""
+        with self._lock:
+            self._latencies.append(seconds)
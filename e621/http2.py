@@ -0,0 +1,190 @@
+import os
+import ssl
+import threading
+from typing import Any, Dict, Iterator, List, Mapping, Optional, Tuple, Union
+from urllib.parse import urlsplit
+
+import certifi
+import requests
+from requests.adapters import BaseAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers, select_proxy
+
+__all__ = ["Http2Adapter"]
+
+# HTTP/2 forbids connection-specific headers, and requests always sends some of them
+_HOP_BY_HOP_HEADERS = {"connection", "keep-alive", "proxy-connection", "transfer-encoding", "upgrade"}
+
+Timeout = Union[None, float, Tuple[Optional[float], Optional[float]]]
+
+
+class Http2Adapter(BaseAdapter):
+    """Sends the requests of a requests session over HTTP/2 with httpx. Requires httpx with HTTP/2 support
+
+    Concurrent requests to a host are multiplexed over a single connection instead of each needing
+    a TCP and TLS handshake of its own. Servers that don't speak HTTP/2, and plain http:// urls, get HTTP/1.1.
+    Pass it as the transport of a client, or mount it on any requests session, e.g. for downloading files:
+
+    api = E621(transport=Http2Adapter(prewarm=["https://e621.net"]))
+    session.mount("https://static1.e621.net", Http2Adapter())
+
+    prewarm opens the connections to the given urls in the background, so the first request doesn't wait for them.
+    The timeout, verify, cert and proxies that requests passes are honoured. Requires httpx 0.26 or newer.
+    """
+
+    def __init__(
+        self,
+        max_connections: int = 10,
+        keepalive_expiry: float = 60.0,
+        prewarm: Optional[List[str]] = None,
+    ) -> None:
+        try:
+            import h2  # noqa: F401
+            import httpx
+        except ImportError as e:
+            raise ImportError("Http2Adapter requires httpx with HTTP/2 support: pip install 'e621[http2]'") from e
+        super().__init__()
+        self._httpx = httpx
+        self._limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        # httpx sets TLS and proxies per client, so every combination of them that requests asks for gets its own
+        self._clients: Dict[Tuple[Any, ...], Any] = {}
+        self._clients_lock = threading.Lock()
+        self._client = self._client_for(True, None, None)
+        if prewarm:
+            threading.Thread(target=self.prewarm, args=prewarm, name="Http2Adapter.prewarm", daemon=True).start()
+
+    def prewarm(self, *urls: str) -> None:
+        """Opens a connection to the host of every url, waiting until they are all open"""
+        origins = {f"{parts.scheme}://{parts.netloc}/" for parts in map(urlsplit, urls)}
+        threads = [threading.Thread(target=self._connect, args=(origin,), daemon=True) for origin in origins]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def _connect(self, origin: str) -> None:
+        try:
+            self._client.head(origin, timeout=10)
+        except self._httpx.HTTPError:
+            # Warming up is only an optimization, the real request will report the problem
+            pass
+
+    def send(
+        self,
+        request: requests.PreparedRequest,
+        stream: bool = False,
+        timeout: Timeout = None,
+        verify: Union[bool, str] = True,
+        cert: Any = None,
+        proxies: Optional[Mapping[str, str]] = None,
+    ) -> requests.Response:
+        httpx = self._httpx
+        proxy = select_proxy(request.url or "", proxies) if proxies else None
+        client = self._client_for(verify, cert, proxy)
+        headers = [(k, v) for k, v in request.headers.items() if k.lower() not in _HOP_BY_HOP_HEADERS]
+        outgoing = client.build_request(
+            request.method or "GET",
+            request.url or "",
+            headers=headers,
+            content=request.body,
+            timeout=_timeout(httpx, timeout),
+        )
+        try:
+            incoming = client.send(outgoing, stream=True)
+        except httpx.TimeoutException as e:
+            raise requests.Timeout(e, request=request) from e
+        except httpx.TransportError as e:
+            raise requests.ConnectionError(e, request=request) from e
+
+        response = requests.Response()
+        response.status_code = incoming.status_code
+        response.headers = CaseInsensitiveDict(incoming.headers.items())
+        response.encoding = get_encoding_from_headers(response.headers)
+        response.reason = incoming.reason_phrase
+        response.url = request.url or ""
+        response.request = request
+        response.connection = self
+        # requests reads the body from raw, unless stream is True only once the session returns it
+        response.raw = _Body(incoming)
+        return response
+
+    def close(self) -> None:
+        with self._clients_lock:
+            for client in self._clients.values():
+                client.close()
+
+    def _client_for(self, verify: Union[bool, str], cert: Any, proxy: Optional[str]) -> Any:
+        key = (verify, tuple(cert) if isinstance(cert, (list, tuple)) else cert, proxy)
+        with self._clients_lock:
+            client = self._clients.get(key)
+            if client is None:
+                client = self._clients[key] = self._httpx.Client(
+                    http2=True,
+                    limits=self._limits,
+                    verify=_ssl_context(verify, cert),
+                    proxy=proxy,
+                    # requests has already applied the environment (REQUESTS_CA_BUNDLE, HTTPS_PROXY, NO_PROXY...)
+                    trust_env=False,
+                )
+            return client
+
+
+class _Body:
+    """The part of urllib3's HTTPResponse that requests.Response uses, on top of an httpx response"""
+
+    def __init__(self, response: Any) -> None:
+        self._response = response
+
+    def stream(self, chunk_size: Optional[int] = None, decode_content: bool = True) -> Iterator[bytes]:
+        # httpx has already undone the Content-Encoding
+        try:
+            yield from self._response.iter_bytes(chunk_size)
+        finally:
+            self._response.close()
+
+    def read(self, amt: Optional[int] = None, decode_content: bool = True) -> bytes:
+        try:
+            return self._response.read()
+        finally:
+            self._response.close()
+
+    def close(self) -> None:
+        self._response.close()
+
+    def release_conn(self) -> None:
+        self._response.close()
+
+
+def _timeout(httpx: Any, timeout: Timeout) -> Any:
+    # requests takes either one timeout or (connect, read)
+    if isinstance(timeout, tuple):
+        connect, read = timeout
+        return httpx.Timeout(connect=connect, read=read, write=read, pool=connect)
+    return timeout
+
+
+def _ssl_context(verify: Union[bool, str], cert: Any) -> Union[bool, ssl.SSLContext]:
+    """What httpx takes as verify for requests' verify and cert"""
+    if verify is True and cert is None:
+        return True
+    if verify is False:
+        context = ssl.create_default_context()
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+    elif verify is True:
+        context = ssl.create_default_context(cafile=certifi.where())
+    elif os.path.isdir(verify):
+        context = ssl.create_default_context(capath=verify)
+    else:
+        context = ssl.create_default_context(cafile=verify)
+    if cert is not None:
+        # A single file with the certificate and the key, or (certificate, key)
+        if isinstance(cert, (list, tuple)):
+            context.load_cert_chain(*cert)
+        else:
+            context.load_cert_chain(cert)
+    return context
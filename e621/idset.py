@@ -0,0 +1,423 @@
+import mmap
+import operator
+import re
+import struct
+import sys
+from array import array
+from bisect import bisect_left
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+from .util import write_atomically
+
+__all__ = ["PostIdSet"]
+
+# Ids are split into their high and low 16 bits. All ids with the same high bits share a container
+_CHUNK_BITS = 16
+_LOW_MASK = (1 << _CHUNK_BITS) - 1
+_MAX_ID = (1 << 32) - 1
+_BITMAP_BYTES = (1 << _CHUNK_BITS) // 8
+# A sorted array of 2 byte values is smaller than the 8 KB bitmap up to this many values
+_ARRAY_MAX = _BITMAP_BYTES // 2
+
+_MAGIC = b"E6IDSET\x01"
+_HEADER = struct.Struct("<8sII")
+# high bits, kind, number of ids, offset of the data in the file
+_ENTRY = struct.Struct("<HHIQ")
+_ARRAY, _BITMAP = 0, 1
+
+# The positions of the set bits of every byte value
+_BITS = [tuple(bit for bit in range(8) if value & (1 << bit)) for value in range(256)]
+# Finds the bytes of a bitmap that have any bits set, scanning the zeros in C
+_NONZERO_BYTE = re.compile(b"[^\\x00]")
+
+# A sorted array("H") of the low bits, or a bytearray bitmap of them
+_Container = Union[array, bytearray]
+
+
+try:
+    _popcount = int.bit_count  # type: ignore
+except AttributeError:  # Python < 3.10
+
+    def _popcount(value: int) -> int:  # type: ignore
+        return bin(value).count("1")
+
+
+class PostIdSet:
+    """A compact set of post ids with fast union, intersection and difference, in the style of a roaring bitmap
+
+    Ids are grouped by their high 16 bits. Each group is stored as a sorted array of the low 16 bits while it has
+    at most 4096 ids, and as an 8 KB bitmap once it has more, so both scattered ids (2 bytes each) and dense runs
+    (1 bit each) stay small. Set operations work a whole group at a time: bitmaps are combined as integers in C.
+    It behaves like a set of ints: in, len, iteration (in increasing order), |, &, -, ^ and their in-place forms.
+
+    save writes a flat, aligned, little-endian file with a directory of the groups, which load reads through mmap.
+    Post ids go from 0 to 2**32 - 1.
+    """
+
+    def __init__(self, ids: Iterable[int] = ()) -> None:
+        self._containers: Dict[int, _Container] = {}
+        self.update(ids)
+
+    # Building
+
+    def add(self, id: int) -> None:
+        high, low = _split(id)
+        container = self._containers.get(high)
+        if container is None:
+            self._containers[high] = array("H", [low])
+        elif isinstance(container, bytearray):
+            container[low >> 3] |= 1 << (low & 7)
+        else:
+            i = bisect_left(container, low)
+            if i == len(container) or container[i] != low:
+                container.insert(i, low)
+                if len(container) > _ARRAY_MAX:
+                    self._containers[high] = _to_bitmap(container)
+
+    def update(self, ids: Iterable[int]) -> None:
+        """Adds all of the ids, which is much faster than adding them one by one"""
+        # Sorting is done in C, and then every group is a slice
+        ids = sorted(ids)
+        if ids and not (0 <= ids[0] and ids[-1] <= _MAX_ID):
+            bad = ids[0] if ids[0] < 0 else ids[-1]
+            raise ValueError(f"Post ids must be between 0 and {_MAX_ID}, got {bad}")
+        start = 0
+        while start < len(ids):
+            high = ids[start] >> _CHUNK_BITS
+            base = high << _CHUNK_BITS
+            end = bisect_left(ids, base + (1 << _CHUNK_BITS), start)
+            container = _from_sorted(list(map(base.__rsub__, ids[start:end])))
+            existing = self._containers.get(high)
+            self._containers[high] = container if existing is None else _union(existing, container)
+            start = end
+
+    def discard(self, id: int) -> None:
+        if not 0 <= id <= _MAX_ID:
+            return
+        high, low = _split(id)
+        container = self._containers.get(high)
+        if container is None:
+            return
+        if isinstance(container, bytearray):
+            container[low >> 3] &= ~(1 << (low & 7)) & 0xFF
+            result = _normalize(container)
+        else:
+            i = bisect_left(container, low)
+            if i < len(container) and container[i] == low:
+                del container[i]
+            result = container if container else None
+        self._set(high, result)
+
+    def clear(self) -> None:
+        self._containers.clear()
+
+    def copy(self) -> "PostIdSet":
+        return self._with({high: _copy(c) for high, c in self._containers.items()})
+
+    # Querying
+
+    def __contains__(self, id: object) -> bool:
+        if not isinstance(id, int) or not 0 <= id <= _MAX_ID:
+            return False
+        container = self._containers.get(id >> _CHUNK_BITS)
+        if container is None:
+            return False
+        low = id & _LOW_MASK
+        if isinstance(container, bytearray):
+            return bool(container[low >> 3] & (1 << (low & 7)))
+        i = bisect_left(container, low)
+        return i < len(container) and container[i] == low
+
+    def __len__(self) -> int:
+        return sum(_cardinality(c) for c in self._containers.values())
+
+    def __bool__(self) -> bool:
+        return bool(self._containers)
+
+    def __iter__(self) -> Iterator[int]:
+        for high in sorted(self._containers):
+            base = high << _CHUNK_BITS
+            container = self._containers[high]
+            if isinstance(container, bytearray):
+                for low in _set_bits(container):
+                    yield base | low
+            else:
+                for low in container:
+                    yield base | low
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, PostIdSet):
+            return self._containers.keys() == other._containers.keys() and all(
+                _equal(c, other._containers[high]) for high, c in self._containers.items()
+            )
+        if isinstance(other, (set, frozenset)):
+            return len(self) == len(other) and all(id in self for id in other)
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        return f"<PostIdSet of {len(self)} ids in {len(self._containers)} groups, {self.nbytes} bytes>"
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes taken by the ids themselves"""
+        return sum(len(c) if isinstance(c, bytearray) else 2 * len(c) for c in self._containers.values())
+
+    def isdisjoint(self, other: "PostIdSet") -> bool:
+        return not self & other
+
+    def issubset(self, other: "PostIdSet") -> bool:
+        return not self - other
+
+    # Set algebra
+
+    def union(self, *others: "PostIdSet") -> "PostIdSet":
+        result = self.copy()
+        for other in others:
+            result |= other
+        return result
+
+    def intersection(self, *others: "PostIdSet") -> "PostIdSet":
+        result = self
+        for other in others:
+            result = result & other
+        return result if others else self.copy()
+
+    def difference(self, *others: "PostIdSet") -> "PostIdSet":
+        result = self
+        for other in others:
+            result = result - other
+        return result if others else self.copy()
+
+    def symmetric_difference(self, other: "PostIdSet") -> "PostIdSet":
+        return self ^ other
+
+    def __or__(self, other: "PostIdSet") -> "PostIdSet":
+        if not isinstance(other, PostIdSet):
+            return NotImplemented
+        return self.union(other)
+
+    def __ior__(self, other: "PostIdSet") -> "PostIdSet":
+        if not isinstance(other, PostIdSet):
+            return NotImplemented
+        for high, container in other._containers.items():
+            existing = self._containers.get(high)
+            self._containers[high] = _copy(container) if existing is None else _union(existing, container)
+        return self
+
+    def __and__(self, other: "PostIdSet") -> "PostIdSet":
+        if not isinstance(other, PostIdSet):
+            return NotImplemented
+        containers = {}
+        for high in self._containers.keys() & other._containers.keys():
+            result = _intersection(self._containers[high], other._containers[high])
+            if result is not None:
+                containers[high] = result
+        return self._with(containers)
+
+    def __iand__(self, other: "PostIdSet") -> "PostIdSet":
+        if not isinstance(other, PostIdSet):
+            return NotImplemented
+        self._containers = (self & other)._containers
+        return self
+
+    def __sub__(self, other: "PostIdSet") -> "PostIdSet":
+        if not isinstance(other, PostIdSet):
+            return NotImplemented
+        containers = {}
+        for high, container in self._containers.items():
+            subtrahend = other._containers.get(high)
+            result = _copy(container) if subtrahend is None else _difference(container, subtrahend)
+            if result is not None:
+                containers[high] = result
+        return self._with(containers)
+
+    def __isub__(self, other: "PostIdSet") -> "PostIdSet":
+        if not isinstance(other, PostIdSet):
+            return NotImplemented
+        for high in self._containers.keys() & other._containers.keys():
+            self._set(high, _difference(self._containers[high], other._containers[high]))
+        return self
+
+    def __xor__(self, other: "PostIdSet") -> "PostIdSet":
+        if not isinstance(other, PostIdSet):
+            return NotImplemented
+        return (self - other) | (other - self)
+
+    def __ixor__(self, other: "PostIdSet") -> "PostIdSet":
+        if not isinstance(other, PostIdSet):
+            return NotImplemented
+        self._containers = (self ^ other)._containers
+        return self
+
+    # Files
+
+    def to_bytes(self) -> bytes:
+        highs = sorted(self._containers)
+        header_size = _HEADER.size + _ENTRY.size * len(highs)
+        entries = []
+        chunks = []
+        offset = _align(header_size)
+        for high in highs:
+            container = self._containers[high]
+            if isinstance(container, bytearray):
+                kind, data = _BITMAP, bytes(container)
+            else:
+                kind, data = _ARRAY, _little_endian(container)
+            entries.append(_ENTRY.pack(high, kind, _cardinality(container), offset))
+            padding = _align(len(data)) - len(data)
+            chunks.append(data + b"\0" * padding)
+            offset += len(data) + padding
+        header = _HEADER.pack(_MAGIC, len(highs), 0) + b"".join(entries)
+        return header + b"\0" * (_align(header_size) - header_size) + b"".join(chunks)
+
+    @classmethod
+    def from_bytes(cls, data: Union[bytes, memoryview, mmap.mmap]) -> "PostIdSet":
+        magic, count, _ = _HEADER.unpack_from(data, 0)
+        if magic != _MAGIC:
+            raise ValueError("Not a PostIdSet file")
+        containers: Dict[int, _Container] = {}
+        for i in range(count):
+            high, kind, cardinality, offset = _ENTRY.unpack_from(data, _HEADER.size + i * _ENTRY.size)
+            if kind == _BITMAP:
+                containers[high] = bytearray(data[offset : offset + _BITMAP_BYTES])
+            else:
+                container = array("H")
+                container.frombytes(data[offset : offset + 2 * cardinality])
+                if sys.byteorder == "big":
+                    container.byteswap()
+                containers[high] = container
+        return cls._with(containers)
+
+    def save(self, path: Union[str, Path]) -> None:
+        """Writes the set to path atomically, replacing whatever was there"""
+        write_atomically(Path(path), self.to_bytes())
+
+    @classmethod
+    def load(cls, path: Union[str, Path]) -> "PostIdSet":
+        with open(path, "rb") as f:
+            if not f.seek(0, 2):
+                raise ValueError(f"{path} is empty")
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                return cls.from_bytes(mapped)
+
+    # Helpers
+
+    @classmethod
+    def _with(cls, containers: Dict[int, _Container]) -> "PostIdSet":
+        result = cls.__new__(cls)
+        result._containers = containers
+        return result
+
+    def _set(self, high: int, container: Optional[_Container]) -> None:
+        if container is None:
+            self._containers.pop(high, None)
+        else:
+            self._containers[high] = container
+
+
+def _split(id: int) -> Tuple[int, int]:
+    if not 0 <= id <= _MAX_ID:
+        raise ValueError(f"Post ids must be between 0 and {_MAX_ID}, got {id}")
+    return id >> _CHUNK_BITS, id & _LOW_MASK
+
+
+def _align(size: int) -> int:
+    return (size + 7) & ~7
+
+
+def _little_endian(values: array) -> bytes:
+    if sys.byteorder == "big":
+        values = array("H", values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def _cardinality(container: _Container) -> int:
+    if isinstance(container, bytearray):
+        return _popcount(int.from_bytes(container, "little"))
+    return len(container)
+
+
+def _copy(container: _Container) -> _Container:
+    return bytearray(container) if isinstance(container, bytearray) else array("H", container)
+
+
+def _equal(a: _Container, b: _Container) -> bool:
+    # Both are normalized, so the same ids are always stored the same way
+    return type(a) is type(b) and a == b
+
+
+def _from_sorted(values: List[int]) -> _Container:
+    unique = list(dict.fromkeys(values))
+    if len(unique) <= _ARRAY_MAX:
+        return array("H", unique)
+    return _to_bitmap(unique)
+
+
+def _to_bitmap(values: Iterable[int]) -> bytearray:
+    bitmap = bytearray(_BITMAP_BYTES)
+    for low in values:
+        bitmap[low >> 3] |= 1 << (low & 7)
+    return bitmap
+
+
+def _as_int(container: _Container) -> int:
+    if isinstance(container, bytearray):
+        return int.from_bytes(container, "little")
+    return int.from_bytes(_to_bitmap(container), "little")
+
+
+def _from_int(value: int) -> Optional[_Container]:
+    """The normalized container of a bitmap given as an int"""
+    return _normalize(bytearray(value.to_bytes(_BITMAP_BYTES, "little")), _popcount(value))
+
+
+def _normalize(bitmap: bytearray, cardinality: Optional[int] = None) -> Optional[_Container]:
+    if cardinality is None:
+        cardinality = _cardinality(bitmap)
+    if cardinality == 0:
+        return None
+    if cardinality > _ARRAY_MAX:
+        return bitmap
+    return array("H", _set_bits(bitmap))
+
+
+def _set_bits(bitmap: bytearray) -> List[int]:
+    """The positions of the set bits, in increasing order"""
+    bits = _BITS
+    return [(i << 3) | bit for i in map(_match_start, _NONZERO_BYTE.finditer(bitmap)) for bit in bits[bitmap[i]]]
+
+
+_match_start = operator.methodcaller("start")
+
+
+def _union(a: _Container, b: _Container) -> _Container:
+    if isinstance(a, array) and isinstance(b, array):
+        values = set(a).union(b)
+        return array("H", sorted(values)) if len(values) <= _ARRAY_MAX else _to_bitmap(values)
+    result = _from_int(_as_int(a) | _as_int(b))
+    assert result is not None
+    return result
+
+
+def _intersection(a: _Container, b: _Container) -> Optional[_Container]:
+    if isinstance(a, array) and isinstance(b, array):
+        values = sorted(set(a).intersection(b))
+        return array("H", values) if values else None
+    if isinstance(a, array) or isinstance(b, array):
+        values, bitmap = (a, b) if isinstance(a, array) else (b, a)
+        found = array("H", [low for low in values if bitmap[low >> 3] & (1 << (low & 7))])
+        return found if found else None
+    return _from_int(_as_int(a) & _as_int(b))
+
+
+def _difference(a: _Container, b: _Container) -> Optional[_Container]:
+    if isinstance(a, array):
+        if isinstance(b, array):
+            exclude = set(b)
+            remaining = array("H", [low for low in a if low not in exclude])
+        else:
+            remaining = array("H", [low for low in a if not b[low >> 3] & (1 << (low & 7))])
+        return remaining if remaining else None
+    return _from_int(_as_int(a) & ~_as_int(b))
@@ -0,0 +1,227 @@
+import re
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import (
+    Any,
+    Callable,
+    DefaultDict,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+)
+
+from typing_extensions import Literal
+
+__all__ = ["RequestEvent", "Histogram", "Instrumentation", "OpenTelemetryAdapter", "retry_attempt", "hedge_request"]
+
+EventKind = Literal["request", "parse"]
+Subscriber = Callable[["RequestEvent"], None]
+
+# Upper bounds in seconds
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+_RE_ID_IN_PATH = re.compile(r"/[^/]*\d[^/]*(?=/|$)")
+
+_current_attempt: ContextVar[int] = ContextVar("e621_retry_attempt", default=0)
+_is_hedge: ContextVar[bool] = ContextVar("e621_hedge", default=False)
+
+
+@contextmanager
+def retry_attempt(attempt: int) -> Iterator[None]:
+    """Marks the requests made inside the block as the attempt-th retry of the same operation"""
+    token = _current_attempt.set(attempt)
+    try:
+        yield
+    finally:
+        _current_attempt.reset(token)
+
+
+@contextmanager
+def hedge_request() -> Iterator[None]:
+    """Marks the requests made inside the block as hedges, i.e. second copies of a request that was slow to answer"""
+    token = _is_hedge.set(True)
+    try:
+        yield
+    finally:
+        _is_hedge.reset(token)
+
+
+@dataclass
+class RequestEvent:
+    """Everything we know about a single request. All durations are in seconds
+
+    decode_time and model_build_time stay None until the response is parsed,
+    which is when the event is emitted for the second time, as a "parse" event.
+    """
+
+    endpoint: str
+    method: str
+    started_at: float = field(default_factory=time.time)
+    status: Optional[int] = None
+    bytes: int = 0
+    queue_wait: float = 0.0
+    network_time: float = 0.0
+    decode_time: Optional[float] = None
+    model_build_time: Optional[float] = None
+    retries: int = field(default_factory=_current_attempt.get)
+    hedge: bool = field(default_factory=_is_hedge.get)
+    cache_hit: bool = False
+    error: Optional[str] = None
+
+    @property
+    def route(self) -> str:
+        """The endpoint with ids replaced by :id, e.g. posts/:id"""
+        return _RE_ID_IN_PATH.sub("/:id", self.endpoint)
+
+
+class Histogram:
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS) -> None:
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self) -> List[Tuple[str, int]]:
+        """(le, count) pairs the way Prometheus expects them"""
+        total = 0
+        pairs = []
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            total += count
+            pairs.append(("+Inf" if bound == float("inf") else repr(bound), total))
+        return pairs
+
+
+_HISTOGRAMS = {
+    "queue_wait": "Time spent waiting for the rate limiter",
+    "network_time": "Time from sending the request to receiving the response",
+    "decode_time": "Time spent decoding the JSON body",
+    "model_build_time": "Time spent building models from the decoded JSON",
+}
+
+
+class Instrumentation:
+    """Collects per-request events and aggregates them into per-endpoint counters and latency histograms
+
+    Pass it to E621(instrumentation=...). A client without instrumentation skips all of this.
+    """
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS) -> None:
+        self.buckets = buckets
+        self._subscribers: Dict[EventKind, List[Subscriber]] = {"request": [], "parse": []}
+        self._lock = threading.Lock()
+        self.requests: DefaultDict[Tuple[str, str, str], int] = defaultdict(int)
+        self.bytes: DefaultDict[str, int] = defaultdict(int)
+        self.retries: DefaultDict[str, int] = defaultdict(int)
+        self.hedges: DefaultDict[str, int] = defaultdict(int)
+        self.cache_hits: DefaultDict[str, int] = defaultdict(int)
+        self.histograms: Dict[str, DefaultDict[str, Histogram]] = {
+            name: defaultdict(lambda: Histogram(self.buckets)) for name in _HISTOGRAMS
+        }
+
+    def subscribe(self, callback: Subscriber, kind: EventKind = "request") -> Subscriber:
+        """Calls callback with every "request" event (sent when the response arrives)
+        or every "parse" event (sent when the response has been turned into models)
+        """
+        self._subscribers[kind].append(callback)
+        return callback
+
+    def unsubscribe(self, callback: Subscriber, kind: EventKind = "request") -> None:
+        self._subscribers[kind].remove(callback)
+
+    def emit_request(self, event: RequestEvent) -> None:
+        route = event.route
+        with self._lock:
+            self.requests[(route, event.method, str(event.status))] += 1
+            self.bytes[route] += event.bytes
+            # event.retries is the attempt's index, and every retried attempt counts once
+            if event.retries:
+                self.retries[route] += 1
+            if event.hedge:
+                self.hedges[route] += 1
+            if event.cache_hit:
+                self.cache_hits[route] += 1
+            self.histograms["queue_wait"][route].observe(event.queue_wait)
+            self.histograms["network_time"][route].observe(event.network_time)
+        for callback in self._subscribers["request"]:
+            callback(event)
+
+    def emit_parse(self, event: RequestEvent) -> None:
+        route = event.route
+        with self._lock:
+            if event.decode_time is not None:
+                self.histograms["decode_time"][route].observe(event.decode_time)
+            if event.model_build_time is not None:
+                self.histograms["model_build_time"][route].observe(event.model_build_time)
+        for callback in self._subscribers["parse"]:
+            callback(event)
+
+    def to_prometheus(self, prefix: str = "e621") -> str:
+        """Renders the metrics in the Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            lines += [f"# HELP {prefix}_requests_total Requests sent", f"# TYPE {prefix}_requests_total counter"]
+            for (route, method, status), count in sorted(self.requests.items()):
+                lines.append(
+                    f'{prefix}_requests_total{{endpoint="{route}",method="{method}",status="{status}"}} {count}'
+                )
+            for name, counter, help in (
+                ("response_bytes_total", self.bytes, "Bytes received"),
+                ("retries_total", self.retries, "Requests that were retries"),
+                ("hedges_total", self.hedges, "Requests that were hedges of a slow request"),
+                ("cache_hits_total", self.cache_hits, "Requests answered from a cache"),
+            ):
+                lines += [f"# HELP {prefix}_{name} {help}", f"# TYPE {prefix}_{name} counter"]
+                lines += [f'{prefix}_{name}{{endpoint="{route}"}} {value}' for route, value in sorted(counter.items())]
+            for name, help in _HISTOGRAMS.items():
+                metric = f"{prefix}_{name}_seconds"
+                lines += [f"# HELP {metric} {help}", f"# TYPE {metric} histogram"]
+                for route, histogram in sorted(self.histograms[name].items()):
+                    for le, count in histogram.cumulative():
+                        lines.append(f'{metric}_bucket{{endpoint="{route}",le="{le}"}} {count}')
+                    lines.append(f'{metric}_sum{{endpoint="{route}"}} {histogram.sum}')
+                    lines.append(f'{metric}_count{{endpoint="{route}"}} {histogram.count}')
+        return "\n".join(lines) + "\n"
+
+
+class OpenTelemetryAdapter:
+    """Turns every request event into an OpenTelemetry span. Requires opentelemetry-api"""
+
+    def __init__(self, instrumentation: Instrumentation, tracer: Optional[Any] = None) -> None:
+        try:
+            from opentelemetry import trace
+        except ImportError as e:
+            raise ImportError("OpenTelemetryAdapter requires opentelemetry-api: pip install opentelemetry-api") from e
+        self.tracer = tracer or trace.get_tracer("e621")
+        instrumentation.subscribe(self._on_request, "request")
+
+    def _on_request(self, event: RequestEvent) -> None:
+        start = int(event.started_at * 1e9)
+        span = self.tracer.start_span(f"{event.method} {event.route}", start_time=start)
+        span.set_attribute("http.method", event.method)
+        span.set_attribute("e621.endpoint", event.route)
+        if event.status is not None:
+            span.set_attribute("http.status_code", event.status)
+        span.set_attribute("http.response_content_length", event.bytes)
+        span.set_attribute("e621.queue_wait", event.queue_wait)
+        span.set_attribute("e621.retries", event.retries)
+        span.set_attribute("e621.hedge", event.hedge)
+        span.set_attribute("e621.cache_hit", event.cache_hit)
+        if event.error is not None:
+            span.set_attribute("error.type", event.error)
+        span.end(end_time=start + int((event.queue_wait + event.network_time) * 1e9))
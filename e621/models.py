@@ -1,11 +1,13 @@
 from __future__ import annotations
 
-from typing import TYPE_CHECKING, Iterable, List, Set
+from typing import TYPE_CHECKING, Iterable, List, Optional, Set
 
 from backports.cached_property import cached_property
 from typing_extensions import Protocol
 
 from .autogenerated_models import *
+from .resolvers import _ordered_posts, fetch_pools, fetch_posts, fetch_users
+from .util import locked_cached_property
 
 if TYPE_CHECKING:
     from .api import E621
@@ -25,6 +27,25 @@ class Post(Post):
             + self.tags.meta
         )
 
+    @locked_cached_property
+    def parent(self) -> Optional[Post]:
+        parent_id = self.relationships.parent_id
+        return None if parent_id is None else fetch_posts(self.e621api, [parent_id]).get(parent_id)
+
+    @locked_cached_property
+    def children(self) -> List[Post]:
+        found = fetch_posts(self.e621api, self.relationships.children)
+        return [found[id] for id in self.relationships.children if id in found]
+
+    @locked_cached_property
+    def in_pools(self) -> List[Pool]:
+        found = fetch_pools(self.e621api, self.pools)
+        return [found[id] for id in self.pools if id in found]
+
+    @locked_cached_property
+    def uploader(self) -> Optional[User]:
+        return fetch_users(self.e621api, [self.uploader_id]).get(self.uploader_id)
+
 
 class _HasPostIdsAndE621API(Protocol):
     e621api: "E621"
@@ -32,9 +53,11 @@ class _HasPostIdsAndE621API(Protocol):
 
 
 class _PostsGetterMixin:
-    @cached_property
+    @locked_cached_property
     def posts(self: _HasPostIdsAndE621API) -> List[Post]:
-        return self.e621api.posts.search(tags=f"id:{','.join(map(str, self.post_ids))}")
+        """Posts in the order of post_ids. Use e621.resolvers.resolve_posts to fill it for many pools at once"""
+        found = fetch_posts(self.e621api, self.post_ids)
+        return _ordered_posts(self.e621api, self.post_ids, found)
 
 
 class Pool(Pool, _PostsGetterMixin):
@@ -110,6 +133,6 @@ class AuthenticatedUser(User):
     favorite_limit: int
     tag_query_limit: int
 
-    @cached_property
+    @locked_cached_property
     def blacklist(self) -> BlackList:
         return BlackList(self.blacklisted_tags.split("\n"))
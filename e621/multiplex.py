@@ -0,0 +1,207 @@
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import (
+    TYPE_CHECKING,
+    Dict,
+    FrozenSet,
+    Iterable,
+    List,
+    Mapping,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
+
+if TYPE_CHECKING:
+    from .api import E621
+    from .models import Post
+
+__all__ = ["TagQuery", "MergedQuery", "MultiplexPlan", "plan_queries"]
+
+# e621's limit for anonymous users and members. Privileged accounts get more, see AuthenticatedUser.tag_query_limit
+DEFAULT_TAG_LIMIT = 40
+_RATINGS = {"s": "s", "safe": "s", "q": "q", "questionable": "q", "e": "e", "explicit": "e"}
+
+
+@dataclass(frozen=True)
+class TagQuery:
+    """A parsed tag query. Only plain tags, -tags, ~tags and rating: can be matched locally"""
+
+    required: FrozenSet[str] = frozenset()
+    excluded: FrozenSet[str] = frozenset()
+    any_of: FrozenSet[str] = frozenset()
+    # Metatags and wildcards that e621 understands but that we cannot evaluate on a Post
+    opaque: FrozenSet[str] = frozenset()
+
+    @classmethod
+    def parse(cls, tags: Union[str, Iterable[str]]) -> "TagQuery":
+        if isinstance(tags, str):
+            tags = tags.split()
+        required, excluded, any_of, opaque = set(), set(), set(), set()
+        for tag in tags:
+            tag = tag.lower()
+            negated = tag.startswith("-")
+            name = tag.lstrip("-~")
+            if "*" in name or (":" in name and _rating(name) is None):
+                opaque.add(tag)
+            elif tag.startswith("~"):
+                any_of.add(name)
+            elif negated:
+                excluded.add(name)
+            else:
+                required.add(name)
+        return cls(frozenset(required), frozenset(excluded), frozenset(any_of), frozenset(opaque))
+
+    @property
+    def is_local(self) -> bool:
+        return not self.opaque
+
+    @property
+    def tag_count(self) -> int:
+        return len(self.required) + len(self.excluded) + len(self.any_of) + len(self.opaque)
+
+    def matches(self, post: "Post") -> bool:
+        if not self.is_local:
+            raise ValueError(f"{self} contains tags that cannot be matched locally")
+        tags = post.all_tags
+        return (
+            all(_has_tag(post, tags, t) for t in self.required)
+            and not any(_has_tag(post, tags, t) for t in self.excluded)
+            and (not self.any_of or not self.any_of.isdisjoint(tags))
+        )
+
+    def __str__(self) -> str:
+        return " ".join(
+            sorted(self.required)
+            + [f"-{t}" for t in sorted(self.excluded)]
+            + [f"~{t}" for t in sorted(self.any_of)]
+            + sorted(self.opaque)
+        )
+
+
+def _has_tag(post: "Post", tags: Set[str], tag: str) -> bool:
+    rating = _rating(tag)
+    return tag in tags if rating is None else post.rating == rating
+
+
+def _rating(tag: str) -> Optional[str]:
+    if tag.startswith("rating:"):
+        return _RATINGS.get(tag[len("rating:") :])
+    return None
+
+
+@dataclass
+class MergedQuery:
+    """A query that is sent to e621 on behalf of all of its members"""
+
+    query: TagQuery
+    members: Dict[str, TagQuery] = field(default_factory=dict)
+
+    @property
+    def tags(self) -> str:
+        return str(self.query)
+
+    def split(self, posts: Iterable["Post"]) -> Dict[str, List["Post"]]:
+        """Distributes the results of the merged query among its members"""
+        posts = list(posts)
+        if len(self.members) == 1:
+            return {name: posts for name in self.members}
+        return {name: [p for p in posts if q.matches(p)] for name, q in self.members.items()}
+
+
+@dataclass
+class MultiplexPlan:
+    merged: List[MergedQuery]
+
+    @property
+    def query_count(self) -> int:
+        return sum(len(m.members) for m in self.merged)
+
+    @property
+    def request_count(self) -> int:
+        return len(self.merged)
+
+    def split(self, results: Mapping[str, Iterable["Post"]]) -> Dict[str, List["Post"]]:
+        """Maps {merged_tags: posts} to {query_name: posts}"""
+        split: Dict[str, List["Post"]] = {}
+        for merged in self.merged:
+            split.update(merged.split(results.get(merged.tags, ())))
+        return split
+
+    def run(self, api: "E621", limit: Optional[int] = None, page: int = 1) -> Dict[str, List["Post"]]:
+        """Runs every merged query once and returns the results of every original query
+
+        Keep in mind that limit applies to the merged queries, so a member gets only the posts that matched it
+        among the first limit results of its merged query. Poll with id cursors when every result matters.
+        """
+        return self.split({m.tags: api.posts.search(m.tags, limit=limit, page=page) for m in self.merged})
+
+
+def plan_queries(queries: Mapping[str, Union[str, Iterable[str]]], tag_limit: int = DEFAULT_TAG_LIMIT) -> MultiplexPlan:
+    """Groups the queries that differ by a single tag into "<shared tags> ~<tag1> ~<tag2> ..." queries
+
+    A query that equals the shared part of a group absorbs the whole group: its results are a superset
+    of everyone else's. Queries with metatags other than rating:, wildcards or their own ~tags are sent
+    as they are, and so are queries whose shared tags leave no room under tag_limit for an OR group.
+    """
+    parsed = {name: TagQuery.parse(tags) for name, tags in queries.items()}
+    merged: List[MergedQuery] = []
+
+    # Every mergeable query can be a member of a group per each of its positive tags plus its own group
+    candidates: Dict[TagQuery, Dict[str, Optional[str]]] = defaultdict(dict)
+    for name, query in parsed.items():
+        if not query.is_local or query.any_of:
+            merged.append(MergedQuery(query, {name: query}))
+            continue
+        candidates[query][name] = None
+        for tag in query.required:
+            if _rating(tag) is not None:
+                continue
+            base = TagQuery(query.required - {tag}, query.excluded)
+            if base.required:
+                candidates[base][name] = tag
+
+    assigned = {name for m in merged for name in m.members}
+    while True:
+        best: Optional[Tuple[TagQuery, Dict[str, Optional[str]]]] = None
+        for base, members in candidates.items():
+            members = {n: t for n, t in members.items() if n not in assigned}
+            if None not in members.values() and tag_limit - base.tag_count < 2:
+                # Not even two ~tags fit next to the shared ones, so merging them would go over the limit
+                continue
+            if len(members) > 1 and (best is None or len(members) > len(best[1])):
+                best = (base, members)
+        if best is None:
+            break
+        base, members = best
+        assigned.update(members)
+        merged.extend(_merge(base, members, parsed, tag_limit))
+
+    for name, query in parsed.items():
+        if name not in assigned:
+            merged.append(MergedQuery(query, {name: query}))
+    return MultiplexPlan(merged)
+
+
+def _merge(
+    base: TagQuery, members: Dict[str, Optional[str]], parsed: Dict[str, TagQuery], tag_limit: int
+) -> List[MergedQuery]:
+    if None in members.values():
+        # One of the members is the base query itself
+        return [MergedQuery(base, {name: parsed[name] for name in members})]
+    by_tag: Dict[str, List[str]] = defaultdict(list)
+    for name, tag in members.items():
+        by_tag[tag].append(name)  # type: ignore
+    tags = sorted(by_tag)
+    # plan_queries only merges groups with room for at least two ~tags
+    room = tag_limit - base.tag_count
+    groups = []
+    for i in range(0, len(tags), room):
+        chunk = tags[i : i + room]
+        if len(chunk) == 1:
+            query = TagQuery(base.required | {chunk[0]}, base.excluded)
+        else:
+            query = TagQuery(base.required, base.excluded, frozenset(chunk))
+        groups.append(MergedQuery(query, {name: parsed[name] for tag in chunk for name in by_tag[tag]}))
+    return groups
@@ -0,0 +1,310 @@
+import os
+import struct
+import tempfile
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Deque, Dict, Iterator, List, Optional, Union
+
+from typing_extensions import Protocol
+
+from .util import percentile
+
+if TYPE_CHECKING:
+    import requests
+
+    from .models import AuthenticatedUser
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None  # type: ignore
+    import msvcrt
+
+__all__ = ["RateLimiter", "TokenBucket", "AdaptiveTokenBucket", "FileTokenBucket"]
+
+# e621 allows 2 requests per second before it starts answering with 429/503
+DEFAULT_RATE = 2.0
+
+
+class RateLimiter(Protocol):
+    def acquire(self) -> None:
+        ...
+
+
+class TokenBucket:
+    """A thread-safe token bucket that refills at `rate` tokens per second and holds at most `burst` tokens"""
+
+    def __init__(self, rate: float = DEFAULT_RATE, burst: float = 1) -> None:
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def try_acquire(self) -> float:
+        """Takes a token if one is available. Returns 0 on success or the number of seconds until one will be"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.rate
+
+    def acquire(self) -> None:
+        while True:
+            wait = self.try_acquire()
+            if wait == 0:
+                return
+            time.sleep(wait)
+
+
+class AdaptiveTokenBucket(TokenBucket):
+    """A token bucket that sizes itself from the account's API limits and follows the server's responses
+
+    configure_from_user() takes the starting refill rate, burst and budget from an AuthenticatedUser
+    (SimpleSession calls it when the client fetches users.me, which is cached, so it happens once).
+    From then on, the bucket follows what e621 sends: a 429/503 halves the rate and pauses for Retry-After,
+    and a response that takes latency_factor times longer than the fast ones (the 10th percentile of the last
+    latency_window responses) slows the rate by slowdown, since e621 gets slow before it starts rejecting requests.
+    Other successful responses let the rate recover to its target again.
+
+    e621 itself doesn't send rate limit headers. If a proxy in front of it does (X-RateLimit-Remaining/Limit),
+    they also cap the local budget, and the rate shrinks proportionally once the remaining budget falls under
+    low_watermark of the limit.
+    """
+
+    _REMAINING_HEADERS = ("X-RateLimit-Remaining", "X-Api-Limit-Remaining")
+    _LIMIT_HEADERS = ("X-RateLimit-Limit", "X-Api-Limit")
+    # Latencies needed before a response counts as slow
+    _MIN_LATENCY_SAMPLES = 10
+
+    def __init__(
+        self,
+        rate: float = DEFAULT_RATE,
+        burst: float = 1,
+        min_rate: float = 0.1,
+        low_watermark: float = 0.2,
+        decrease: float = 0.5,
+        increase: float = 0.05,
+        latency_factor: float = 3.0,
+        slowdown: float = 0.9,
+        latency_window: int = 50,
+    ) -> None:
+        super().__init__(rate, burst)
+        self.base_rate = rate
+        self.target_rate = rate
+        self.min_rate = min_rate
+        self.low_watermark = low_watermark
+        self.decrease = decrease
+        self.increase = increase
+        self.latency_factor = latency_factor
+        self.slowdown = slowdown
+        self._latencies: Deque[float] = deque(maxlen=latency_window)
+        self._paused_until = 0.0
+
+    def configure(self, regen_multiplier: float, burst_limit: int, remaining: int) -> None:
+        with self._lock:
+            self.target_rate = self.rate = max(self.min_rate, self.base_rate * regen_multiplier)
+            self.burst = max(1, burst_limit)
+            self._tokens = min(float(self.burst), float(remaining))
+
+    def configure_from_user(self, user: "AuthenticatedUser") -> None:
+        self.configure(user.api_regen_multiplier, user.api_burst_limit, user.remaining_api_limit)
+
+    def try_acquire(self) -> float:
+        pause = self._paused_until - time.monotonic()
+        if pause > 0:
+            return pause
+        return super().try_acquire()
+
+    def observe(self, response: "requests.Response", elapsed: float) -> None:
+        remaining = _int_header(response, self._REMAINING_HEADERS)
+        limit = _int_header(response, self._LIMIT_HEADERS) or self.burst
+        with self._lock:
+            if response.status_code in (429, 503):
+                self.rate = max(self.min_rate, self.rate * self.decrease)
+                self._tokens = 0.0
+                retry_after = _int_header(response, ("Retry-After",))
+                if retry_after is not None:
+                    self._paused_until = time.monotonic() + retry_after
+                return
+            slow = len(self._latencies) >= self._MIN_LATENCY_SAMPLES and elapsed > self.latency_factor * percentile(
+                self._latencies, 0.1
+            )
+            self._latencies.append(elapsed)
+            if slow:
+                self.rate = max(self.min_rate, self.rate * self.slowdown)
+            else:
+                self.rate = min(self.target_rate, self.rate + self.increase * self.target_rate)
+            if remaining is not None:
+                self._tokens = min(self._tokens, float(remaining))
+                headroom = remaining / max(1, limit)
+                if headroom < self.low_watermark:
+                    self.rate = max(self.min_rate, self.target_rate * headroom / self.low_watermark)
+
+
+def _int_header(response: "requests.Response", names: Any) -> Optional[int]:
+    for name in names:
+        value = response.headers.get(name)
+        if value is not None and value.strip().isdigit():
+            return int(value)
+    return None
+
+
+class FileTokenBucket:
+    """A token bucket shared by every process on the host that uses the same state file
+
+    The state lives in a small file guarded by an advisory lock, so unrelated processes, each with its own
+    E621 client, stay within one common budget. Waiters are served in the order they arrived (a ticket lock),
+    so no process can starve the others. A waiter that is interrupted gives up its ticket,
+    and if the process at the head of the queue dies, it is skipped after stale_after seconds.
+    By default, every user on the host gets a state file of their own.
+    """
+
+    # Tickets given up by waiters that were interrupted before their turn, skipped when their turn comes
+    _ABANDONED_SLOTS = 8
+    # tokens, last refill, next ticket, ticket being served, last heartbeat of the ticket being served,
+    # then the abandoned tickets (-1 for an empty slot)
+    _STATE = struct.Struct(f"<ddqqd{_ABANDONED_SLOTS}q")
+
+    def __init__(
+        self,
+        path: Union[str, Path, None] = None,
+        rate: float = DEFAULT_RATE,
+        burst: float = 1,
+        stale_after: float = 5.0,
+    ) -> None:
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        if path is None:
+            path = _default_state_path()
+        self.path = Path(path)
+        self.rate = rate
+        self.burst = burst
+        self.stale_after = stale_after
+        self._fd: Optional[int] = None
+        self._pid = 0
+        self._thread_lock = threading.Lock()
+
+    def __getstate__(self) -> Dict[str, Any]:
+        state = self.__dict__.copy()
+        state.update(_fd=None, _pid=0, _thread_lock=None)
+        return state
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__dict__.update(state)
+        self._thread_lock = threading.Lock()
+
+    def acquire(self) -> None:
+        with self._locked_state() as state:
+            ticket = state[2]
+            state[2] += 1
+        try:
+            while True:
+                with self._locked_state() as state:
+                    tokens, last, _, serving, heartbeat = state[:5]
+                    now = time.time()
+                    if serving < ticket and now - heartbeat > self.stale_after:
+                        # Whoever holds the ticket being served is gone. The live waiters we jump over take new tickets
+                        serving = ticket
+                        heartbeat = now
+                    if serving > ticket:
+                        ticket = state[2]
+                        state[2] += 1
+                        continue
+                    if serving == ticket:
+                        tokens = min(self.burst, tokens + max(0.0, now - last) * self.rate)
+                        last = heartbeat = now
+                        if tokens >= 1:
+                            state[:5] = [tokens - 1, last, state[2], serving + 1, now]
+                            return
+                        wait = (1 - tokens) / self.rate
+                    else:
+                        wait = (ticket - serving) / self.rate
+                    state[:5] = [tokens, last, state[2], serving, heartbeat]
+                time.sleep(min(max(wait, 0.001), self.stale_after / 2))
+        except BaseException:
+            # e.g. KeyboardInterrupt while sleeping. Left behind, the ticket would stall every process on the host
+            with self._locked_state() as state:
+                _abandon(state, ticket)
+            raise
+
+    @contextmanager
+    def _locked_state(self) -> Iterator[list]:
+        with self._thread_lock:
+            fd = self._open()
+            _lock_file(fd)
+            try:
+                os.lseek(fd, 0, os.SEEK_SET)
+                raw = os.read(fd, self._STATE.size)
+                if len(raw) == self._STATE.size:
+                    state = list(self._STATE.unpack(raw))
+                else:
+                    state = [float(self.burst), time.time(), 0, 0, time.time()] + [-1] * self._ABANDONED_SLOTS
+                yield state
+                _skip_abandoned(state)
+                os.lseek(fd, 0, os.SEEK_SET)
+                os.write(fd, self._STATE.pack(*state))
+            finally:
+                _unlock_file(fd)
+
+    def _open(self) -> int:
+        # Locks belong to the open file, so a forked child has to open the file again to get its own lock
+        if self._fd is None or self._pid != os.getpid():
+            self._fd = os.open(str(self.path), os.O_RDWR | os.O_CREAT, 0o666)
+            self._pid = os.getpid()
+        return self._fd
+
+
+def _default_state_path() -> Path:
+    # A file created by another user isn't writable. On Windows, the temporary directory is per user already
+    name = f"e621-py-ratelimit-{os.getuid()}.bin" if hasattr(os, "getuid") else "e621-py-ratelimit.bin"
+    return Path(tempfile.gettempdir()) / name
+
+
+def _abandon(state: List[Any], ticket: int) -> None:
+    serving, next_ticket = state[3], state[2]
+    if ticket >= next_ticket:
+        # It was never handed out
+        return
+    if ticket == serving:
+        state[3] += 1
+        state[4] = time.time()
+    elif ticket > serving:
+        abandoned = state[5:]
+        if -1 in abandoned:
+            state[5 + abandoned.index(-1)] = ticket
+        # Otherwise it is skipped after stale_after seconds, like the ticket of a dead process
+
+
+def _skip_abandoned(state: List[Any]) -> None:
+    """Moves the queue past abandoned tickets and frees the slots of the ones it has passed"""
+    abandoned = state[5:]
+    while state[3] in abandoned:
+        abandoned[abandoned.index(state[3])] = -1
+        state[3] += 1
+        state[4] = time.time()
+    state[5:] = [ticket if ticket >= state[3] else -1 for ticket in abandoned]
+
+
+def _lock_file(fd: int) -> None:
+    if fcntl is not None:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+    else:
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+
+
+def _unlock_file(fd: int) -> None:
+    if fcntl is not None:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+    else:
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
@@ -0,0 +1,170 @@
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Dict,
+    Hashable,
+    Iterable,
+    List,
+    Sequence,
+    Type,
+    TypeVar,
+)
+
+from typing_extensions import Protocol
+
+if TYPE_CHECKING:
+    from .api import E621
+    from .models import Pool, Post, User
+
+__all__ = ["fetch_posts", "fetch_pools", "fetch_users", "resolve_posts", "load_related"]
+
+Model = TypeVar("Model")
+
+# e621 ignores everything after the first 100 ids of an id:1,2,3 search
+ID_CHUNK_SIZE = 100
+RELATIONS = ("parent", "children", "pools", "uploader")
+
+
+class _HasPostIds(Protocol):
+    post_ids: List[int]
+
+
+def _fetch_many(
+    api: "E621",
+    model: Type[Model],
+    ids: Iterable[Hashable],
+    fetch_chunk: Callable[[List[Any]], List[Model]],
+    chunk_size: int,
+    max_workers: int,
+) -> Dict[Any, Model]:
+    """Fetches the entities with the given ids in as few concurrent requests as possible
+
+    Ids are deduplicated, ids already present in api.entity_cache are not requested at all.
+    Deleted and nonexistent entities are silently missing from the result.
+    """
+    ids = list(dict.fromkeys(ids))
+    found: Dict[Any, Model] = {}
+    cache = api.entity_cache
+    if cache is not None:
+        found.update(cache.get_many(model, ids))
+        ids = [id for id in ids if id not in found]
+
+    chunks = [ids[i : i + chunk_size] for i in range(0, len(ids), chunk_size)]
+    if len(chunks) > 1 and max_workers > 1:
+        with ThreadPoolExecutor(min(max_workers, len(chunks))) as executor:
+            # The chunks are fetched with the priority of the caller
+            futures = [executor.submit(contextvars.copy_context().run, fetch_chunk, chunk) for chunk in chunks]
+            pages = [future.result() for future in futures]
+    else:
+        pages = [fetch_chunk(chunk) for chunk in chunks]
+
+    for page in pages:
+        for obj in page:
+            found[obj.id] = obj  # type: ignore
+        if cache is not None:
+            cache.put_many(page)
+    return found
+
+
+def fetch_posts(
+    api: "E621",
+    post_ids: Iterable[int],
+    chunk_size: int = ID_CHUNK_SIZE,
+    max_workers: int = 4,
+) -> Dict[int, "Post"]:
+    from .models import Post
+
+    return _fetch_many(api, Post, post_ids, api.posts.get, chunk_size, max_workers)
+
+
+def fetch_pools(
+    api: "E621",
+    pool_ids: Iterable[int],
+    chunk_size: int = ID_CHUNK_SIZE,
+    max_workers: int = 4,
+) -> Dict[int, "Pool"]:
+    from .models import Pool
+
+    def fetch_chunk(ids: List[int]) -> List[Pool]:
+        return api.pools.search(id=ids, limit=len(ids))
+
+    return _fetch_many(api, Pool, pool_ids, fetch_chunk, chunk_size, max_workers)
+
+
+def fetch_users(
+    api: "E621",
+    user_ids: Iterable[int],
+    chunk_size: int = ID_CHUNK_SIZE,
+    max_workers: int = 4,
+) -> Dict[int, "User"]:
+    from .models import User
+
+    def fetch_chunk(ids: List[int]) -> List[User]:
+        return api.users._default_search({"search[id]": ",".join(map(str, ids))}, limit=len(ids))
+
+    return _fetch_many(api, User, user_ids, fetch_chunk, chunk_size, max_workers)
+
+
+def _ordered_posts(api: "E621", post_ids: Sequence[int], found: Dict[int, "Post"]) -> List["Post"]:
+    posts = [found[id] for id in post_ids if id in found]
+    if api.logged_in:
+        blacklist = api.users.me.blacklist
+        return [p for p in posts if not blacklist.intersects(p.all_tags)]
+    return posts
+
+
+def resolve_posts(containers: Iterable[_HasPostIds], api: "E621", max_workers: int = 4) -> None:
+    """Fills the posts property of every pool or post set with a shared set of requests
+
+    Each container receives its posts in the order of its post_ids.
+    """
+    containers = list(containers)
+    found = fetch_posts(api, (id for c in containers for id in c.post_ids), max_workers=max_workers)
+    for container in containers:
+        # Same slot that cached_property would have filled on first access
+        container.__dict__["posts"] = _ordered_posts(api, container.post_ids, found)
+
+
+def load_related(posts: Sequence["Post"], api: "E621", include: Iterable[str], max_workers: int = 4) -> None:
+    """Eagerly loads the related entities of all the posts, making one chunked query per relation type
+
+    The possible relations and the attributes they fill are:
+        "parent" -> post.parent, "children" -> post.children,
+        "pools" -> post.in_pools, "uploader" -> post.uploader
+    """
+    include = set(include)
+    unknown = include.difference(RELATIONS)
+    if unknown:
+        raise ValueError(f"Unknown relations: {sorted(unknown)}. Expected any of {RELATIONS}")
+    if not include or not posts:
+        return
+
+    related_posts: Dict[int, Post] = {}
+    pools: Dict[int, Pool] = {}
+    users: Dict[int, User] = {}
+    related_post_ids: List[int] = []
+    if "parent" in include:
+        related_post_ids.extend(p.relationships.parent_id for p in posts if p.relationships.parent_id is not None)
+    if "children" in include:
+        related_post_ids.extend(id for p in posts for id in p.relationships.children)
+    if related_post_ids:
+        related_posts = fetch_posts(api, related_post_ids, max_workers=max_workers)
+    if "pools" in include:
+        pools = fetch_pools(api, (id for p in posts for id in p.pools), max_workers=max_workers)
+    if "uploader" in include:
+        users = fetch_users(api, (p.uploader_id for p in posts), max_workers=max_workers)
+
+    # Same slots that the cached_properties would have filled on first access
+    for post in posts:
+        if "parent" in include:
+            parent_id = post.relationships.parent_id
+            post.__dict__["parent"] = related_posts.get(parent_id) if parent_id is not None else None
+        if "children" in include:
+            post.__dict__["children"] = [related_posts[id] for id in post.relationships.children if id in related_posts]
+        if "pools" in include:
+            post.__dict__["in_pools"] = [pools[id] for id in post.pools if id in pools]
+        if "uploader" in include:
+            post.__dict__["uploader"] = users.get(post.uploader_id)
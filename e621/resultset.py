@@ -0,0 +1,182 @@
+import mmap
+import tempfile
+import threading
+from array import array
+from pathlib import Path
+from typing import (
+    IO,
+    TYPE_CHECKING,
+    Any,
+    Dict,
+    Generic,
+    Iterable,
+    Iterator,
+    Optional,
+    Sequence,
+    Type,
+    TypeVar,
+    Union,
+    overload,
+)
+
+from .base_model import BaseModel
+from .serialization import RECORD_HEADER, pack, unpack
+
+if TYPE_CHECKING:
+    from .api import E621
+
+__all__ = ["DiskResultSet", "ResultSetSlice"]
+
+Model = TypeVar("Model", bound=BaseModel)
+
+
+class DiskResultSet(Sequence[Model], Generic[Model]):
+    """An append-only list of search results that lives on disk and builds its models only when they are accessed
+
+    Every result is stored as a length-prefixed record in the compact format of e621.serialization.pack,
+    in a record file that is read through mmap. Only the offsets where the records start are kept in memory
+    (8 bytes per result), so millions of posts fit on small machines.
+    Without a path, the records go to an anonymous temporary file that disappears once the result set is closed.
+    With a path, they stay there, and passing the same path again opens them and appends to them.
+    The files written by PackedExporter can be opened the same way.
+    """
+
+    def __init__(self, model: Type[Model], api: "E621", path: Union[str, Path, None] = None) -> None:
+        self.model = model
+        self.path = None if path is None else Path(path)
+        self._api = api
+        self._file: IO[bytes] = tempfile.TemporaryFile() if self.path is None else open(self.path, "a+b")
+        self._lock = threading.Lock()
+        self._map: Optional[mmap.mmap] = None
+        self._mapped_size = 0
+        # Where every record starts, followed by where the last one ends
+        self._offsets = array("Q", [0])
+        self._file.seek(0, 2)
+        if self._file.tell():
+            self._index_existing_records()
+
+    def _index_existing_records(self) -> None:
+        self._remap(self._file.tell())
+        if self._map is None:
+            return
+        pos = 0
+        while pos + RECORD_HEADER.size <= self._mapped_size:
+            (length,) = RECORD_HEADER.unpack_from(self._map, pos)
+            if pos + RECORD_HEADER.size + length > self._mapped_size:
+                break
+            pos += RECORD_HEADER.size + length
+            self._offsets.append(pos)
+        if pos < self._mapped_size:
+            # The last record was cut off by a crash, so it is overwritten by the next one
+            self._remap(pos)
+            self._file.truncate(pos)
+
+    def append(self, raw: Dict[str, Any]) -> None:
+        self.extend([raw])
+
+    def extend(self, raws: Iterable[Dict[str, Any]]) -> None:
+        """Appends raw results, as returned by the api, to the end of the record file"""
+        with self._lock:
+            end = self._offsets[-1]
+            self._file.seek(end)
+            for raw in raws:
+                data = pack(self.model, raw)
+                self._file.write(RECORD_HEADER.pack(len(data)) + data)
+                end += RECORD_HEADER.size + len(data)
+                self._offsets.append(end)
+
+    def raw(self, index: int) -> Dict[str, Any]:
+        """The raw result at the index, without building its model"""
+        index = self._normalize_index(index)
+        start, end = self._offsets[index], self._offsets[index + 1]
+        with self._lock:
+            if end > self._mapped_size:
+                self._file.flush()
+                self._remap(self._offsets[-1])
+            assert self._map is not None
+            record = self._map[start + RECORD_HEADER.size : end]
+        return unpack(self.model, record)
+
+    def iter_raw(self) -> Iterator[Dict[str, Any]]:
+        for i in range(len(self)):
+            yield self.raw(i)
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    @overload
+    def __getitem__(self, index: int) -> Model:
+        ...
+
+    @overload
+    def __getitem__(self, index: slice) -> "ResultSetSlice[Model]":
+        ...
+
+    def __getitem__(self, index: Union[int, slice]) -> Union[Model, "ResultSetSlice[Model]"]:
+        if isinstance(index, slice):
+            return ResultSetSlice(self, range(len(self))[index])
+        return self.model._validate(self.raw(index), self._api)
+
+    def __iter__(self) -> Iterator[Model]:
+        for raw in self.iter_raw():
+            yield self.model._validate(raw, self._api)
+
+    def close(self) -> None:
+        with self._lock:
+            if self._map is not None:
+                self._map.close()
+                self._map = None
+            self._mapped_size = 0
+            self._file.close()
+
+    def __enter__(self) -> "DiskResultSet[Model]":
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
+
+    def __repr__(self) -> str:
+        return f"<DiskResultSet of {len(self)} {self.model.__name__} at {self.path or 'a temporary file'}>"
+
+    def _normalize_index(self, index: int) -> int:
+        length = len(self)
+        if index < 0:
+            index += length
+        if not 0 <= index < length:
+            raise IndexError("DiskResultSet index out of range")
+        return index
+
+    def _remap(self, size: int) -> None:
+        if self._map is not None:
+            self._map.close()
+        # An empty file can't be mapped
+        self._map = mmap.mmap(self._file.fileno(), size, access=mmap.ACCESS_READ) if size else None
+        self._mapped_size = size
+
+
+class ResultSetSlice(Sequence[Model], Generic[Model]):
+    """A lazy view of a part of a DiskResultSet. Nothing is read until its items are accessed"""
+
+    def __init__(self, results: DiskResultSet[Model], indices: range) -> None:
+        self._results = results
+        self._indices = indices
+
+    def __len__(self) -> int:
+        return len(self._indices)
+
+    @overload
+    def __getitem__(self, index: int) -> Model:
+        ...
+
+    @overload
+    def __getitem__(self, index: slice) -> "ResultSetSlice[Model]":
+        ...
+
+    def __getitem__(self, index: Union[int, slice]) -> Union[Model, "ResultSetSlice[Model]"]:
+        if isinstance(index, slice):
+            return ResultSetSlice(self._results, self._indices[index])
+        return self._results[self._indices[index]]
+
+    def __iter__(self) -> Iterator[Model]:
+        for i in self._indices:
+            yield self._results[i]
@@ -0,0 +1,179 @@
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Any, Deque, Dict, Iterator, List, Mapping, Optional
+
+import requests
+
+from .ratelimit import RateLimiter
+from .util import percentile
+
+if TYPE_CHECKING:
+    from .models import AuthenticatedUser
+
+__all__ = ["INTERACTIVE", "BULK", "ClassStats", "RequestScheduler", "priority", "current_priority"]
+
+INTERACTIVE = "interactive"
+BULK = "bulk"
+
+_current_priority: ContextVar[Optional[str]] = ContextVar("e621_priority", default=None)
+
+
+@contextmanager
+def priority(name: str) -> Iterator[None]:
+    """Sends every request made inside the block with the given priority class"""
+    token = _current_priority.set(name)
+    try:
+        yield
+    finally:
+        _current_priority.reset(token)
+
+
+@contextmanager
+def default_priority(name: str) -> Iterator[None]:
+    """Same as priority, unless the caller has already chosen one"""
+    if _current_priority.get() is None:
+        with priority(name):
+            yield
+    else:
+        yield
+
+
+def current_priority() -> Optional[str]:
+    return _current_priority.get()
+
+
+@dataclass
+class ClassStats:
+    requests: int
+    waiting: int
+    mean_wait: float
+    p50_wait: float
+    p95_wait: float
+    p99_wait: float
+    mean_latency: float
+    p95_latency: float
+
+
+class _ClassState:
+    def __init__(self, quota: float, samples: int) -> None:
+        self.quota = quota
+        self.queue: Deque[object] = deque()
+        self.requests = 0
+        self.waits: Deque[float] = deque(maxlen=samples)
+        self.latencies: Deque[float] = deque(maxlen=samples)
+
+
+class RequestScheduler:
+    """A rate limiter that hands out the tokens of another rate limiter by priority
+
+    classes maps the priority classes, from the most to the least important, to their quotas:
+    the share of the recent requests a class is guaranteed to get while other classes compete with it.
+    Otherwise the most important waiting class always goes first, so interactive requests jump ahead
+    of queued bulk traffic while the total throughput stays at the limiter's rate.
+    Requests without a priority (see the priority context manager) belong to default_class.
+    """
+
+    def __init__(
+        self,
+        limiter: RateLimiter,
+        classes: Optional[Mapping[str, float]] = None,
+        default_class: str = INTERACTIVE,
+        window: int = 100,
+        samples: int = 1000,
+    ) -> None:
+        if classes is None:
+            classes = {INTERACTIVE: 0.0, BULK: 0.2}
+        if default_class not in classes:
+            raise ValueError(f"default_class {default_class!r} is not one of {list(classes)}")
+        if sum(classes.values()) > 1:
+            raise ValueError("The quotas of all classes must add up to at most 1")
+        self.limiter = limiter
+        self.default_class = default_class
+        self._classes = {name: _ClassState(quota, samples) for name, quota in classes.items()}
+        self._recent: Deque[str] = deque(maxlen=window)
+        self._cond = threading.Condition()
+
+    def acquire(self) -> None:
+        name = self._class_name()
+        state = self._classes[name]
+        waiter = object()
+        enqueued_at = time.monotonic()
+        with self._cond:
+            state.queue.append(waiter)
+            self._cond.notify_all()
+            try:
+                while True:
+                    if self._pick() is not state or state.queue[0] is not waiter:
+                        self._cond.wait()
+                        continue
+                    try_acquire = getattr(self.limiter, "try_acquire", None)
+                    if try_acquire is None:
+                        # The limiter can only block, so the head waits for it without holding up the others
+                        self._cond.release()
+                        try:
+                            self.limiter.acquire()
+                        finally:
+                            self._cond.acquire()
+                        break
+                    wait = try_acquire()
+                    if wait == 0:
+                        break
+                    # Woken up early if someone more important arrives
+                    self._cond.wait(wait)
+            except BaseException:
+                # Otherwise everyone behind this waiter would wait for it forever
+                state.queue.remove(waiter)
+                self._cond.notify_all()
+                raise
+            state.queue.popleft()
+            state.requests += 1
+            state.waits.append(time.monotonic() - enqueued_at)
+            self._recent.append(name)
+            self._cond.notify_all()
+
+    def observe(self, response: requests.Response, elapsed: float) -> None:
+        self._classes[self._class_name()].latencies.append(elapsed)
+        observe = getattr(self.limiter, "observe", None)
+        if observe is not None:
+            observe(response, elapsed)
+
+    def configure_from_user(self, user: "AuthenticatedUser") -> None:
+        configure = getattr(self.limiter, "configure_from_user", None)
+        if configure is not None:
+            configure(user)
+
+    def stats(self) -> Dict[str, ClassStats]:
+        with self._cond:
+            return {
+                name: ClassStats(
+                    requests=state.requests,
+                    waiting=len(state.queue),
+                    mean_wait=sum(state.waits) / len(state.waits) if state.waits else 0.0,
+                    p50_wait=percentile(state.waits, 0.5),
+                    p95_wait=percentile(state.waits, 0.95),
+                    p99_wait=percentile(state.waits, 0.99),
+                    mean_latency=sum(state.latencies) / len(state.latencies) if state.latencies else 0.0,
+                    p95_latency=percentile(state.latencies, 0.95),
+                )
+                for name, state in self._classes.items()
+            }
+
+    def _class_name(self) -> str:
+        name = _current_priority.get()
+        if name is None or name not in self._classes:
+            return self.default_class
+        return name
+
+    def _pick(self) -> Optional[_ClassState]:
+        waiting: List[Any] = [(name, state) for name, state in self._classes.items() if state.queue]
+        if not waiting:
+            return None
+        if len(waiting) > 1 and self._recent:
+            for name, state in waiting:
+                if self._recent.count(name) < state.quota * len(self._recent):
+                    return state
+        return waiting[0][1]
@@ -0,0 +1,232 @@
+import contextlib
+import importlib
+import json
+import marshal
+import struct
+import zlib
+from contextvars import ContextVar
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    Type,
+    Union,
+)
+
+from .base_model import (
+    BaseModel,
+    _is_list,
+    _is_model,
+    _set_api,
+    _strip_optional,
+    fields_of,
+)
+
+if TYPE_CHECKING:
+    from .api import E621
+
+__all__ = ["dumps", "loads", "pack", "unpack", "default_api", "RECORD_HEADER"]
+
+# Every encoded object starts with a byte that says which codec produced it
+_MARSHAL = b"\x01"
+_MSGPACK = b"\x02"
+_JSON = b"\x03"
+# Length prefix of the records in record files, such as the ones of DiskResultSet and PackedExporter
+RECORD_HEADER = struct.Struct("<I")
+
+_default_api: "ContextVar[Optional[E621]]" = ContextVar("e621_default_api", default=None)
+
+
+@contextlib.contextmanager
+def default_api(api: Optional["E621"]) -> Iterator[None]:
+    """The client that models loaded without an explicit one (e.g. by pickle.loads) are bound to"""
+    token = _default_api.set(api)
+    try:
+        yield
+    finally:
+        _default_api.reset(token)
+
+
+def dumps(obj: Union[BaseModel, List[BaseModel]]) -> bytes:
+    """Encodes a model, or a list of models of the same class, without its client
+
+    Fields are stored by position instead of by name, nested models as nested lists.
+    The bytes are encoded with msgpack if it is installed and with marshal otherwise.
+    Both are much smaller and faster than pickle and json,
+    but marshal data can only be loaded by the same Python version, so it is meant for memory rather than files.
+    """
+    if isinstance(obj, list):
+        if not obj:
+            raise ValueError("Can't tell the model of an empty list")
+        model = type(obj[0])
+        schema = _schema(model)
+        payload = [_name_of(model), schema.fingerprint, True, [schema.values_of(o) for o in obj]]
+    else:
+        schema = _schema(type(obj))
+        payload = [_name_of(type(obj)), schema.fingerprint, False, schema.values_of(obj)]
+    return _encode(payload)
+
+
+def loads(data: bytes, api: Optional["E621"] = None) -> Any:
+    """Decodes what dumps encoded, binding the models to api (or to the default_api if api is None)
+
+    The models are rebuilt without being validated again.
+    """
+    name, fingerprint, many, values = _decode(data)
+    schema = _schema(_model_named(name))
+    schema.check(fingerprint)
+    if api is None:
+        api = _default_api.get()
+    if many:
+        return [schema.build(v, api) for v in values]
+    return schema.build(values, api)
+
+
+def pack(model: Type[BaseModel], raw: Dict[str, Any]) -> bytes:
+    """Encodes a raw entity, as returned by the api, positionally by the fields of the model
+
+    Keys that the model doesn't know about are kept, so unpack returns the same dict,
+    except that fields of the model that were missing from it come back as None.
+    These records go to files, so they are encoded with msgpack if it is installed and with JSON otherwise,
+    never with marshal, which a later Python version might not be able to read.
+    """
+    schema = _schema(model)
+    return _encode([schema.fingerprint, schema.pack_raw(raw)], portable=True)
+
+
+def unpack(model: Type[BaseModel], data: bytes) -> Dict[str, Any]:
+    fingerprint, values = _decode(data)
+    schema = _schema(model)
+    schema.check(fingerprint)
+    return schema.unpack_raw(values)
+
+
+def _restore(data: bytes) -> BaseModel:
+    return loads(data)
+
+
+def _encode(payload: List[Any], portable: bool = False) -> bytes:
+    try:
+        import msgpack
+    except ImportError:
+        if portable:
+            return _JSON + json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode()
+        return _MARSHAL + marshal.dumps(payload)
+    return _MSGPACK + msgpack.packb(payload, use_bin_type=True)
+
+
+def _decode(data: bytes) -> Any:
+    codec, body = data[:1], data[1:]
+    if codec == _MARSHAL:
+        return marshal.loads(body)
+    if codec == _JSON:
+        return json.loads(body)
+    if codec == _MSGPACK:
+        try:
+            import msgpack
+        except ImportError as e:
+            raise ImportError("This data was encoded with msgpack: pip install msgpack") from e
+        return msgpack.unpackb(body, raw=False, strict_map_key=False)
+    raise ValueError(f"Unknown serialization codec {codec!r}")
+
+
+def _name_of(model: Type[BaseModel]) -> str:
+    return f"{model.__module__}:{model.__qualname__}"
+
+
+_models: Dict[str, Type[BaseModel]] = {}
+
+
+def _model_named(name: str) -> Type[BaseModel]:
+    model = _models.get(name)
+    if model is None:
+        module, _, qualname = name.partition(":")
+        model = importlib.import_module(module)  # type: ignore
+        for part in qualname.split("."):
+            model = getattr(model, part)
+        _models[name] = model
+    return model
+
+
+class _Schema:
+    """The positional layout of a model, with everything needed to go from a model or raw entity to it and back"""
+
+    def __init__(self, model: Type[BaseModel]) -> None:
+        self.model = model
+        self.names: List[str] = []
+        self.aliases: List[str] = []
+        # (position, name, alias, schema, is_list) of the fields that hold a nested model or a list of them
+        self.nested: List[Tuple[int, str, str, _Schema, bool]] = []
+        for i, (name, alias, annotation) in enumerate(fields_of(model)):
+            self.names.append(name)
+            self.aliases.append(alias)
+            annotation = _strip_optional(annotation)
+            is_list = _is_list(annotation)
+            if is_list:
+                annotation = _strip_optional(annotation.__args__[0])
+            if _is_model(annotation):
+                self.nested.append((i, name, alias, _schema(annotation), is_list))
+        self.known_aliases = set(self.aliases)
+        # Changes whenever a field is added, removed, renamed or moved anywhere in the model
+        nested = {i: schema.fingerprint for i, _, _, schema, _ in self.nested}
+        layout = ",".join(f"{alias}:{nested.get(i, '')}" for i, alias in enumerate(self.aliases))
+        self.fingerprint = zlib.crc32(f"{model.__name__}({layout})".encode())
+
+    def check(self, fingerprint: int) -> None:
+        if fingerprint != self.fingerprint:
+            raise ValueError(f"The data was encoded with a different version of the {self.model.__name__} model")
+
+    def values_of(self, obj: BaseModel) -> List[Any]:
+        fields = obj.__dict__
+        values = [fields[name] for name in self.names]
+        for i, _, _, schema, is_list in self.nested:
+            value = values[i]
+            if value is not None:
+                values[i] = [schema.values_of(v) for v in value] if is_list else schema.values_of(value)
+        return values
+
+    def build(self, values: List[Any], api: Optional["E621"]) -> BaseModel:
+        fields = dict(zip(self.names, values))
+        for i, name, _, schema, is_list in self.nested:
+            value = values[i]
+            if value is not None:
+                fields[name] = [schema.build(v, None) for v in value] if is_list else schema.build(value, None)
+        model = self.model._construct(fields)
+        if api is not None:
+            _set_api(model, api)
+        return model
+
+    def pack_raw(self, raw: Dict[str, Any]) -> List[Any]:
+        values = [raw.get(alias) for alias in self.aliases]
+        for i, _, _, schema, is_list in self.nested:
+            value = values[i]
+            if value is not None:
+                values[i] = [schema.pack_raw(v) for v in value] if is_list else schema.pack_raw(value)
+        if not self.known_aliases.issuperset(raw):
+            # Keys that appeared in the api after the models were generated
+            values.append({key: value for key, value in raw.items() if key not in self.known_aliases})
+        return values
+
+    def unpack_raw(self, values: List[Any]) -> Dict[str, Any]:
+        raw = dict(zip(self.aliases, values))
+        for i, _, alias, schema, is_list in self.nested:
+            value = values[i]
+            if value is not None:
+                raw[alias] = [schema.unpack_raw(v) for v in value] if is_list else schema.unpack_raw(value)
+        if len(values) > len(self.aliases):
+            raw.update(values[-1])
+        return raw
+
+
+_schemas: Dict[type, _Schema] = {}
+
+
+def _schema(model: Type[BaseModel]) -> _Schema:
+    schema = _schemas.get(model)
+    if schema is None:
+        schema = _schemas[model] = _Schema(model)
+    return schema
@@ -1,15 +1,54 @@
-from typing import Any, Dict, List, Optional, Tuple
+import contextvars
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from contextlib import nullcontext
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+)
+from urllib.parse import urlsplit
 
 import requests
+from requests.adapters import BaseAdapter, HTTPAdapter
 from typing_extensions import TypeAlias
 
+from .circuit import CircuitBreaker, is_outage
+from .enums import OffsetRelation
+from .hedging import HedgePolicy
+from .instrumentation import Instrumentation, RequestEvent, hedge_request
+from .ratelimit import RateLimiter
+from .scheduler import BULK, current_priority, default_priority
+from .streaming import iter_json_array
+
+if TYPE_CHECKING:
+    from .models import AuthenticatedUser
+
 Username: TypeAlias = str
 ApiKey: TypeAlias = str
 
+# The largest page e621 will return, bigger limits are silently truncated to it
+MAX_PAGE_SIZE = 320
+# Bytes read at a time from streamed responses
+STREAM_CHUNK_SIZE = 64 * 1024
+
 
 class SimpleSession(requests.Session):
     """A session that automatically configures itself with the necessary auth and headers
     and always makes requests to base_url
+
+    transport replaces the adapter that sends the requests, e.g. with a transport.ReplayAdapter or http2.Http2Adapter.
+    Otherwise, up to pool_size connections are kept open for the threads that share the session.
+    With a circuit_breaker, requests fail fast with circuit.CircuitOpenError while e621 is down.
+    With a hedge_policy, GETs that take unusually long get a second copy, and whichever answers first is used.
+    Bulk requests (see scheduler.priority) and streamed ones are never hedged
     """
 
     def __init__(
@@ -19,20 +58,156 @@ class SimpleSession(requests.Session):
         auth: Optional[Tuple[Username, ApiKey]],
         client_name: str,
         client_version: str,
+        rate_limiter: Optional[RateLimiter] = None,
+        instrumentation: Optional[Instrumentation] = None,
+        transport: Optional[BaseAdapter] = None,
+        pool_size: int = 10,
+        keep_alive: bool = True,
+        circuit_breaker: Optional[CircuitBreaker] = None,
+        hedge_policy: Optional[HedgePolicy] = None,
     ) -> None:
         super().__init__()
         self.base_url = base_url
         self.timeout = timeout
+        self.rate_limiter = rate_limiter
+        self.instrumentation = instrumentation
+        self.circuit_breaker = circuit_breaker
+        self.hedge_policy = hedge_policy
+        self._hedge_executor: Optional[ThreadPoolExecutor] = None
+        self._hedge_workers = 2 * pool_size
+        self._hedge_lock = threading.Lock()
+        if transport is None:
+            # All requests go to one host, so one pool is enough, but it needs a connection per thread.
+            # Without pool_block, threads that find the pool empty open extra connections that are then thrown away
+            transport = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        # Every request goes to base_url, so the transport only has to handle its scheme
+        self.mount(f"{urlsplit(base_url).scheme}://", transport)
         self.headers.update({"User-Agent": f"{client_name}/{client_version}"})
+        if not keep_alive:
+            self.headers["Connection"] = "close"
         if auth is not None:
             self.auth = auth
 
     def request(self, method: str, endpoint: str, *args: Any, **kwargs: Any) -> requests.Response:
         url = self.base_url.format(endpoint=endpoint)
-        r = super().request(method, url, *args, timeout=self.timeout, **kwargs)
+        breaker = self.circuit_breaker
+        if breaker is not None:
+            # Before the rate limiter, so that failing fast doesn't use up the budget
+            breaker.before_request()
+        try:
+            if (
+                self.hedge_policy is not None
+                and method == "GET"
+                and not kwargs.get("stream")
+                and current_priority() != BULK
+            ):
+                r = self._hedged_request(self.hedge_policy, method, endpoint, url, *args, **kwargs)
+            else:
+                r = self._send(method, endpoint, url, *args, **kwargs)
+        except Exception:
+            if breaker is not None:
+                breaker.record(failed=True)
+            raise
+        if breaker is not None:
+            breaker.record(failed=is_outage(r))
         r.raise_for_status()
         return r
 
+    def _send(self, method: str, endpoint: str, url: str, *args: Any, **kwargs: Any) -> requests.Response:
+        if self.rate_limiter is None and self.instrumentation is None:
+            return super().request(method, url, *args, timeout=self.timeout, **kwargs)
+        return self._measured_request(method, endpoint, url, *args, **kwargs)
+
+    def _hedged_request(
+        self, policy: HedgePolicy, method: str, endpoint: str, url: str, *args: Any, **kwargs: Any
+    ) -> requests.Response:
+        delay = policy.delay()
+
+        def attempt() -> requests.Response:
+            start = time.monotonic()
+            r = self._send(method, endpoint, url, *args, **kwargs)
+            policy.observe(time.monotonic() - start)
+            return r
+
+        if delay is None:
+            return attempt()
+        executor = self._get_hedge_executor()
+        # The attempts run on other threads, which must see the priority and retry attempt of this one
+        first = executor.submit(contextvars.copy_context().run, attempt)
+        done, _ = wait([first], timeout=delay)
+        if done or not policy.try_hedge():
+            return first.result()
+        second = executor.submit(contextvars.copy_context().run, _as_hedge, attempt)
+        pending = {first, second}
+        while True:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            winner = next((future for future in done if future.exception() is None), None)
+            if winner is None and pending:
+                # The first one to finish failed, so the other one may still succeed
+                continue
+            if winner is None:
+                winner = done.pop()
+            for loser in (done | pending) - {winner}:
+                # requests can't abort a request in flight, but its response is closed as soon as it arrives
+                if not loser.cancel():
+                    loser.add_done_callback(_close_response)
+            return winner.result()
+
+    def _get_hedge_executor(self) -> ThreadPoolExecutor:
+        with self._hedge_lock:
+            if self._hedge_executor is None:
+                self._hedge_executor = ThreadPoolExecutor(self._hedge_workers, thread_name_prefix="e621-hedge")
+            return self._hedge_executor
+
+    def close(self) -> None:
+        super().close()
+        with self._hedge_lock:
+            if self._hedge_executor is not None:
+                self._hedge_executor.shutdown(wait=False)
+                self._hedge_executor = None
+
+    def _measured_request(self, method: str, endpoint: str, url: str, *args: Any, **kwargs: Any) -> requests.Response:
+        instrumentation = self.instrumentation
+        event = None if instrumentation is None else RequestEvent(endpoint, method)
+        queued = time.monotonic()
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire()
+        start = time.monotonic()
+        try:
+            r = super().request(method, url, *args, timeout=self.timeout, **kwargs)
+        except requests.RequestException as e:
+            if instrumentation is not None and event is not None:
+                event.queue_wait = start - queued
+                event.network_time = time.monotonic() - start
+                event.error = type(e).__name__
+                instrumentation.emit_request(event)
+            raise
+        elapsed = time.monotonic() - start
+        observe = getattr(self.rate_limiter, "observe", None)
+        if observe is not None:
+            observe(r, elapsed)
+        if instrumentation is not None and event is not None:
+            event.status = r.status_code
+            event.queue_wait = start - queued
+            event.network_time = elapsed
+            # Reading a streamed body here would defeat the streaming, so it is sized by its header instead
+            event.bytes = int(r.headers.get("Content-Length", 0)) if kwargs.get("stream") else len(r.content)
+            event.cache_hit = bool(getattr(r, "from_cache", False))
+            r.e621_event = event  # type: ignore
+            instrumentation.emit_request(event)
+        return r
+
+    def configure_from_user(self, user: "AuthenticatedUser") -> None:
+        """Adapts the session to the limits of the authenticated account"""
+        self.timeout = max(self.timeout, user.statement_timeout / 1000 + 1)
+        configure = getattr(self.rate_limiter, "configure_from_user", None)
+        if configure is not None:
+            configure(user)
+
+    def _emit_parse(self, event: RequestEvent) -> None:
+        if self.instrumentation is not None:
+            self.instrumentation.emit_parse(event)
+
     def paginated_get(
         self,
         endpoint: str,
@@ -43,16 +218,163 @@ class SimpleSession(requests.Session):
     ) -> List[Dict[Any, Any]]:
         """Performs a paginated GET request to the given endpoint, returning a list of all the results"""
         results: List[Dict[Any, Any]] = []
-        while True:
-            json = self.get(endpoint, params=params, *args, **kwargs).json()
-            chunk: List[Dict[Any, Any]]
-            if root_entity_name is not None and isinstance(json, dict):
-                chunk = json[root_entity_name]
-            else:
-                chunk = json
-            params["page"] += 1
-            params["limit"] -= len(chunk)
+        for chunk in self.iter_paginated_get(
+            endpoint, params, root_entity_name, *args, page_size=params["limit"], **kwargs
+        ):
             results.extend(chunk)
-            if params["limit"] <= 0 or len(chunk) == 0:
-                break
         return results
+
+    def iter_paginated_get(
+        self,
+        endpoint: str,
+        params: Dict[str, Any],
+        root_entity_name: Optional[str] = None,
+        *args: Any,
+        page_size: Optional[int] = None,
+        use_cursor: bool = False,
+        bulk: bool = False,
+        **kwargs: Any,
+    ) -> Iterator[List[Dict[Any, Any]]]:
+        """Lazily performs a paginated GET request to the given endpoint, yielding one page of results at a time
+
+        If params["limit"] is None, the pages are requested until they run out.
+        If use_cursor is True, the next page is requested with a b<id> cursor instead of a page number,
+        which is faster for deep pages and not subject to e621's page number limit.
+        If params["page"] is a cursor itself (see PageOffset), the pages always continue with cursors,
+        in the cursor's direction: an a<id> start walks up through the newer results, a b<id> start down.
+        If bulk is True, the pages are requested as BULK traffic (see scheduler.priority),
+        unless the caller has chosen a priority already.
+        """
+        for page in self._iter_pages(
+            endpoint, params, root_entity_name, args, kwargs, page_size, use_cursor, False, bulk
+        ):
+            chunk = list(page)
+            if chunk:
+                yield chunk
+
+    def iter_paginated_items(
+        self,
+        endpoint: str,
+        params: Dict[str, Any],
+        root_entity_name: Optional[str] = None,
+        *args: Any,
+        page_size: Optional[int] = None,
+        use_cursor: bool = False,
+        stream: bool = True,
+        bulk: bool = False,
+        **kwargs: Any,
+    ) -> Iterator[Dict[Any, Any]]:
+        """Same as iter_paginated_get, but yields the results one at a time
+
+        If stream is True, each page is decoded while it downloads, one result at a time,
+        so the memory used doesn't grow with the page size.
+        """
+        for page in self._iter_pages(
+            endpoint, params, root_entity_name, args, kwargs, page_size, use_cursor, stream, bulk
+        ):
+            yield from page
+
+    def _iter_pages(
+        self,
+        endpoint: str,
+        params: Dict[str, Any],
+        root_entity_name: Optional[str],
+        args: Tuple[Any, ...],
+        kwargs: Dict[str, Any],
+        page_size: Optional[int],
+        use_cursor: bool,
+        stream: bool,
+        bulk: bool,
+    ) -> Iterator["_Page"]:
+        """Yields the results of every page. Each page has to be consumed before the next one is requested"""
+        remaining: Optional[int] = params["limit"]
+        if page_size is None:
+            page_size = MAX_PAGE_SIZE
+        after = False
+        start = str(params["page"])
+        if start[:1] in (OffsetRelation.AFTER.value, OffsetRelation.BEFORE.value):
+            # e621 orders the results of a cursor by id, so only another cursor can continue from them
+            use_cursor = True
+            after = start[0] == OffsetRelation.AFTER.value
+        if not use_cursor:
+            # Page n starts at (n - 1) * limit, so the limit can't change between pages. The last one is trimmed instead
+            page_size = min(page_size, MAX_PAGE_SIZE)
+        while remaining is None or remaining > 0:
+            params["limit"] = page_size if remaining is None or not use_cursor else min(page_size, remaining)
+            with default_priority(BULK) if bulk else nullcontext():
+                response = self.get(endpoint, params=params, *args, stream=stream, **kwargs)
+            if stream:
+                page = _Page(_stream_results(response, root_entity_name), remaining)
+            else:
+                page = _Page(self._decode_results(response, root_entity_name), remaining)
+            yield page
+            if page.count == 0:
+                break
+            if remaining is not None:
+                remaining -= page.count
+            if page.count < params["limit"] <= MAX_PAGE_SIZE:
+                break
+            if after:
+                params["page"] = f"{OffsetRelation.AFTER.value}{page.max_id}"
+            elif use_cursor:
+                params["page"] = f"{OffsetRelation.BEFORE.value}{page.min_id}"
+            else:
+                params["page"] += 1
+
+    def _decode_results(self, response: requests.Response, root_entity_name: Optional[str]) -> List[Dict[Any, Any]]:
+        event: Optional[RequestEvent] = getattr(response, "e621_event", None)
+        if event is None:
+            json = response.json()
+        else:
+            start = time.monotonic()
+            json = response.json()
+            event.decode_time = time.monotonic() - start
+            self._emit_parse(event)
+        if root_entity_name is not None and isinstance(json, dict):
+            return json[root_entity_name]
+        return json
+
+
+def _as_hedge(attempt: Callable[[], requests.Response]) -> requests.Response:
+    with hedge_request():
+        return attempt()
+
+
+def _close_response(future: "Future[requests.Response]") -> None:
+    if not future.cancelled() and future.exception() is None:
+        future.result().close()
+
+
+def _stream_results(response: requests.Response, root_entity_name: Optional[str]) -> Iterator[Dict[Any, Any]]:
+    try:
+        yield from iter_json_array(response.iter_content(STREAM_CHUNK_SIZE), root_entity_name)
+    finally:
+        response.close()
+
+
+class _Page:
+    """The results of a single page, counted as they are consumed. Stops after limit results, if given"""
+
+    def __init__(self, results: Iterable[Dict[Any, Any]], limit: Optional[int] = None) -> None:
+        self._results = results
+        self._limit = limit
+        self.count = 0
+        self.min_id: Optional[int] = None
+        self.max_id: Optional[int] = None
+
+    def __iter__(self) -> Iterator[Dict[Any, Any]]:
+        try:
+            for result in self._results:
+                if self.count == self._limit:
+                    break
+                self.count += 1
+                id = result.get("id")
+                if id is not None:
+                    self.min_id = id if self.min_id is None else min(self.min_id, id)
+                    self.max_id = id if self.max_id is None else max(self.max_id, id)
+                yield result
+        finally:
+            # Releases the connection of a streamed page that was cut short
+            close = getattr(self._results, "close", None)
+            if close is not None:
+                close()
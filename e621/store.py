@@ -0,0 +1,82 @@
+import json
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Union
+
+from .idset import PostIdSet
+
+__all__ = ["LocalStore"]
+
+
+class LocalStore:
+    """A local SQLite database of raw e621 entities, keyed by their kind ("posts", "pools", ...) and id
+
+    Writing the same entity twice replaces it, so several processes can fill one store
+    and an interrupted job can simply rewrite whatever it had written last.
+    """
+
+    def __init__(self, path: Union[str, Path]) -> None:
+        self.path = Path(path)
+        self._local = threading.local()
+        with self._connection as db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS entities ("
+                "kind TEXT NOT NULL, id INTEGER NOT NULL, data TEXT NOT NULL, PRIMARY KEY (kind, id)"
+                ") WITHOUT ROWID"
+            )
+
+    @property
+    def _connection(self) -> sqlite3.Connection:
+        # sqlite3 connections cannot be shared between threads
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(str(self.path), timeout=60)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def put_many(self, kind: str, records: Iterable[Dict[str, Any]]) -> None:
+        with self._connection as db:
+            db.executemany(
+                "INSERT OR REPLACE INTO entities (kind, id, data) VALUES (?, ?, ?)",
+                ((kind, r["id"], json.dumps(r, ensure_ascii=False)) for r in records),
+            )
+
+    def get(self, kind: str, id: int) -> Optional[Dict[str, Any]]:
+        row = self._connection.execute("SELECT data FROM entities WHERE kind = ? AND id = ?", (kind, id)).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def get_many(self, kind: str, ids: Iterable[int]) -> Dict[int, Dict[str, Any]]:
+        found = {}
+        ids = list(ids)
+        # SQLite limits the number of variables in a single statement
+        for i in range(0, len(ids), 500):
+            chunk = ids[i : i + 500]
+            rows = self._connection.execute(
+                f"SELECT id, data FROM entities WHERE kind = ? AND id IN ({','.join('?' * len(chunk))})",
+                (kind, *chunk),
+            )
+            found.update((id, json.loads(data)) for id, data in rows)
+        return found
+
+    def ids(self, kind: str) -> List[int]:
+        return [id for (id,) in self._connection.execute("SELECT id FROM entities WHERE kind = ? ORDER BY id", (kind,))]
+
+    def id_set(self, kind: str) -> PostIdSet:
+        """The ids of every stored entity of the kind, e.g. to leave the posts already stored out of a download"""
+        return PostIdSet(id for (id,) in self._connection.execute("SELECT id FROM entities WHERE kind = ?", (kind,)))
+
+    def count(self, kind: str) -> int:
+        return self._connection.execute("SELECT COUNT(*) FROM entities WHERE kind = ?", (kind,)).fetchone()[0]
+
+    def iter(self, kind: str) -> Iterator[Dict[str, Any]]:
+        for (data,) in self._connection.execute("SELECT data FROM entities WHERE kind = ? ORDER BY id", (kind,)):
+            yield json.loads(data)
+
+    def close(self) -> None:
+        connection = getattr(self._local, "connection", None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
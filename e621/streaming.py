@@ -0,0 +1,118 @@
+import codecs
+import json
+from typing import Any, Iterable, Iterator, List, Optional, Tuple
+
+__all__ = ["JsonArrayStream", "iter_json_array"]
+
+_WHITESPACE = " \t\r\n"
+_decoder = json.JSONDecoder()
+
+
+class _NeedMoreData(Exception):
+    pass
+
+
+class JsonArrayStream:
+    """Incrementally decodes the elements of a JSON array as its bytes arrive, one element at a time
+
+    The array is either the whole document or, if the document is an object, the value of its root_key
+    (or its first array if root_key is None), so both [{...}, ...] and {"posts": [{...}, ...]} work.
+    Every element is decoded by the C decoder of the json module as soon as it is complete,
+    and only the element being received is kept in memory, never the whole document.
+    """
+
+    def __init__(self, root_key: Optional[str] = None) -> None:
+        self.root_key = root_key
+        self.done = False
+        self._text = ""
+        self._utf8 = codecs.getincrementaldecoder("utf-8")()
+        self._in_array = False
+
+    def feed(self, data: bytes) -> List[Any]:
+        """Takes the next bytes of the document and returns the elements completed by them"""
+        if self.done:
+            return []
+        self._text += self._utf8.decode(data)
+        elements: List[Any] = []
+        pos = 0
+        try:
+            if not self._in_array:
+                pos = self._find_array()
+                self._in_array = True
+            while not self.done:
+                pos = self._skip_whitespace(pos)
+                if self._text[pos] == "]":
+                    self.done = True
+                    break
+                element, end = self._decode(pos)
+                end = self._skip_whitespace(end)
+                if self._text[end] not in ",]":
+                    # A number cut in the middle, like 1 of 1.5. If the element is broken instead, close() will tell
+                    raise _NeedMoreData
+                elements.append(element)
+                pos = end + 1 if self._text[end] == "," else end
+        except _NeedMoreData:
+            pass
+        # Everything before pos has been dealt with
+        self._text = self._text[pos:]
+        return elements
+
+    def close(self) -> None:
+        """Makes sure that the whole array has been received"""
+        if not self.done:
+            raise ValueError(f"The JSON document ended in the middle of the array: {self._text[:100]!r}")
+
+    def _find_array(self) -> int:
+        """Returns the position right after the [ that opens the array"""
+        pos = self._skip_whitespace(0)
+        if self._text[pos] == "[":
+            return pos + 1
+        if self._text[pos] != "{":
+            raise ValueError(f"Expected a JSON array or object, got {self._text[pos:pos + 20]!r}")
+        pos += 1
+        while True:
+            pos = self._skip_whitespace(pos)
+            if self._text[pos] == "}":
+                # There is no array, e.g. because this is an error message
+                self.done = True
+                return pos
+            key, pos = self._decode(pos)
+            pos = self._skip_whitespace(pos)
+            if self._text[pos] != ":":
+                raise ValueError(f"Expected : after an object key, got {self._text[pos:pos + 20]!r}")
+            pos = self._skip_whitespace(pos + 1)
+            if self._text[pos] == "[" and (self.root_key is None or key == self.root_key):
+                return pos + 1
+            _, pos = self._decode(pos)
+            pos = self._skip_whitespace(pos)
+            if self._text[pos] == ",":
+                pos += 1
+
+    def _skip_whitespace(self, pos: int) -> int:
+        text = self._text
+        while pos < len(text) and text[pos] in _WHITESPACE:
+            pos += 1
+        if pos >= len(text):
+            raise _NeedMoreData
+        return pos
+
+    def _decode(self, pos: int) -> Tuple[Any, int]:
+        try:
+            value, end = _decoder.raw_decode(self._text, pos)
+        except json.JSONDecodeError:
+            # Most likely the rest of the value hasn't arrived yet. If it is broken instead, close() will tell
+            raise _NeedMoreData from None
+        if end >= len(self._text):
+            # A number like 12 could still turn out to be 123
+            raise _NeedMoreData
+        return value, end
+
+
+def iter_json_array(chunks: Iterable[bytes], root_key: Optional[str] = None) -> Iterator[Any]:
+    """Yields the elements of a JSON array (see JsonArrayStream) from an iterable of byte chunks"""
+    stream = JsonArrayStream(root_key)
+    for chunk in chunks:
+        yield from stream.feed(chunk)
+        if stream.done:
+            return
+    stream.close()
@@ -0,0 +1,144 @@
+import gzip
+import json
+import threading
+from collections import defaultdict, deque
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any, DefaultDict, Deque, Dict, List, Optional, Tuple, Union
+from urllib.parse import parse_qsl, urlsplit
+
+import requests
+from requests.adapters import BaseAdapter, HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+__all__ = ["Interaction", "Cassette", "RecordingAdapter", "ReplayAdapter", "request_key"]
+
+# Only these response headers are worth keeping, the rest is noise that bloats the cassette
+RECORDED_HEADERS = ("Content-Type", "Retry-After", "X-RateLimit-Limit", "X-RateLimit-Remaining")
+# Credentials never end up in a cassette
+_SECRET_PARAMS = {"login", "api_key"}
+
+RequestKey = Tuple[str, str, Tuple[Tuple[str, str], ...]]
+
+
+def request_key(method: str, url: str) -> RequestKey:
+    """Identifies a request by its method, path and sorted query, ignoring the host and the credentials"""
+    parts = urlsplit(url)
+    query = tuple(sorted((k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True) if k not in _SECRET_PARAMS))
+    return method.upper(), parts.path, query
+
+
+@dataclass
+class Interaction:
+    method: str
+    path: str
+    query: List[Tuple[str, str]]
+    status: int
+    headers: Dict[str, str] = field(default_factory=dict)
+    body: str = ""
+
+    @property
+    def key(self) -> RequestKey:
+        return self.method, self.path, tuple((k, v) for k, v in self.query)
+
+
+class Cassette:
+    """Recorded request/response pairs, stored as gzipped JSON lines
+
+    Identical requests recorded several times are replayed in the order they were recorded,
+    and the last recording keeps being replayed after that.
+    """
+
+    def __init__(self, interactions: Optional[List[Interaction]] = None) -> None:
+        self.interactions: List[Interaction] = []
+        self._by_key: DefaultDict[RequestKey, Deque[Interaction]] = defaultdict(deque)
+        self._lock = threading.Lock()
+        for interaction in interactions or []:
+            self.add(interaction)
+
+    @classmethod
+    def load(cls, path: Union[str, Path]) -> "Cassette":
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            interactions = []
+            for line in f:
+                raw = json.loads(line)
+                raw["query"] = [tuple(pair) for pair in raw["query"]]
+                interactions.append(Interaction(**raw))
+        return cls(interactions)
+
+    def save(self, path: Union[str, Path]) -> None:
+        with self._lock, gzip.open(path, "wt", encoding="utf-8") as f:
+            for interaction in self.interactions:
+                f.write(json.dumps(asdict(interaction), ensure_ascii=False, separators=(",", ":")) + "\n")
+
+    def add(self, interaction: Interaction) -> None:
+        with self._lock:
+            self.interactions.append(interaction)
+            self._by_key[interaction.key].append(interaction)
+
+    def record(self, response: requests.Response) -> Interaction:
+        request = response.request
+        method, path, query = request_key(request.method or "GET", request.url or "")
+        headers = {name: response.headers[name] for name in RECORDED_HEADERS if name in response.headers}
+        interaction = Interaction(method, path, list(query), response.status_code, headers, response.text)
+        self.add(interaction)
+        return interaction
+
+    def find(self, method: str, url: str) -> Optional[Interaction]:
+        with self._lock:
+            recorded = self._by_key.get(request_key(method, url))
+            if not recorded:
+                return None
+            return recorded.popleft() if len(recorded) > 1 else recorded[0]
+
+    def __len__(self) -> int:
+        return len(self.interactions)
+
+
+class RecordingAdapter(HTTPAdapter):
+    """Sends requests over the network and records every response into a cassette
+
+    api = E621(transport=RecordingAdapter(cassette)); ...; cassette.save("session.jsonl.gz")
+    """
+
+    def __init__(self, cassette: Cassette, **kwargs: Any) -> None:
+        super().__init__(**kwargs)
+        self.cassette = cassette
+
+    def send(self, request: requests.PreparedRequest, *args: Any, **kwargs: Any) -> requests.Response:
+        response = super().send(request, *args, **kwargs)
+        self.cassette.record(response)
+        return response
+
+
+class ReplayAdapter(BaseAdapter):
+    """Answers requests from a cassette without touching the network
+
+    A request that was never recorded raises a ConnectionError,
+    or goes to the fallback adapter (e.g. a RecordingAdapter) if there is one.
+    """
+
+    def __init__(self, cassette: Cassette, fallback: Optional[BaseAdapter] = None) -> None:
+        super().__init__()
+        self.cassette = cassette
+        self.fallback = fallback
+
+    def send(self, request: requests.PreparedRequest, *args: Any, **kwargs: Any) -> requests.Response:
+        interaction = self.cassette.find(request.method or "GET", request.url or "")
+        if interaction is None:
+            if self.fallback is not None:
+                return self.fallback.send(request, *args, **kwargs)
+            raise requests.ConnectionError(f"{request.method} {request.url} is not in the cassette", request=request)
+        response = requests.Response()
+        response.status_code = interaction.status
+        response.headers = CaseInsensitiveDict(interaction.headers)
+        response._content = interaction.body.encode("utf-8")
+        response.encoding = "utf-8"
+        response.url = request.url or ""
+        response.request = request
+        response.reason = "Replayed"
+        return response
+
+    def close(self) -> None:
+        if self.fallback is not None:
+            self.fallback.close()
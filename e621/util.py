@@ -1,5 +1,11 @@
 import enum
+import os
 import re
+import threading
+from pathlib import Path
+from typing import Any, Iterable, Optional, Type, Union
+
+from backports.cached_property import cached_property
 
 _RE_CAMEL_TO_SNAKE1 = re.compile("(.)([A-Z][a-z]+)")
 _RE_CAMEL_TO_SNAKE2 = re.compile("([a-z0-9])([A-Z])")
@@ -8,3 +14,61 @@ _RE_CAMEL_TO_SNAKE2 = re.compile("([a-z0-9])([A-Z])")
 def camel_to_snake(name: str) -> str:
     name = re.sub(_RE_CAMEL_TO_SNAKE1, r"\1_\2", name)
     return re.sub(_RE_CAMEL_TO_SNAKE2, r"\1_\2", name).lower()
+
+
+def write_atomically(path: Path, data: Union[str, bytes]) -> None:
+    """Replaces the contents of path so that readers never see a partially written file"""
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    if isinstance(data, bytes):
+        tmp.write_bytes(data)
+    else:
+        tmp.write_text(data)
+    os.replace(tmp, path)
+
+
+def percentile(samples: Iterable[float], q: float) -> float:
+    """Returns the q-th (0 <= q <= 1) quantile of the samples or 0 if there are none"""
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+_NOT_FOUND = object()
+
+
+class locked_cached_property(cached_property):
+    """A cached_property that computes its value only once, even if several threads ask for it at the same time
+
+    functools.cached_property locks all instances of a class at once before Python 3.12 and not at all since then.
+    Here, every instance gets one of a fixed set of locks, so unrelated instances rarely wait for each other
+    and no memory is spent on a lock per instance. Being a cached_property, pydantic leaves it alone too.
+    """
+
+    # A power of two, so that the lock is picked by the top bits of the hash in _lock_index
+    _LOCK_BITS = 6
+    _LOCK_COUNT = 1 << _LOCK_BITS
+
+    def __init__(self, func: Any) -> None:
+        super().__init__(func)
+        self._locks = [threading.RLock() for _ in range(self._LOCK_COUNT)]
+
+    def __get__(self, instance: Any, owner: Optional[Type[Any]] = None) -> Any:
+        if instance is None:
+            return self
+        cache = instance.__dict__
+        value = cache.get(self.attrname, _NOT_FOUND)
+        if value is not _NOT_FOUND:
+            return value
+        with self._locks[self._lock_index(instance)]:
+            # Another thread may have computed it while this one was waiting
+            value = cache.get(self.attrname, _NOT_FOUND)
+            if value is _NOT_FOUND:
+                value = cache[self.attrname] = self.func(instance)
+        return value
+
+    @classmethod
+    def _lock_index(cls, instance: Any) -> int:
+        # Objects of the same size sit at addresses that are multiples of each other's stride, so the address
+        # modulo the lock count picks the same few locks for all of them. Fibonacci hashing mixes all of its bits
+        return ((id(instance) >> 4) * 0x9E3779B97F4A7C15 & 0xFFFFFFFFFFFFFFFF) >> (64 - cls._LOCK_BITS)
@@ -0,0 +1,201 @@
+import asyncio
+import json
+import threading
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    AsyncIterator,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Tuple,
+    Union,
+)
+
+from .base_model import BaseModel
+from .endpoints import BaseEndpoint, PageOffset
+from .enums import OffsetRelation
+from .scheduler import BULK, default_priority
+from .session import MAX_PAGE_SIZE
+from .util import write_atomically
+
+if TYPE_CHECKING:
+    from .api import E621
+
+__all__ = ["Subscription", "Watcher"]
+
+Fetcher = Callable[[Union[PageOffset, int], int], List[BaseModel]]
+Callback = Callable[["Subscription", List[BaseModel]], None]
+
+
+@dataclass
+class Subscription:
+    """A feed of new entities of a single query. Only high_water_mark and interval survive a checkpoint"""
+
+    name: str
+    fetch: Fetcher
+    filter: Optional[Callable[[List[BaseModel]], List[BaseModel]]] = None
+    high_water_mark: Optional[int] = None
+    interval: float = 60.0
+    next_poll: float = field(default=0.0, compare=False)
+
+
+class Watcher:
+    """Polls any number of queries for entities newer than the ones it has already seen
+
+    Every poll asks only for the entities after the subscription's high water mark (page=a<id>)
+    using the largest page size, so a poll without new content costs a single small response.
+    The polling interval of every subscription adapts to its activity: it is halved after a poll
+    that found something and grows by backoff after an empty one, within [min_interval, max_interval].
+    """
+
+    def __init__(
+        self,
+        api: "E621",
+        checkpoint_path: Union[str, Path, None] = None,
+        min_interval: float = 30.0,
+        max_interval: float = 3600.0,
+        backoff: float = 1.5,
+    ) -> None:
+        self._api = api
+        self.checkpoint_path = Path(checkpoint_path) if checkpoint_path is not None else None
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.subscriptions: Dict[str, Subscription] = {}
+        self._callbacks: List[Callback] = []
+        self._lock = threading.Lock()
+        self._checkpoint: Dict[str, Dict[str, Any]] = {}
+        if self.checkpoint_path is not None and self.checkpoint_path.exists():
+            self._checkpoint = json.loads(self.checkpoint_path.read_text())
+
+    def on_new(self, callback: Callback) -> Callback:
+        """Registers a callback that receives every subscription that got new entities. Usable as a decorator"""
+        self._callbacks.append(callback)
+        return callback
+
+    def watch(self, name: str, endpoint: BaseEndpoint, **search_params: Any) -> Subscription:
+        """Subscribes to the results of endpoint.search(**search_params)"""
+
+        def fetch(page: Union[PageOffset, int], limit: int) -> List[BaseModel]:
+            return endpoint.search(**search_params, limit=limit, page=page)  # type: ignore
+
+        return self._subscribe(Subscription(name, fetch))
+
+    def watch_posts(self, name: str, tags: Union[str, List[str]]) -> Subscription:
+        if isinstance(tags, list):
+            tags = " ".join(tags)
+        posts = self._api.posts
+
+        def fetch(page: Union[PageOffset, int], limit: int) -> List[BaseModel]:
+            # The blacklist is applied after the high water mark moves past the blacklisted posts
+            return posts._default_search({"tags": tags}, limit, page)  # type: ignore
+
+        return self._subscribe(Subscription(name, fetch, posts._filter_blacklisted))  # type: ignore
+
+    def watch_blips(self, name: str, **search_params: Any) -> Subscription:
+        return self.watch(name, self._api.blips, **search_params)
+
+    def watch_forum_topics(self, name: str) -> Subscription:
+        return self.watch(name, self._api.forum_topics)
+
+    def watch_post_versions(self, name: str, **search_params: Any) -> Subscription:
+        return self.watch(name, self._api.post_versions, **search_params)
+
+    def unwatch(self, name: str) -> None:
+        with self._lock:
+            del self.subscriptions[name]
+
+    def poll(self, subscription: Subscription) -> List[BaseModel]:
+        """Returns the entities that appeared since the last poll, oldest first
+
+        The very first poll of a subscription without a checkpoint only remembers the newest entity.
+        """
+        with default_priority(BULK):
+            new = self._fetch_new(subscription)
+        if subscription.filter is not None:
+            new = subscription.filter(new)
+        return new
+
+    def _fetch_new(self, subscription: Subscription) -> List[BaseModel]:
+        if subscription.high_water_mark is None:
+            latest = subscription.fetch(1, 1)
+            subscription.high_water_mark = max((e.id for e in latest), default=0)  # type: ignore
+            return []
+        new: List[BaseModel] = []
+        while True:
+            page = subscription.fetch(PageOffset(OffsetRelation.AFTER, subscription.high_water_mark), MAX_PAGE_SIZE)
+            if not page:
+                break
+            page.sort(key=lambda e: e.id)  # type: ignore
+            subscription.high_water_mark = page[-1].id  # type: ignore
+            new.extend(page)
+            if len(page) < MAX_PAGE_SIZE:
+                break
+        return new
+
+    def poll_due(self) -> List[Tuple[Subscription, List[BaseModel]]]:
+        """Polls every subscription whose interval has passed, notifies the callbacks and saves the checkpoint"""
+        now = time.monotonic()
+        with self._lock:
+            due = [s for s in self.subscriptions.values() if s.next_poll <= now]
+        results = []
+        for subscription in due:
+            new = self.poll(subscription)
+            if new:
+                subscription.interval = max(self.min_interval, subscription.interval / 2)
+                results.append((subscription, new))
+                for callback in self._callbacks:
+                    callback(subscription, new)
+            else:
+                subscription.interval = min(self.max_interval, subscription.interval * self.backoff)
+            subscription.next_poll = time.monotonic() + subscription.interval
+        if due:
+            self._save_checkpoint()
+        return results
+
+    def seconds_until_next_poll(self) -> float:
+        with self._lock:
+            next_poll = min((s.next_poll for s in self.subscriptions.values()), default=time.monotonic())
+        return max(0.0, next_poll - time.monotonic())
+
+    def run_forever(self, stop: Optional[threading.Event] = None) -> None:
+        """Polls the subscriptions as they become due until stop is set. New entities go to the callbacks"""
+        stop = stop or threading.Event()
+        while not stop.is_set():
+            self.poll_due()
+            stop.wait(self.seconds_until_next_poll())
+
+    async def stream(self) -> AsyncIterator[Tuple[Subscription, List[BaseModel]]]:
+        """Asynchronously yields (subscription, new_entities) pairs as they appear. Polling runs in a thread"""
+        loop = asyncio.get_running_loop()
+        while True:
+            for result in await loop.run_in_executor(None, self.poll_due):
+                yield result
+            await asyncio.sleep(self.seconds_until_next_poll())
+
+    def __aiter__(self) -> AsyncIterator[Tuple[Subscription, List[BaseModel]]]:
+        return self.stream()
+
+    def _subscribe(self, subscription: Subscription) -> Subscription:
+        saved = self._checkpoint.get(subscription.name)
+        if saved is not None:
+            subscription.high_water_mark = saved["high_water_mark"]
+            subscription.interval = saved["interval"]
+        else:
+            subscription.interval = self.min_interval
+        with self._lock:
+            self.subscriptions[subscription.name] = subscription
+        return subscription
+
+    def _save_checkpoint(self) -> None:
+        with self._lock:
+            for s in self.subscriptions.values():
+                self._checkpoint[s.name] = {"high_water_mark": s.high_water_mark, "interval": s.interval}
+            if self.checkpoint_path is None:
+                return
+            write_atomically(self.checkpoint_path, json.dumps(self._checkpoint))
@@ -79,7 +79,12 @@ def main(
             stdout = temp_stdout.getvalue()
         print("Normalizing")
 
-    models_source = stdout.replace("TagAliase", "TagAlias")
+    # Field has to come from the same pydantic API as the BaseModel backend
+    models_source = (
+        stdout.replace("TagAliase", "TagAlias")
+        .replace("from pydantic import Field\n", "")
+        .replace("from e621.models import BaseModel", "from .base_model import BaseModel, Field")
+    )
     model_class_names = [repr(n) for n in RE_CLASSNAME.findall(models_source)]
     all_list = f"__all__ = {', '.join(model_class_names)}\n\n\n"
     models_source += all_list
@@ -0,0 +1,11 @@
+from typing import Iterator
+
+import pytest
+
+from e621.fakeserver import FakeE621Server
+
+
+@pytest.fixture(scope="module")
+def server() -> Iterator[FakeE621Server]:
+    with FakeE621Server(post_count=2000) as server:
+        yield server
@@ -0,0 +1,56 @@
+import copy
+import os
+import subprocess
+import sys
+from typing import Any, Callable
+
+import pydantic
+import pytest
+
+from e621.base_model import BaseModel
+from e621.fakeserver import FakeE621Server
+
+# copy() is deprecated in pydantic 2, but still supported
+pytestmark = pytest.mark.filterwarnings("ignore::DeprecationWarning")
+
+COPIES = {
+    "copy": lambda post: post.copy(),
+    "copy_update": lambda post: post.copy(update={"description": "changed"}),
+    "copy_deep": lambda post: post.copy(deep=True),
+    "copy.copy": copy.copy,
+    "copy.deepcopy": copy.deepcopy,
+}
+if hasattr(BaseModel, "model_copy"):
+    COPIES["model_copy"] = lambda post: post.model_copy()
+    COPIES["model_copy_deep"] = lambda post: post.model_copy(deep=True)
+
+
+@pytest.mark.parametrize("make_copy", COPIES.values(), ids=list(COPIES))
+def test_copies_stay_bound_to_the_client(server: FakeE621Server, make_copy: Callable[[Any], Any]) -> None:
+    api = server.api()
+    post = api.posts.get(1)
+    copied = make_copy(post)
+    assert copied is not post
+    assert copied.id == post.id
+    assert copied.e621api is api
+
+
+def test_copies_of_unbound_models_stay_unbound(server: FakeE621Server) -> None:
+    score = server.api().posts.get(1).score
+    with pytest.raises(AttributeError, match="isn't bound to a client"):
+        score.copy().e621api
+
+
+@pytest.mark.parametrize("backend", ["v1", "v2"] if pydantic.VERSION.startswith("2.") else ["v1"])
+def test_every_supported_backend_parses_posts(backend: str) -> None:
+    # The backend is chosen on import, so each one needs a fresh interpreter
+    script = (
+        "from e621.base_model import BACKEND\n"
+        "from e621.fakeserver import FakeE621Server\n"
+        "with FakeE621Server(post_count=10) as server:\n"
+        "    post = server.api().posts.get(3)\n"
+        "print(BACKEND, post.id, post.e621api is not None)\n"
+    )
+    env = {**os.environ, "E621_MODEL_BACKEND": backend, "PYTHONPATH": os.pathsep.join(sys.path)}
+    output = subprocess.run([sys.executable, "-c", script], env=env, capture_output=True, text=True, check=True).stdout
+    assert output.split() == [backend, "3", "True"]
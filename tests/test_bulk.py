@@ -0,0 +1,141 @@
+import threading
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Tuple
+from urllib.parse import parse_qsl, urlsplit
+
+import pytest
+
+from e621.bulk import BulkMutator
+from e621.fakeserver import FakeE621Server
+from e621.ratelimit import TokenBucket
+
+
+class RecordingServer(FakeE621Server):
+    """Remembers every request and answers the ones listed in failures with the given statuses, in order"""
+
+    def __init__(self, **kwargs: Any) -> None:
+        super().__init__(**kwargs)
+        self.calls: List[Tuple[str, str, Dict[str, str]]] = []
+        self.failures: Dict[Tuple[str, str], List[int]] = {}
+        self.bodies: Dict[Tuple[str, str], bytes] = {}
+        self._calls_lock = threading.Lock()
+
+    def handle(self, method: str, url: str) -> Tuple[int, Dict[str, str], bytes]:
+        parts = urlsplit(url)
+        path = parts.path.strip("/")[: -len(".json")]
+        with self._calls_lock:
+            self.calls.append((method, path, dict(parse_qsl(parts.query, keep_blank_values=True))))
+            statuses = self.failures.get((method, path))
+            status = statuses.pop(0) if statuses else None
+        if status is not None:
+            return status, {}, b'{"success":false,"reason":"Scripted failure"}'
+        if (method, path) in self.bodies:
+            return 200, {}, self.bodies[method, path]
+        return super().handle(method, url)
+
+    def requests_to(self, method: str, path: str) -> List[Dict[str, str]]:
+        return [params for m, p, params in self.calls if (m, p) == (method, path)]
+
+
+@pytest.fixture
+def recording_server() -> Iterator[RecordingServer]:
+    with RecordingServer(post_count=100, entity_count=100) as server:
+        yield server
+
+
+def make_mutator(server: FakeE621Server, **kwargs: Any) -> BulkMutator:
+    return BulkMutator(server.api(), backoff=0, rate_limiter=TokenBucket(1000, 100), **kwargs)
+
+
+def test_pool_edits_are_squashed_into_one_update(recording_server: RecordingServer) -> None:
+    original = list(recording_server.api().pools.get(7).post_ids)
+    recording_server.calls.clear()
+    bulk = make_mutator(recording_server)
+    # Synthesized pools only contain ids up to post_count
+    bulk.add_to_pool(7, [190, 191, original[0]])
+    bulk.update_pool(7, description="changed")
+    bulk.remove_from_pool(7, [191, original[-1]])
+    bulk.add_to_pool(7, [192])
+    report = bulk.run()
+
+    assert [r.ok for r in report] == [True] * 4
+    assert len(recording_server.requests_to("GET", "pools/7")) == 1
+    (update,) = recording_server.requests_to("PATCH", "pools/7")
+    expected = [i for i in original if i != original[-1]] + [190, 192]
+    assert update["pool[post_ids]"] == " ".join(map(str, expected))
+    assert update["pool[description]"] == "changed"
+
+
+def test_pool_edits_after_a_full_update_need_no_lookup(recording_server: RecordingServer) -> None:
+    bulk = make_mutator(recording_server)
+    bulk.update_pool(7, post_ids="1 2 3")
+    bulk.add_to_pool(7, [4])
+    bulk.remove_from_pool(7, [2])
+    bulk.run()
+
+    assert recording_server.requests_to("GET", "pools/7") == []
+    (update,) = recording_server.requests_to("PATCH", "pools/7")
+    assert update["pool[post_ids]"] == "1 3 4"
+
+
+def test_failures_are_recorded_without_stopping_the_batch(recording_server: RecordingServer) -> None:
+    recording_server.failures[("PATCH", "posts/1")] = [422]
+    recording_server.failures[("PATCH", "posts/2")] = [503, 503]
+    recording_server.failures[("PATCH", "posts/3")] = [500] * 10
+    # A response that isn't a pool, so the lookup fails outside of requests
+    recording_server.bodies[("GET", "pools/5")] = b'"not a pool"'
+    bulk = make_mutator(recording_server, max_retries=3)
+    for post_id in (1, 2, 3, 4):
+        bulk.update_post(post_id, description="changed")
+    bulk.add_to_pool(5, [1])
+    report = bulk.run()
+
+    assert [(r.ok, r.attempts) for r in report] == [(False, 1), (True, 3), (False, 4), (True, 1), (False, 1)]
+    assert "422" in report.results[0].error
+    assert "500" in report.results[2].error
+    assert report.results[4].error.startswith("TypeError: ")
+    assert [r.mutation.target for r in report.failed] == [1, 3, 5]
+    # Non-retryable failures are given up on right away
+    assert len(recording_server.requests_to("PATCH", "posts/1")) == 1
+    assert recording_server.requests_to("PATCH", "pools/5") == []
+
+
+def test_resumed_batch_only_retries_the_failed_mutations(recording_server: RecordingServer, tmp_path: Path) -> None:
+    checkpoint_path = tmp_path / "bulk.json"
+
+    def make_batch() -> BulkMutator:
+        bulk = make_mutator(recording_server, max_retries=0, checkpoint_path=checkpoint_path)
+        for post_id in (1, 2, 3):
+            bulk.update_post(post_id, description="changed")
+        bulk.create_favorite(4)
+        return bulk
+
+    recording_server.failures[("PATCH", "posts/2")] = [500]
+    recording_server.failures[("POST", "favorites")] = [500]
+    first = make_batch().run()
+    assert [r.ok for r in first] == [True, False, True, False]
+
+    recording_server.calls.clear()
+    second = make_batch().run()
+    assert [r.ok for r in second] == [True] * 4
+    assert sorted((method, path) for method, path, _ in recording_server.calls) == [
+        ("PATCH", "posts/2"),
+        ("POST", "favorites"),
+    ]
+
+    # Everything is done, so running it once more sends nothing
+    recording_server.calls.clear()
+    assert [r.ok for r in make_batch().run()] == [True] * 4
+    assert recording_server.calls == []
+
+
+def test_checkpoint_of_another_batch_is_rejected(recording_server: RecordingServer, tmp_path: Path) -> None:
+    checkpoint_path = tmp_path / "bulk.json"
+    bulk = make_mutator(recording_server, checkpoint_path=checkpoint_path)
+    bulk.update_post(1, description="changed")
+    bulk.run()
+
+    other = make_mutator(recording_server, checkpoint_path=checkpoint_path)
+    other.update_post(1, description="something else")
+    with pytest.raises(ValueError):
+        other.run()
@@ -0,0 +1,57 @@
+import time
+from typing import Iterator
+
+import pytest
+
+from e621.cache import EntityCache, NegativeCache
+from e621.fakeserver import FakeE621Server
+from e621.models import Post
+from e621.resolvers import fetch_posts
+
+
+@pytest.fixture
+def deleted_server() -> Iterator[FakeE621Server]:
+    with FakeE621Server(post_count=300, deleted_posts=[2, 5]) as server:
+        yield server
+
+
+def test_deleted_models_are_returned_as_copies(deleted_server: FakeE621Server) -> None:
+    api = deleted_server.api(negative_cache=NegativeCache())
+    first = api.posts.get(2)
+    assert first.flags.deleted
+    requests_before = deleted_server.requests_served
+    first.description = "changed"
+    second = api.posts.get(2)
+    assert deleted_server.requests_served == requests_before
+    assert second is not first
+    assert second.description != "changed"
+    assert second.e621api is api
+
+
+def test_bulk_gets_only_remember_ids_below_the_newest_post_found(deleted_server: FakeE621Server) -> None:
+    cache = NegativeCache()
+    api = deleted_server.api(negative_cache=cache)
+    assert [post.id for post in api.posts.get([1, 2, 3, 5, 6, 400])] == [6, 3, 1]
+    assert sorted(cache.deleted_posts) == [2, 5]
+
+
+def test_deleted_posts_expire(deleted_server: FakeE621Server) -> None:
+    cache = NegativeCache(ttl=0.2)
+    api = deleted_server.api(negative_cache=cache)
+    api.posts.get([1, 2, 3])
+    requests_before = deleted_server.requests_served
+    assert api.posts.get([2]) == []
+    assert deleted_server.requests_served == requests_before
+    time.sleep(0.5)
+    assert cache.without_deleted_posts([2]) == [2]
+
+
+def test_gets_fill_the_entity_cache_without_a_circuit_breaker(server: FakeE621Server) -> None:
+    cache = EntityCache()
+    api = server.api(entity_cache=cache)
+    post = api.posts.get(10)
+    assert cache.get(Post, 10) is post
+    # Resolvers reuse it instead of asking e621 again
+    requests_before = server.requests_served
+    assert fetch_posts(api, [10]) == {10: post}
+    assert server.requests_served == requests_before
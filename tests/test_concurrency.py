@@ -0,0 +1,103 @@
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterator, List, Tuple
+
+import pytest
+
+from e621.api import E621
+from e621.fakeserver import FakeE621Server
+
+THREADS = 16
+
+
+class CountingServer(FakeE621Server):
+    """Counts the requests for every path and the most requests that were ever in flight at once"""
+
+    def __init__(self, **kwargs: Any) -> None:
+        super().__init__(**kwargs)
+        self.paths: Counter = Counter()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._counter_lock = threading.Lock()
+
+    def handle(self, method: str, url: str) -> Tuple[int, Dict[str, str], bytes]:
+        with self._counter_lock:
+            self.paths[url.partition("?")[0]] += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            return super().handle(method, url)
+        finally:
+            with self._counter_lock:
+                self.in_flight -= 1
+
+    def reset_counters(self) -> None:
+        with self._counter_lock:
+            self.paths.clear()
+            self.max_in_flight = 0
+
+
+@pytest.fixture(scope="module")
+def slow_server() -> Iterator[CountingServer]:
+    # Slow enough that all of the threads ask while the first request is still running
+    with CountingServer(post_count=2000, latency=0.05) as server:
+        yield server
+
+
+def run_at_once(function: Callable[[], Any], threads: int = THREADS) -> List[Any]:
+    """Calls function from every thread at the same moment and returns what each call returned"""
+    start_line = threading.Barrier(threads)
+
+    def call() -> Any:
+        start_line.wait()
+        return function()
+
+    with ThreadPoolExecutor(threads) as executor:
+        futures = [executor.submit(call) for _ in range(threads)]
+        return [future.result() for future in futures]
+
+
+def test_users_me_is_fetched_once(slow_server: CountingServer) -> None:
+    api = slow_server.api(auth=("stress", "key"))
+    slow_server.reset_counters()
+    users = run_at_once(lambda: api.users.me)
+    assert slow_server.paths == {"/users/stress.json": 1}
+    assert all(user is users[0] for user in users)
+
+
+def test_post_parent_is_fetched_once(slow_server: CountingServer) -> None:
+    api = slow_server.api()
+    post = api.posts.get(100)
+    # The fake server's posts have no parents of their own
+    post.relationships.parent_id = 50
+    slow_server.reset_counters()
+    parents = run_at_once(lambda: post.parent)
+    assert sum(slow_server.paths.values()) == 1
+    assert parents[0] is not None and parents[0].id == 50
+    assert all(parent is parents[0] for parent in parents)
+
+
+def test_endpoints_are_created_once(slow_server: CountingServer) -> None:
+    api: E621 = slow_server.api()
+    slow_server.reset_counters()
+    endpoints = run_at_once(lambda: api.pools)
+    assert all(endpoint is endpoints[0] for endpoint in endpoints)
+    assert not slow_server.paths
+
+
+def test_lazy_properties_of_different_posts_load_concurrently(slow_server: CountingServer) -> None:
+    api = slow_server.api(pool_size=THREADS)
+    posts = api.posts.search("", limit=THREADS)
+    slow_server.reset_counters()
+    next_post = iter(posts)
+    lock = threading.Lock()
+
+    def load_uploader() -> Any:
+        with lock:
+            post = next(next_post)
+        return post.uploader
+
+    run_at_once(load_uploader)
+    assert sum(slow_server.paths.values()) == THREADS
+    assert slow_server.max_in_flight > 1
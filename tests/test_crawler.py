@@ -0,0 +1,77 @@
+import functools
+import json
+from pathlib import Path
+from typing import Any, List
+
+import pytest
+
+from e621.api import E621
+from e621.crawler import Crawler
+from e621.fakeserver import FakeE621Server
+
+
+def crawler(server: FakeE621Server, output_dir: Path, **kwargs: Any) -> Crawler:
+    kwargs = {"id_range": (1, 1000), "shards": 2, "workers": 2, "rate": 1000, "page_size": 100, **kwargs}
+    return Crawler(output_dir, api_class=functools.partial(E621, base_url=server.base_url), **kwargs)
+
+
+def crawled_ids(output_dir: Path) -> List[int]:
+    return [json.loads(line)["id"] for path in sorted(output_dir.glob("*.jsonl")) for line in path.open()]
+
+
+def interrupt(output_dir: Path, shard: str, cursor: int) -> None:
+    """Turns a finished shard back into one that was killed after writing the posts above cursor"""
+    path = output_dir / "checkpoints" / f"{shard}.json"
+    lines = (output_dir / f"{shard}.jsonl").read_bytes().splitlines(keepends=True)
+    kept = [line for line in lines if json.loads(line)["id"] >= cursor]
+    checkpoint = {**json.loads(path.read_text()), "cursor": cursor, "done": False, "count": len(kept)}
+    # Plus half a page that was written before the crawl was killed
+    checkpoint["offset"] = len(b"".join(kept))
+    (output_dir / f"{shard}.jsonl").write_bytes(b"".join(kept) + lines[len(kept)][:10])
+    path.write_text(json.dumps(checkpoint))
+
+
+def test_crawl_writes_every_post_once(server: FakeE621Server, tmp_path: Path) -> None:
+    results = crawler(server, tmp_path).run()
+    assert all(checkpoint.done for checkpoint in results.values())
+    assert sorted(crawled_ids(tmp_path)) == list(range(1, 1001))
+
+
+def test_resume_continues_after_the_checkpoint(server: FakeE621Server, tmp_path: Path) -> None:
+    crawler(server, tmp_path).run()
+    interrupt(tmp_path, "shard-0000", 300)
+    results = crawler(server, tmp_path).run()
+    assert results[0].done and results[0].count == 500
+    assert sorted(crawled_ids(tmp_path)) == list(range(1, 1001))
+
+
+def test_resume_starts_a_shard_over_when_its_file_is_gone(server: FakeE621Server, tmp_path: Path) -> None:
+    crawler(server, tmp_path).run()
+    interrupt(tmp_path, "shard-0000", 300)
+    (tmp_path / "shard-0000.jsonl").unlink()
+    crawler(server, tmp_path).run()
+    assert sorted(crawled_ids(tmp_path)) == list(range(1, 1001))
+    assert (tmp_path / "shard-0000.jsonl").read_bytes().count(b"\0") == 0
+
+
+def test_resume_starts_a_shard_over_when_its_file_is_too_short(server: FakeE621Server, tmp_path: Path) -> None:
+    crawler(server, tmp_path).run()
+    interrupt(tmp_path, "shard-0000", 300)
+    (tmp_path / "shard-0000.jsonl").write_bytes(b"")
+    crawler(server, tmp_path).run()
+    assert sorted(crawled_ids(tmp_path)) == list(range(1, 1001))
+
+
+@pytest.mark.parametrize(
+    "changes", [{"tags": "tag_1"}, {"output_format": "packed"}, {"id_range": (1, 2000)}, {"id_range": None}]
+)
+def test_resume_rejects_a_different_crawl(server: FakeE621Server, tmp_path: Path, changes: dict) -> None:
+    crawler(server, tmp_path).plan()
+    with pytest.raises(ValueError, match="different crawl"):
+        crawler(server, tmp_path, **changes).plan()
+
+
+def test_order_tags_are_rejected(server: FakeE621Server, tmp_path: Path) -> None:
+    with pytest.raises(ValueError, match="order:"):
+        crawler(server, tmp_path, tags="fox order:score").plan()
+    assert not (tmp_path / "crawl.json").exists()
@@ -0,0 +1,60 @@
+from typing import Iterator
+
+import pytest
+import requests
+
+from e621.fakeserver import FakeE621Server
+
+pytest.importorskip("h2")
+pytest.importorskip("httpx")
+
+from e621.http2 import Http2Adapter  # noqa: E402
+
+
+@pytest.fixture
+def adapter() -> Iterator[Http2Adapter]:
+    adapter = Http2Adapter(max_connections=4)
+    yield adapter
+    adapter.close()
+
+
+def test_gets_and_searches_over_the_adapter(server: FakeE621Server, adapter: Http2Adapter) -> None:
+    api = server.api(transport=adapter)
+    assert api.posts.get(7).id == 7
+    assert [post.id for post in api.posts.search("", limit=5)] == [2000, 1999, 1998, 1997, 1996]
+    streamed = list(api.posts.iter_search("", limit=500, stream=True))
+    assert len({post.id for post in streamed}) == 500
+
+
+def test_errors_become_requests_errors(server: FakeE621Server, adapter: Http2Adapter) -> None:
+    api = server.api(transport=adapter)
+    with pytest.raises(requests.HTTPError) as error:
+        api.posts.get(10**6)
+    assert error.value.response.status_code == 404
+    with FakeE621Server() as stopped:
+        url = stopped.base_url
+    session = requests.Session()
+    session.mount("http://", adapter)
+    with pytest.raises(requests.ConnectionError):
+        session.get(url.format(endpoint="posts"), timeout=1)
+
+
+def test_timeouts_are_passed_to_httpx(server: FakeE621Server, adapter: Http2Adapter) -> None:
+    session = requests.Session()
+    session.mount("http://", adapter)
+    url = server.base_url.format(endpoint="posts/1")
+    assert session.get(url, timeout=(1, 5)).json()["post"]["id"] == 1
+    with FakeE621Server(latency=0.5) as slow:
+        with pytest.raises(requests.Timeout):
+            session.get(slow.base_url.format(endpoint="posts/1"), timeout=(1, 0.1))
+
+
+def test_clients_are_kept_per_tls_and_proxy_settings(server: FakeE621Server, adapter: Http2Adapter) -> None:
+    session = requests.Session()
+    session.trust_env = False
+    session.mount("http://", adapter)
+    url = server.base_url.format(endpoint="posts/1")
+    session.get(url)
+    session.get(url)
+    session.get(url, verify=False)
+    assert len(adapter._clients) == 2
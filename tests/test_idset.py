@@ -0,0 +1,134 @@
+import itertools
+import random
+from pathlib import Path
+from typing import Set, Tuple
+
+import pytest
+
+from e621.idset import PostIdSet
+
+SEEDS = range(40)
+
+
+def random_ids(rng: random.Random) -> Set[int]:
+    """Ids around the sizes where a container switches between a sorted array and a bitmap (4096),
+    spread over one or several blocks of 65536 ids, plus a few anywhere in the 32 bit range
+    """
+    count = rng.choice([0, 1, 10, 4096, 4097, 5000, 20000])
+    base = rng.choice([0, 65536 * 3 - 100, 5_000_000])
+    spread = rng.choice([8192, 65536, 200_000])
+    ids = {base + rng.randrange(spread) for _ in range(count)}
+    return ids | {rng.randrange(2**32) for _ in range(rng.randrange(5))}
+
+
+def random_pair(seed: int) -> Tuple[Set[int], Set[int]]:
+    rng = random.Random(seed)
+    a = random_ids(rng)
+    # Overlapping sets exercise more of the container combinations than independent ones
+    b = random_ids(rng) | set(rng.sample(sorted(a), len(a) // 3))
+    return a, b
+
+
+def assert_same(ids: PostIdSet, expected: Set[int]) -> None:
+    assert list(ids) == sorted(expected)
+    assert len(ids) == len(expected)
+    assert bool(ids) == bool(expected)
+    assert ids == expected
+    # The same ids always end up in the same containers, however they were added
+    assert ids == PostIdSet(expected)
+    assert ids.nbytes == PostIdSet(expected).nbytes
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_operators_match_set(seed: int) -> None:
+    a, b = random_pair(seed)
+    ids_a, ids_b = PostIdSet(a), PostIdSet(b)
+    assert_same(ids_a | ids_b, a | b)
+    assert_same(ids_a & ids_b, a & b)
+    assert_same(ids_a - ids_b, a - b)
+    assert_same(ids_a ^ ids_b, a ^ b)
+    assert_same(ids_a.union(ids_b, PostIdSet()), a | b)
+    assert_same(ids_a.intersection(ids_b), a & b)
+    assert_same(ids_a.difference(ids_b), a - b)
+    assert_same(ids_a.symmetric_difference(ids_b), a ^ b)
+    assert ids_a.isdisjoint(ids_b) == a.isdisjoint(b)
+    assert ids_a.issubset(ids_b) == a.issubset(b)
+    assert (ids_a & ids_b).issubset(ids_a)
+    # The operands are left alone
+    assert_same(ids_a, a)
+    assert_same(ids_b, b)
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_in_place_operators_match_set(seed: int) -> None:
+    a, b = random_pair(seed)
+    for operator in ("__ior__", "__iand__", "__isub__", "__ixor__"):
+        ids = PostIdSet(a)
+        expected = set(a)
+        result = getattr(ids, operator)(PostIdSet(b))
+        getattr(expected, operator)(b)
+        assert result is ids
+        assert_same(ids, expected)
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_add_and_discard_match_set(seed: int) -> None:
+    rng = random.Random(seed)
+    a, b = random_pair(seed)
+    ids = PostIdSet()
+    for id in sorted(a | b):
+        ids.add(id)
+    removed = rng.sample(sorted(b), len(b) // 2)
+    for id in removed:
+        ids.discard(id)
+    expected = (a | b) - set(removed)
+    # Discarding an id that isn't there changes nothing
+    ids.discard(next(id for id in itertools.count() if id not in expected))
+    assert_same(ids, expected)
+    for id in rng.sample(sorted(a | b), min(len(a | b), 100)):
+        assert (id in ids) == (id in expected)
+    assert "1" not in ids
+
+
+@pytest.mark.parametrize("size", [4095, 4096, 4097, 4098])
+def test_containers_switch_at_the_array_limit(size: int) -> None:
+    expected = set(range(2, 2 * size + 2, 2))
+    odd = PostIdSet(range(1, 2 * size + 2, 2))
+    shrunk = PostIdSet(range(0, 2 * size + 2, 2))
+    shrunk.discard(0)
+    grown = PostIdSet(range(4, 2 * size + 2, 2))
+    grown.add(2)
+    halves = sorted(expected)
+    assert_same(shrunk, expected)
+    assert_same(grown, expected)
+    assert_same(PostIdSet(halves[::2]) | PostIdSet(halves[1::2]), expected)
+    assert_same((PostIdSet(expected) | odd) - odd, expected)
+    assert_same((PostIdSet(expected) | odd) & (PostIdSet(expected) | PostIdSet([10**6])), expected)
+    assert_same((PostIdSet(expected) | odd) ^ odd, expected)
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_save_and_load(seed: int, tmp_path: Path) -> None:
+    a, _ = random_pair(seed)
+    ids = PostIdSet(a)
+    ids.save(tmp_path / "ids.idset")
+    assert_same(PostIdSet.load(tmp_path / "ids.idset"), a)
+    assert_same(PostIdSet.from_bytes(ids.to_bytes()), a)
+
+
+def test_copies_are_independent() -> None:
+    ids = PostIdSet(range(10_000))
+    copied = ids.copy()
+    copied.discard(5)
+    copied |= PostIdSet([10**6])
+    assert 5 in ids and 10**6 not in ids
+    assert len(ids) == 10_000
+
+
+def test_load_rejects_other_files(tmp_path: Path) -> None:
+    (tmp_path / "empty").write_bytes(b"")
+    (tmp_path / "other").write_bytes(b"not an id set at all")
+    with pytest.raises(ValueError):
+        PostIdSet.load(tmp_path / "empty")
+    with pytest.raises(ValueError):
+        PostIdSet.load(tmp_path / "other")
@@ -0,0 +1,19 @@
+from e621.bulk import BulkMutator
+from e621.fakeserver import FakeE621Server
+from e621.instrumentation import Instrumentation
+from e621.ratelimit import TokenBucket
+
+
+def test_every_retried_request_counts_once() -> None:
+    with FakeE621Server(post_count=10, error_rate=1.0) as server:
+        instrumentation = Instrumentation()
+        bulk = BulkMutator(
+            server.api(instrumentation=instrumentation), max_retries=3, backoff=0, rate_limiter=TokenBucket(1000, 100)
+        )
+        bulk.update_post(1, description="changed")
+        bulk.update_post(2, description="changed")
+        report = bulk.run()
+    assert [result.attempts for result in report] == [4, 4]
+    assert instrumentation.requests == {("posts/:id", "PATCH", "500"): 8}
+    assert instrumentation.retries == {"posts/:id": 6}
+    assert 'e621_retries_total{endpoint="posts/:id"} 6' in instrumentation.to_prometheus()
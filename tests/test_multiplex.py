@@ -0,0 +1,74 @@
+from typing import Dict
+
+import pytest
+
+from e621.fakeserver import FakeE621Server
+from e621.models import Post
+from e621.multiplex import TagQuery, plan_queries
+
+
+def tag_counts(queries: Dict[str, str], tag_limit: int) -> Dict[str, int]:
+    return {m.tags: TagQuery.parse(m.tags).tag_count for m in plan_queries(queries, tag_limit).merged}
+
+
+def test_queries_that_differ_by_one_tag_are_merged() -> None:
+    plan = plan_queries({"c": "a b c", "d": "a b d", "e": "a b e"}, tag_limit=40)
+    assert [m.tags for m in plan.merged] == ["a b ~c ~d ~e"]
+    assert plan.query_count == 3
+
+
+def test_merged_queries_are_split_to_stay_under_the_tag_limit() -> None:
+    queries = {name: f"a b {name}" for name in "cdefg"}
+    counts = tag_counts(queries, tag_limit=4)
+    assert counts == {"a b ~c ~d": 4, "a b ~e ~f": 4, "a b g": 3}
+
+
+@pytest.mark.parametrize("tag_limit", [2, 3])
+def test_queries_at_the_tag_limit_are_sent_unmerged(tag_limit: int) -> None:
+    queries = {name: f"a b {name}" for name in "cde"}
+    plan = plan_queries(queries, tag_limit=tag_limit)
+    assert sorted(m.tags for m in plan.merged) == ["a b c", "a b d", "a b e"]
+    assert all(list(m.members) == [m.tags[-1]] for m in plan.merged)
+
+
+def test_queries_at_the_tag_limit_can_still_join_a_group_that_fits() -> None:
+    # "a b ~x ~y ~z" would need 5 tags, but "b x" covers "a b x" without adding any
+    plan = plan_queries({"x": "a b x", "y": "a b y", "z": "a b z", "bx": "b x"}, tag_limit=3)
+    assert sorted((m.tags, sorted(m.members)) for m in plan.merged) == [
+        ("a b y", ["y"]),
+        ("a b z", ["z"]),
+        ("b x", ["bx", "x"]),
+    ]
+
+
+@pytest.fixture(scope="module")
+def post(server: FakeE621Server) -> Post:
+    # Tagged species_47 tag_0 tag_1 tag_3 tag_5 and rated e
+    return server.api().posts.get(1)
+
+
+@pytest.mark.parametrize(
+    "tags, matches",
+    [
+        ("tag_0 tag_1", True),
+        ("tag_0 tag_2", False),
+        ("tag_0 -tag_2", True),
+        ("tag_0 -tag_1", False),
+        ("-tag_2 -tag_4", True),
+        ("~tag_2 ~tag_3", True),
+        ("~tag_2 ~tag_4", False),
+        ("tag_0 ~tag_2 ~tag_5 -tag_4", True),
+        ("~tag_1 ~tag_3 -tag_5", False),
+        ("rating:e ~tag_1 ~tag_9", True),
+        ("-rating:explicit ~tag_1", False),
+        ("-rating:s", True),
+    ],
+)
+def test_matches(post: Post, tags: str, matches: bool) -> None:
+    assert TagQuery.parse(tags).matches(post) is matches
+
+
+def test_metatags_and_wildcards_cannot_be_matched(post: Post) -> None:
+    for tags in ("tag_* tag_1", "score:>10"):
+        with pytest.raises(ValueError):
+            TagQuery.parse(tags).matches(post)
@@ -0,0 +1,60 @@
+import pytest
+
+from e621.endpoints import PageOffset
+from e621.enums import OffsetRelation
+from e621.fakeserver import FakeE621Server
+
+
+@pytest.mark.parametrize("limit", [1, 320, 500, 641, 1000])
+def test_search_ignoring_pagination_returns_exactly_limit_unique_posts(server: FakeE621Server, limit: int) -> None:
+    posts = server.api().posts.search("", limit=limit, ignore_pagination=True)
+    assert len(posts) == limit
+    assert len({p.id for p in posts}) == limit
+
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_iter_search_returns_exactly_limit_unique_posts(server: FakeE621Server, stream: bool) -> None:
+    posts = list(server.api().posts.iter_search("order:score", limit=500, stream=stream))
+    assert len(posts) == 500
+    assert len({p.id for p in posts}) == 500
+
+
+def test_pages_keep_their_size_when_the_last_one_is_trimmed(server: FakeE621Server) -> None:
+    pages = list(server.api().session.iter_paginated_get("posts", {"limit": 250, "page": 1}, "posts", page_size=100))
+    assert [len(page) for page in pages] == [100, 100, 50]
+    assert len({post["id"] for page in pages for post in page}) == 250
+
+
+def test_cursor_pagination_returns_exactly_limit_unique_posts(server: FakeE621Server) -> None:
+    pages = server.api().session.iter_paginated_get(
+        "posts", {"limit": 500, "page": 1}, "posts", page_size=320, use_cursor=True
+    )
+    ids = [post["id"] for page in pages for post in page]
+    assert len(ids) == len(set(ids)) == 500
+
+
+@pytest.mark.parametrize("stream", [False, True])
+@pytest.mark.parametrize("tags", ["", "order:score"])
+def test_iter_search_continues_after_an_offset(server: FakeE621Server, stream: bool, tags: str) -> None:
+    start = PageOffset(OffsetRelation.AFTER, 1000)
+    ids = [post.id for post in server.api().posts.iter_search(tags, page=start, stream=stream)]
+    assert sorted(ids) == list(range(1001, 2001))
+
+
+@pytest.mark.parametrize("stream", [False, True])
+@pytest.mark.parametrize("tags", ["", "order:score"])
+def test_iter_search_continues_before_an_offset(server: FakeE621Server, stream: bool, tags: str) -> None:
+    start = PageOffset(OffsetRelation.BEFORE, 1000)
+    ids = [post.id for post in server.api().posts.iter_search(tags, limit=700, page=start, stream=stream)]
+    assert ids == list(range(999, 299, -1))
+
+
+def test_pages_after_an_offset_move_up(server: FakeE621Server) -> None:
+    pages = server.api().session.iter_paginated_get(
+        "posts", {"limit": 500, "page": "a100"}, "posts", page_size=200, use_cursor=True
+    )
+    assert [(min(p["id"] for p in page), max(p["id"] for p in page)) for page in pages] == [
+        (101, 300),
+        (301, 500),
+        (501, 600),
+    ]
@@ -0,0 +1,96 @@
+import threading
+from typing import Callable
+
+import pytest
+
+from e621.scheduler import BULK, INTERACTIVE, RequestScheduler, priority
+
+
+class FailingOnceLimiter:
+    """Hands out tokens immediately, except the first one, which raises"""
+
+    def __init__(self, error: BaseException) -> None:
+        self.error = error
+        self.calls = 0
+
+    def try_acquire(self) -> float:
+        self.calls += 1
+        if self.calls == 1:
+            raise self.error
+        return 0.0
+
+
+class BlockingFailingOnceLimiter:
+    """Same as FailingOnceLimiter, but without try_acquire"""
+
+    def __init__(self, error: BaseException) -> None:
+        self._limiter = FailingOnceLimiter(error)
+
+    def acquire(self) -> None:
+        self._limiter.try_acquire()
+
+
+def acquire_in_thread(scheduler: RequestScheduler, name: str = INTERACTIVE) -> Callable[[], bool]:
+    """Starts acquiring in another thread and returns a function that tells whether it finished in time"""
+
+    def acquire() -> None:
+        with priority(name):
+            scheduler.acquire()
+
+    thread = threading.Thread(target=acquire, daemon=True)
+    thread.start()
+
+    def finished() -> bool:
+        thread.join(5)
+        return not thread.is_alive()
+
+    return finished
+
+
+@pytest.mark.parametrize("limiter_class", [FailingOnceLimiter, BlockingFailingOnceLimiter])
+@pytest.mark.parametrize("error", [RuntimeError("limiter failed"), KeyboardInterrupt()])
+def test_a_failed_acquire_leaves_the_queue(limiter_class: type, error: BaseException) -> None:
+    scheduler = RequestScheduler(limiter_class(error))
+    with pytest.raises(type(error)):
+        scheduler.acquire()
+    assert scheduler.stats()[INTERACTIVE].waiting == 0
+    assert acquire_in_thread(scheduler)()
+    assert acquire_in_thread(scheduler, BULK)()
+    stats = scheduler.stats()
+    assert stats[INTERACTIVE].requests == stats[BULK].requests == 1
+    assert stats[INTERACTIVE].waiting == stats[BULK].waiting == 0
+
+
+def test_waiters_behind_a_failed_acquire_go_on() -> None:
+    asked = threading.Event()
+
+    class Limiter:
+        calls = 0
+
+        def try_acquire(self) -> float:
+            self.calls += 1
+            if self.calls == 1:
+                # The head waits for its token, so the others line up behind it
+                asked.set()
+                return 5.0
+            if self.calls == 2:
+                raise RuntimeError("limiter failed")
+            return 0.0
+
+    scheduler = RequestScheduler(Limiter())
+    failed = []
+
+    def head() -> None:
+        with pytest.raises(RuntimeError):
+            scheduler.acquire()
+        failed.append(True)
+
+    thread = threading.Thread(target=head, daemon=True)
+    thread.start()
+    assert asked.wait(5)
+    # The first of them wakes the head up, whose next try_acquire raises
+    waiters = [acquire_in_thread(scheduler) for _ in range(3)]
+    assert all(finished() for finished in waiters)
+    thread.join(5)
+    assert failed == [True]
+    assert scheduler.stats()[INTERACTIVE].requests == 3
@@ -0,0 +1,111 @@
+import asyncio
+from pathlib import Path
+from typing import Iterator, List, Tuple
+
+import pytest
+
+from e621.fakeserver import FakeE621Server
+from e621.watchers import Subscription, Watcher
+
+
+@pytest.fixture
+def growing_server() -> Iterator[FakeE621Server]:
+    # Tests add posts by raising post_count, so every test gets a server of its own
+    with FakeE621Server(post_count=100) as server:
+        yield server
+
+
+def make_due(watcher: Watcher) -> None:
+    for subscription in watcher.subscriptions.values():
+        subscription.next_poll = 0.0
+
+
+def test_the_first_poll_only_sets_the_high_water_mark(growing_server: FakeE621Server) -> None:
+    watcher = Watcher(growing_server.api())
+    subscription = watcher.watch_posts("all", "")
+    assert watcher.poll(subscription) == []
+    assert subscription.high_water_mark == 100
+    assert watcher.poll(subscription) == []
+
+
+@pytest.mark.parametrize("added", [1, 5, 320, 700])
+def test_polls_return_the_new_posts_oldest_first(growing_server: FakeE621Server, added: int) -> None:
+    watcher = Watcher(growing_server.api())
+    subscription = watcher.watch_posts("all", "")
+    watcher.poll(subscription)
+    growing_server.post_count += added
+    assert [post.id for post in watcher.poll(subscription)] == list(range(101, 101 + added))
+    assert subscription.high_water_mark == 100 + added
+    assert watcher.poll(subscription) == []
+
+
+def test_the_high_water_mark_moves_past_posts_that_dont_match(growing_server: FakeE621Server) -> None:
+    watcher = Watcher(growing_server.api())
+    subscription = watcher.watch_posts("rating:s", "rating:s")
+    watcher.poll(subscription)
+    growing_server.post_count += 400
+    new = watcher.poll(subscription)
+    assert new and all(post.rating == "s" and post.id > 100 for post in new)
+    assert [post.id for post in new] == sorted(post.id for post in new)
+    assert watcher.poll(subscription) == []
+
+
+def test_the_checkpoint_survives_a_restart(growing_server: FakeE621Server, tmp_path: Path) -> None:
+    checkpoint = tmp_path / "watcher.json"
+    watcher = Watcher(growing_server.api(), checkpoint, min_interval=10)
+    watcher.watch_posts("all", "")
+    watcher.watch_posts("tagged", "tag_1")
+    watcher.poll_due()
+    growing_server.post_count += 3
+
+    restarted = Watcher(growing_server.api(), checkpoint, min_interval=10)
+    subscription = restarted.watch_posts("all", "")
+    assert subscription.high_water_mark == 100
+    assert subscription.interval == 15
+    assert [post.id for post in restarted.poll(subscription)] == [101, 102, 103]
+    # Subscriptions that weren't watched again are kept in the checkpoint
+    restarted.poll_due()
+    assert set(Watcher(growing_server.api(), checkpoint)._checkpoint) == {"all", "tagged"}
+
+
+def test_intervals_adapt_to_activity(growing_server: FakeE621Server) -> None:
+    watcher = Watcher(growing_server.api(), min_interval=10, max_interval=40, backoff=2)
+    found: List[Tuple[Subscription, list]] = []
+    watcher.on_new(lambda subscription, new: found.append((subscription, new)))
+    subscription = watcher.watch_posts("all", "")
+    assert subscription.interval == 10
+    intervals = []
+    for added in (0, 0, 0, 0, 2, 1, 0):
+        growing_server.post_count += added
+        make_due(watcher)
+        watcher.poll_due()
+        intervals.append(subscription.interval)
+    assert intervals == [20, 40, 40, 40, 20, 10, 20]
+    assert [[post.id for post in new] for _, new in found] == [[101, 102], [103]]
+    assert 0 < watcher.seconds_until_next_poll() <= 20
+
+
+def test_poll_due_skips_subscriptions_that_arent_due(growing_server: FakeE621Server) -> None:
+    watcher = Watcher(growing_server.api(), min_interval=60)
+    watcher.watch_posts("all", "")
+    watcher.poll_due()
+    served = growing_server.requests_served
+    growing_server.post_count += 1
+    assert watcher.poll_due() == []
+    assert growing_server.requests_served == served
+
+
+def test_stream_yields_new_posts(growing_server: FakeE621Server) -> None:
+    watcher = Watcher(growing_server.api(), min_interval=0.01, max_interval=0.05)
+    subscription = watcher.watch_posts("all", "")
+    watcher.poll(subscription)
+    growing_server.post_count += 2
+
+    async def first() -> Tuple[Subscription, list]:
+        async for result in watcher:
+            return result
+        raise AssertionError("The stream ended")
+
+    streamed, new = asyncio.run(asyncio.wait_for(first(), 10))
+    assert streamed is subscription
+    assert [post.id for post in new] == [101, 102]